@@ -0,0 +1,299 @@
+# batch - step many headless missions at once
+#
+# For tuning AI strategies we run thousands of matches with nobody watching.  Rather than
+# walking a grid of Tile objects per mission, the batch stacks every mission's tile layers
+# into one [mission][y][x] array (flattened, mission-major) and advances shroom growth,
+# heat, and weapon timers for all of them in single passes.  Each mission keeps drawing
+# from it's own random streams, so a batched mission gives the same result as running
+# it alone.
+
+from multiprocessing import Pool
+import os
+import sys
+import time
+
+from equipment import Weapon
+from mapping import TRN_LAND, MASK_SPAWN_NO, shroomTick
+from mission import Mission
+from rng import StreamRNG
+
+
+class MissionBatch( object ):
+
+    """
+    A stack of independent missions sharing the same map dimentions.
+
+    Attributes:
+        area (int): Tiles per mission
+        count (int): Number of missions in the stack
+        dim_x (int): Map Dimention X
+        dim_y (int): Map Dimention Y
+        heat (list): Heat layer, mission-major ravel order
+        missions (list): The Missions that were stacked
+        occupancy (list): Occupancy flags layer
+        shrooms (list): Shroom layer
+        terrain (list): Terrain layer
+        ticks (int): Number of ticks the batch has been stepped
+    """
+
+    def __init__( self, missions ):
+        self.missions = list( missions )
+        self.count = len( self.missions )
+        self.ticks = 0
+
+        if( self.count < 1 ):
+            raise ValueError( "A batch needs at least one Mission" )
+
+        first = self.missions[0].field
+        self.dim_x = first.dim_x
+        self.dim_y = first.dim_y
+        self.area = self.dim_x * self.dim_y
+
+        for mission in self.missions:
+            if( (mission.field.dim_x != self.dim_x) or (mission.field.dim_y != self.dim_y) ):
+                raise ValueError( "Batched Missions must share map dimentions" )
+
+        # The stacked tile layers
+        self.terrain   = []
+        self.shrooms   = []
+        self.heat      = []
+        self.occupancy = []
+        for mission in self.missions:
+            tiles = [ tile for row in mission.field.grid for tile in row ]
+            self.terrain.extend(   tile.terrain         for tile in tiles )
+            self.shrooms.extend(   tile.shrooms         for tile in tiles )
+            self.heat.extend(      tile.heat            for tile in tiles )
+            self.occupancy.extend( tile.occupancy_flags for tile in tiles )
+
+        # Weapon timers, one slot per registered weapon
+        self._weapons  = []
+        self.w_mission = []
+        self.w_state   = []
+        self.w_count   = []
+        self.w_rof     = []
+        self.w_warmup  = []
+        self.w_cooldown = []
+
+    @classmethod
+    def fromMap( cls, map_fq, seeds ):
+        """
+        Make a batch of the same mission map, one per seed.
+
+        Args:
+            map_fq (string): fully qualified path to the mission JSON
+            seeds (list): PRNG seed for each mission
+
+        Returns:
+            MissionBatch: The batch
+        """
+        missions = []
+        for seed in seeds:
+            mission = Mission( map_fq )
+            mission.rand.seed( seed )
+            mission.rand_seed = seed
+            mission.streams = StreamRNG( seed )
+            missions.append( mission )
+
+        return cls( missions )
+
+    def addWeapon( self, mission_idx, weapon ):
+        """
+        Have the batch run this weapon's timers.
+
+        Args:
+            mission_idx (int): Which mission the weapon is fighting in
+            weapon (Weapon): The weapon
+
+        Returns:
+            int: Slot the weapon was given
+        """
+        self._weapons.append( weapon )
+        self.w_mission.append( mission_idx )
+        self.w_state.append( weapon.state )
+        self.w_count.append( weapon.count )
+        self.w_rof.append( weapon.rof )
+        self.w_warmup.append( weapon.warmup )
+        self.w_cooldown.append( weapon.cooldown )
+        return len( self._weapons ) - 1
+
+    # Stepping ###############################################################
+
+    def tick( self ):
+        """
+        Advance every mission in the batch one economy tick.
+
+        Returns:
+            list: Weapon slots that started firing this tick
+        """
+        self.growShrooms()
+        self.heatDecay()
+        fired = self.weaponTimers()
+        self.ticks += 1
+        for mission in self.missions:
+            mission.tick()
+        return fired
+
+    def run( self, ticks ):
+        """
+        Step the batch and time it.
+
+        Args:
+            ticks (int): Ticks to run
+
+        Returns:
+            float: Throughput in mission-ticks per second
+        """
+        start = time.perf_counter()
+        for _ in range( ticks ):
+            self.tick()
+        elapsed = time.perf_counter() - start
+
+        return ( self.count * ticks ) / max( elapsed, 1e-9 )
+
+    def growShrooms( self ):
+        """
+        Map.growShrooms for every mission, over the stacked layers.
+        """
+        shrooms   = self.shrooms
+        terrain   = self.terrain
+        occupancy = self.occupancy
+        dim_x = self.dim_x
+        dim_y = self.dim_y
+
+        for m_idx, mission in enumerate( self.missions ):
+            base   = m_idx * self.area
+            stop   = base + self.area
+            amount = mission.shroom_grow_amount
+            cap    = mission.shroom_cap
+
+            growing, spreads = shroomTick( mission, mission.clock.now, range( base, stop ), shrooms[ base:stop ],
+                                           lambda idx: idx - base )
+
+            for idx in growing:
+                new = shrooms[ idx ] + amount
+                shrooms[ idx ] = min( new, cap ) if( new > 0 ) else 0
+
+            for idx, dx, dy in spreads:
+                y, x = divmod( idx - base, dim_x )
+                x += dx
+                y += dy
+                if( (x >= dim_x) or (x < 0) or (y >= dim_y) or (y < 0) ):
+                    continue
+
+                target = base + x + y * dim_x
+                if( (not (occupancy[ target ] & MASK_SPAWN_NO)) and (terrain[ target ] == TRN_LAND) ):
+                    new = shrooms[ target ] + amount
+                    shrooms[ target ] = min( new, cap ) if( new > 0 ) else 0
+
+    def heatDecay( self ):
+        """
+        Map.heatDecay for every mission, over the stacked layers.
+        """
+        heat = self.heat
+        for m_idx, mission in enumerate( self.missions ):
+            base = m_idx * self.area
+            stop = base + self.area
+            decay = mission.heat_decay
+            heat[ base:stop ] = [ (h - decay) if( h > decay ) else 0 for h in heat[ base:stop ] ]
+
+    def weaponTimers( self ):
+        """
+        Weapon.tick for every registered weapon.
+
+        Returns:
+            list: Weapon slots that started firing this tick
+        """
+        fired = []
+        state = self.w_state
+        count = self.w_count
+
+        for slot in range( len( state ) ):
+            if( state[ slot ] == Weapon.STATE_WAITING ):
+                continue
+
+            count[ slot ] -= 1
+            if( count[ slot ] >= 1 ):
+                continue
+
+            if( state[ slot ] == Weapon.STATE_CHARGEUP ):
+                state[ slot ] = Weapon.STATE_FIRING
+                count[ slot ] = self.w_rof[ slot ]
+                fired.append( slot )
+
+            elif( state[ slot ] == Weapon.STATE_FIRING ):
+                state[ slot ] = Weapon.STATE_COOLING
+                count[ slot ] = self.w_cooldown[ slot ]
+
+            elif( state[ slot ] == Weapon.STATE_COOLING ):
+                state[ slot ] = Weapon.STATE_WAITING
+
+        return fired
+
+    # Results ################################################################
+
+    def syncBack( self ):
+        """
+        Write the batched state back into the missions' Tiles and Weapons, so they
+        can be inspected or carry on un-batched.
+        """
+        for m_idx, mission in enumerate( self.missions ):
+            idx = m_idx * self.area
+            for row in mission.field.grid:
+                for tile in row:
+                    tile.shrooms = self.shrooms[ idx ]
+                    tile.heat = self.heat[ idx ]
+                    idx += 1
+
+        for slot, weapon in enumerate( self._weapons ):
+            weapon.state = self.w_state[ slot ]
+            weapon.count = self.w_count[ slot ]
+            if( weapon.state != Weapon.STATE_FIRING ):
+                weapon.target = None
+
+
+def _runShard( args ):
+    map_fq, seeds, ticks = args
+    batch = MissionBatch.fromMap( map_fq, seeds )
+    start = time.perf_counter()
+    for _ in range( ticks ):
+        batch.tick()
+    return ( len( seeds ) * ticks, time.perf_counter() - start )
+
+
+def benchmark( map_fq, num_missions, ticks, workers=1 ):
+    """
+    Run _num_missions_ copies of a map for _ticks_, sharded across worker processes.
+
+    Args:
+        map_fq (string): fully qualified path to the mission JSON
+        num_missions (int): Missions to run
+        ticks (int): Ticks to run each for
+        workers (int): Processes (cores) to use
+
+    Returns:
+        float: mission-ticks per second per core
+    """
+    seeds = list( range( num_missions ) )
+    shards = [ ( map_fq, seeds[ i::workers ], ticks ) for i in range( workers ) ]
+    shards = [ shard for shard in shards if shard[1] ]
+
+    if( len( shards ) == 1 ):
+        results = [ _runShard( shards[0] ) ]
+    else:
+        with Pool( len( shards ) ) as pool:
+            results = pool.map( _runShard, shards )
+
+    total = sum( done for done, _ in results )
+    busy = sum( elapsed for _, elapsed in results )
+    return total / max( busy, 1e-9 )
+
+
+if( __name__ == "__main__" ):
+    # batch.py [map] [missions] [ticks] [workers]
+    map_fq  = sys.argv[1] if( len( sys.argv ) > 1 ) else "test_map.json"
+    num     = int( sys.argv[2] ) if( len( sys.argv ) > 2 ) else 100
+    ticks   = int( sys.argv[3] ) if( len( sys.argv ) > 3 ) else 100
+    workers = int( sys.argv[4] ) if( len( sys.argv ) > 4 ) else ( os.cpu_count() or 1 )
+
+    rate = benchmark( map_fq, num, ticks, workers )
+    print( "{} missions x {} ticks on {} cores: {:.0f} mission-ticks/s/core".format( num, ticks, workers, rate ) )
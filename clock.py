@@ -0,0 +1,87 @@
+# clock - the game tick, and a scheduler for things that need to happen on a future tick
+#
+# Everything in the simulation is measured in GAME TICKS (assumed 15tps).  Work that
+# has to land on a known tick (AI orders, build completion, batched updates) is
+# scheduled here, so the order it happens in is deterministic.
+
+import heapq
+
+
+class Clock( object ):
+
+    """
+    The mission clock.  Callbacks scheduled for the same tick run in the order
+    they were scheduled.
+
+    Attributes:
+        now (int): The current game tick
+    """
+
+    def __init__( self ):
+        self.now = 0
+
+        # heap of [tick, seq, callback, args], seq breaks ties in scheduling order
+        self._queue = []
+        self._seq = 0
+
+    def schedule( self, tick, callback, *args ):
+        """
+        Run _callback_ on the given tick.  Ticks in the past run on the next advance.
+
+        Args:
+            tick (int): Tick to run on
+            callback (callable): Thing to do
+            args: Passed to the callback
+
+        Returns:
+            list: Handle that can be passed to cancel()
+        """
+        entry = [ tick, self._seq, callback, args ]
+        self._seq += 1
+        heapq.heappush( self._queue, entry )
+        return entry
+
+    def scheduleIn( self, delay, callback, *args ):
+        """
+        Run _callback_ _delay_ ticks from now.
+
+        Args:
+            delay (int): Ticks to wait
+            callback (callable): Thing to do
+            args: Passed to the callback
+
+        Returns:
+            list: Handle that can be passed to cancel()
+        """
+        return self.schedule( self.now + delay, callback, *args )
+
+    def cancel( self, handle ):
+        """
+        Stop a scheduled callback from running.  It's left in the heap and skipped.
+
+        Args:
+            handle (list): As returned by schedule()
+        """
+        handle[2] = None
+
+    def advance( self ):
+        """
+        Step the clock forward one tick, and run everything that is due.
+
+        Returns:
+            int: The new tick
+        """
+        self.now += 1
+        while( self._queue and self._queue[0][0] <= self.now ):
+            _, _, callback, args = heapq.heappop( self._queue )
+            if( callback is not None ):
+                callback( *args )
+
+        return self.now
+
+    def pending( self ):
+        """
+        Returns:
+            int: Number of callbacks waiting to run (including cancelled ones)
+        """
+        return len( self._queue )
@@ -0,0 +1,265 @@
+# commands - hand FRAGOs out to the units
+#
+# Orders arrive far faster than units can act on them: repeated right-clicks, the AI
+# re-targeting every decision, orders to a whole squad.  Each Commandable queues it's
+# own orders most urgent first, replacing waiting orders of the same kind, and the
+# Dispatcher starts at most _budget_ of them a tick, so order spam can't blow up the
+# tick time.  What doesn't fit waits for the next tick.
+
+import heapq
+
+
+# Urgency, in order of precedence
+URG_ROUTINE   = 0
+URG_PRIORITY  = 1
+URG_IMMEDIATE = 2
+URG_FLASH     = 3
+
+# Kinds of order
+CMD_MOVE    = "move"
+CMD_ATTACK  = "attack"
+CMD_GUARD   = "guard"
+CMD_PATROL  = "patrol"
+CMD_STOP    = "stop"
+
+
+class Frago( object ):
+
+    """
+    A Fragmentary Order, simplified.  Orders are shared between the units they go to, so
+    don't change one once it's issued.
+
+    Attributes:
+        coordination (TBD): Who else is involved, eg. the Squad
+        issued (int): Game tick the order was given
+        kind (string): CMD_XXX, a waiting order of the same kind is replaced by this one.
+            None never replaces anything
+        target (Coord/Entity): Where or who
+        tasks (list): Details for the unit
+        urgency (int): URG_XXX
+    """
+
+    def __init__( self, kind, target=None, urgency=URG_ROUTINE, tasks=None, coordination=None, issued=0 ):
+        self.kind = kind
+        self.target = target
+        self.urgency = urgency
+        self.tasks = tasks
+        self.coordination = coordination
+        self.issued = issued
+
+    def __repr__( self ):
+        return "Frago({}, {}, urgency={})".format( self.kind, self.target, self.urgency )
+
+
+class Dispatcher( object ):
+
+    """
+    Starts waiting orders on Commandables, a bounded number per tick.  The most urgent
+    go first, and units waiting at the same urgency go in turn, one order each a tick.
+
+    Orders broadcast to a squad are started together, so a squad doesn't set off in
+    halves.  A squad that doesn't fit in what's left of the tick's budget waits for the
+    next tick, one bigger than the whole budget is started a budget's worth a tick.  The
+    budget is never overrun.
+
+    Attributes:
+        budget (int): Orders to start per tick
+        coalesced (int): Orders replaced before they were started
+        executed (int): Orders started
+        issued (int): Orders given to units
+    """
+
+    def __init__( self, budget=256 ):
+        self.budget = budget
+
+        self.issued = 0
+        self.coalesced = 0
+        self.executed = 0
+
+        # heap of [ -urgency, seq, batch, unit ], stale once the unit's _tokens seq moves on
+        self._waiting = []
+        self._tokens = {}
+        self._seq = 0
+        self._batch = None
+        # batch -> ids of the units still waiting in it
+        self._batches = {}
+
+        self._handle = None
+
+    # Registration ###########################################################
+
+    def register( self, unit ):
+        """
+        Send this unit's orders through the dispatcher.
+
+        Args:
+            unit (Commandable): The unit
+        """
+        unit.dispatcher = self
+        if( unit.urgency() is not None ):
+            self.waiting( unit )
+
+    def unregister( self, unit ):
+        """
+        Forget a unit, eg. it was destroyed.  Orders it's still waiting on are dropped.
+
+        Args:
+            unit (Commandable): The unit
+        """
+        if( unit.dispatcher is self ):
+            unit.dispatcher = None
+        self._leave( id( unit ) )
+
+    def waiting( self, unit ):
+        """
+        A unit's queue changed, make sure it's waiting at the right urgency.  Called by
+        Commandable.frago.
+
+        Args:
+            unit (Commandable): The unit
+        """
+        key = id( unit )
+        urgency = unit.urgency()
+        batch = self._batch
+        if( urgency is None ):
+            self._leave( key )
+            return
+
+        token = self._tokens.get( key )
+        if( (token is not None) and (token[0] == urgency) and ((batch is None) or (token[2] == batch)) ):
+            # Already waiting at this urgency, keep it's place.  Unless a broadcast is
+            # being issued, then it goes with the rest of the squad
+            return
+
+        self._leave( key )
+        self._tokens[ key ] = ( urgency, self._seq, batch )
+        if( batch is not None ):
+            self._batches.setdefault( batch, set() ).add( key )
+        heapq.heappush( self._waiting, [ -urgency, self._seq, batch, unit ] )
+        self._seq += 1
+
+    def _leave( self, key ):
+        token = self._tokens.pop( key, None )
+        if( (token is not None) and (token[2] is not None) ):
+            members = self._batches[ token[2] ]
+            members.discard( key )
+            if( not members ):
+                del self._batches[ token[2] ]
+
+    # Issuing ################################################################
+
+    def issue( self, unit, command ):
+        """
+        Give a unit an order.
+
+        Args:
+            unit (Commandable): The unit
+            command (Frago): The order
+        """
+        if( unit.dispatcher is not self ):
+            self.register( unit )
+
+        self.issued += 1
+        if( unit.frago( command ) ):
+            self.coalesced += 1
+
+    def broadcast( self, squad, command ):
+        """
+        Give every member of a squad the same order.
+
+        Args:
+            squad (Squad/list): The squad, or a list of units
+            command (Frago): The order
+        """
+        members = getattr( squad, "members", squad )
+        self._batch = self._seq
+        try:
+            for unit in members:
+                self.issue( unit, command )
+        finally:
+            self._batch = None
+
+    # Processing #############################################################
+
+    def dispatch( self, budget=None ):
+        """
+        Start the most urgent waiting orders.
+
+        Args:
+            budget (int): Orders to start, defaults to self.budget
+
+        Returns:
+            int: Orders started
+        """
+        if( budget is None ):
+            budget = self.budget
+
+        waiting = self._waiting
+        tokens = self._tokens
+        batches = self._batches
+        started = 0
+        last_batch = None
+        again = []
+
+        while( waiting and (started < budget) ):
+            neg_urgency, seq, batch, unit = waiting[0]
+            token = tokens.get( id( unit ) )
+            if( (token is None) or (token[1] != seq) ):
+                # Superseded, or the unit was unregistered
+                heapq.heappop( waiting )
+                continue
+
+            if( (batch is not None) and (batch != last_batch) ):
+                size = len( batches[ batch ] )
+                if( (started + size > budget) and (size <= budget) ):
+                    # The squad fits in a whole tick, wait for one
+                    break
+
+            heapq.heappop( waiting )
+            self._leave( id( unit ) )
+            command = unit.nextOrder()
+            if( command is not None ):
+                unit.obey( command )
+                started += 1
+            last_batch = batch
+
+            if( unit.urgency() is not None ):
+                again.append( unit )
+
+        for unit in again:
+            # More to do next tick, back of the line at it's next urgency
+            self.waiting( unit )
+
+        self.executed += started
+        return started
+
+    def pending( self ):
+        """
+        Returns:
+            int: Units with orders waiting to start
+        """
+        return len( self._tokens )
+
+    def start( self, clock ):
+        """
+        Dispatch on every tick of the clock.
+
+        Args:
+            clock (Clock): The mission clock
+        """
+        self._handle = clock.scheduleIn( 1, self._tick, clock )
+
+    def stop( self, clock ):
+        """
+        Stop dispatching on the clock.
+
+        Args:
+            clock (Clock): The mission clock
+        """
+        if( self._handle is not None ):
+            clock.cancel( self._handle )
+            self._handle = None
+
+    def _tick( self, clock ):
+        self.dispatch()
+        self._handle = clock.scheduleIn( 1, self._tick, clock )
@@ -4,11 +4,171 @@
 # there is also a fractional 'sub-coordinate' system, say to move dudes around inside a tile
 # 
 
+from bisect import bisect_right
 from collections import OrderedDict
 import math
 import random
 
 
+# tan( 22.5 degrees ), the edge between compass points.  sqrt( 2 ) - 1, written out so
+# it doesn't depend on the platform's libm.
+_TAN_OCTANT_FLOAT = 0.41421356237309503
+
+
+def quantizedAtan2( east, north ):
+    """
+    Compass point heading of a vector, without working out the angle.  Compares the
+    vector against the octant edges instead, so there's no trig at all.
+
+    Args:
+        east (float): Distance East (+x)
+        north (float): Distance North (-y)
+
+    Returns:
+        float: nearest compass point heading
+    """
+    a_e = abs( east )
+    a_n = abs( north )
+    if( a_e <= a_n * _TAN_OCTANT_FLOAT ):
+        # Along the North / South axis
+        return 0. if( north >= 0 ) else 180.
+    if( a_n <= a_e * _TAN_OCTANT_FLOAT ):
+        # Along the East / West axis
+        return 90. if( east >= 0 ) else 270.
+    if( north >= 0 ):
+        return 45. if( east >= 0 ) else 315.
+    return 135. if( east >= 0 ) else 225.
+
+
+
+
+# Fixed point ##################################################################
+#
+# Floats can come out differently on different machines, which is no good for lockstep
+# play.  FixedCoord works in integer sub-cell units, with trig from lookup tables in
+# whole degrees, so moves are bit-identical everywhere.  A Mission with fixed_point set
+# makes it's entities with fixedPoint().
+
+SUB_SHIFT = 8
+SUB_CELL  = 1 << SUB_SHIFT # sub-cell units per tile
+
+TRIG_SHIFT = 14
+TRIG_ONE   = 1 << TRIG_SHIFT
+TRIG_HALF  = 1 << ( TRIG_SHIFT - 1 )
+
+# sin( 0..90 degrees ) * TRIG_ONE, rounded.  Written out rather than computed so the
+# table doesn't depend on the platform's libm.
+_QUARTER_SINE = (
+        0,   286,   572,   857,  1143,  1428,  1713,  1997,  2280,  2563,
+     2845,  3126,  3406,  3686,  3964,  4240,  4516,  4790,  5063,  5334,
+     5604,  5872,  6138,  6402,  6664,  6924,  7182,  7438,  7692,  7943,
+     8192,  8438,  8682,  8923,  9162,  9397,  9630,  9860, 10087, 10311,
+    10531, 10749, 10963, 11174, 11381, 11585, 11786, 11982, 12176, 12365,
+    12551, 12733, 12911, 13085, 13255, 13421, 13583, 13741, 13894, 14044,
+    14189, 14330, 14466, 14598, 14726, 14849, 14968, 15082, 15191, 15296,
+    15396, 15491, 15582, 15668, 15749, 15826, 15897, 15964, 16026, 16083,
+    16135, 16182, 16225, 16262, 16294, 16322, 16344, 16362, 16374, 16382,
+    16384,
+)
+
+# tan( 0.5..44.5 degrees ) * TRIG_ONE, rounded.  The edges between whole degrees.
+_TAN_EDGES = (
+      143,   429,   715,  1002,  1289,  1578,  1867,  2157,  2449,  2742,
+     3037,  3333,  3632,  3933,  4237,  4544,  4853,  5166,  5482,  5802,
+     6126,  6454,  6786,  7124,  7467,  7815,  8169,  8529,  8896,  9270,
+     9651, 10040, 10438, 10844, 11260, 11687, 12124, 12572, 13032, 13506,
+    13993, 14495, 15013, 15548, 16101,
+)
+
+
+def _sineDeg( deg ):
+    if( deg <= 90 ):
+        return _QUARTER_SINE[ deg ]
+    if( deg <= 180 ):
+        return _QUARTER_SINE[ 180 - deg ]
+    if( deg <= 270 ):
+        return -_QUARTER_SINE[ deg - 180 ]
+    return -_QUARTER_SINE[ 360 - deg ]
+
+
+SIN_LUT = tuple( _sineDeg( deg ) for deg in range( 360 ) )
+COS_LUT = tuple( SIN_LUT[ ( deg + 90 ) % 360 ] for deg in range( 360 ) )
+
+# ( sin, cos ) per degree, one lookup per move
+_SIN_COS = tuple( zip( SIN_LUT, COS_LUT ) )
+
+# tan * TRIG_ONE -> whole degrees, for the first octant.  One index instead of a search
+# of _TAN_EDGES.
+_OCTANT_DEG = bytes( bisect_right( _TAN_EDGES, tan ) for tan in range( TRIG_ONE + 1 ) )
+
+# tan( 22.5 degrees ) * TRIG_ONE, the edge between compass points
+_TAN_OCTANT = 6786
+
+
+def atan2Deg( east, north ):
+    """
+    Integer heading of a vector, octant by octant from the tangent table.
+
+    Args:
+        east (int): Distance East (+x)
+        north (int): Distance North (-y)
+
+    Returns:
+        int: Heading in whole degrees 0..359 - North = 0, clockwise
+    """
+    a_e = abs( east )
+    a_n = abs( north )
+    if( a_e == 0 and a_n == 0 ):
+        return 0
+
+    if( a_e <= a_n ):
+        ang = _OCTANT_DEG[ ( a_e << TRIG_SHIFT ) // a_n ]
+    else:
+        ang = 90 - _OCTANT_DEG[ ( a_n << TRIG_SHIFT ) // a_e ]
+
+    if( north >= 0 ):
+        return ang if( east >= 0 ) else ( 360 - ang ) % 360
+    return ( 180 - ang ) if( east >= 0 ) else ( 180 + ang )
+
+
+def quantizedAtan2Deg( east, north ):
+    """
+    Compass point heading of a vector, without working out the angle.
+
+    Args:
+        east (int): Distance East (+x)
+        north (int): Distance North (-y)
+
+    Returns:
+        int: nearest compass point heading
+    """
+    a_e = abs( east ) << TRIG_SHIFT
+    a_n = abs( north ) << TRIG_SHIFT
+    if( a_e <= abs( north ) * _TAN_OCTANT ):
+        # Along the North / South axis
+        return 0 if( north >= 0 ) else 180
+    if( a_n <= abs( east ) * _TAN_OCTANT ):
+        # Along the East / West axis
+        return 90 if( east >= 0 ) else 270
+    if( north >= 0 ):
+        return 45 if( east >= 0 ) else 315
+    return 135 if( east >= 0 ) else 225
+
+
+def quantizeDeg( angle ):
+    """
+    Integer Coord.quantizeHeading.
+
+    Args:
+        angle (int): Heading in whole degrees, can be > 360
+
+    Returns:
+        int: nearest compass point heading
+    """
+    return ( ( ( angle % 360 ) + 22 ) // 45 % 8 ) * 45
+
+
+
 class Coord( object ):
 
     HEADING = OrderedDict(
@@ -28,7 +188,7 @@ class Coord( object ):
     HALF_PI = math.pi / 2.
 
 
-    __init__( self, x=0., y=0. ):
+    def __init__( self, x=0., y=0. ):
         self.x = x
         self.y = y
 
@@ -72,7 +232,7 @@ class Coord( object ):
             distance (float): distance in coord units (cell.sub-cell)
         """
         self.x += math.sin( math.radians(heading) ) * distance
-        self.y += math.cos( math.radians(heading) ) * distance
+        self.y -= math.cos( math.radians(heading) ) * distance
 
     def suggestRando( self, distance ):
         """
@@ -89,7 +249,7 @@ class Coord( object ):
         return new_pos
 
     @classmethod
-    def quantizeHeading( angle ):
+    def quantizeHeading( cls, angle ):
         """
         Lock the supplied angle to one of the compass headings we know about
         
@@ -100,10 +260,10 @@ class Coord( object ):
             float: nearest compass point from HEADING
         """
         test = (angle % 360) - 22.5
-        for direction in self.HEADING.values():
+        for direction in cls.HEADING.values():
             if( test < direction ):
                 return direction
-        return HEADING["N"]
+        return cls.HEADING["N"]
 
     def headingTo( self, position ):
         """
@@ -131,6 +291,217 @@ class Coord( object ):
         Returns:
             float: compass point to bring us close
         """
-        return self.quantizeHeading( self.headingTo( position ) )
+        return quantizedAtan2( position.x - self.x, self.y - position.y )
+
+
+
+class FixedCoord( Coord ):
+
+    """
+    Coord in integer sub-cell units, SUB_CELL to a tile.  Headings are whole degrees,
+    distances are sub-cell units.  x and y read and write in tiles for compatibility,
+    but the truth is in fx and fy.  Mix it into an Entity class with fixedPoint().
+
+    Attributes:
+        fx (int): X in sub-cell units
+        fy (int): Y in sub-cell units
+    """
+
+    def __init__( self, x=0, y=0 ):
+        super( FixedCoord, self ).__init__()
+        self.fx = int( round( x * SUB_CELL ) )
+        self.fy = int( round( y * SUB_CELL ) )
+
+    @property
+    def x( self ):
+        return self.fx / SUB_CELL
+
+    @x.setter
+    def x( self, val ):
+        self.fx = int( round( val * SUB_CELL ) )
+
+    @property
+    def y( self ):
+        return self.fy / SUB_CELL
+
+    @y.setter
+    def y( self, val ):
+        self.fy = int( round( val * SUB_CELL ) )
+
+    def distanceSq( self, other ):
+        """
+        Args:
+            other (FixedCoord): The other coordinate
+
+        Returns:
+            int: squared distance to the other coordinate, in sub-cell units
+        """
+        dx = self.fx - other.fx
+        dy = self.fy - other.fy
+        return (dx*dx + dy*dy)
+
+    def distanceTo( self, other ):
+        """
+        Args:
+            other (FixedCoord): The other coordinate
+
+        Returns:
+            int: distance to other coordinate, in sub-cell units, rounded down
+        """
+        dx = self.fx - other.fx
+        dy = self.fy - other.fy
+        # sqrt is correctly rounded everywhere, and exact enough to floor right for
+        # squares under 2**52, 60 thousand tiles
+        return int( math.sqrt( dx*dx + dy*dy ) )
+
+    def asCellPos( self ):
+        """
+        Return x,y as ints so they can index an array
+
+        Returns:
+            tuple: x and y as ints
+        """
+        return ( self.fx >> SUB_SHIFT, self.fy >> SUB_SHIFT, )
+
+    def vector( self, heading, distance ):
+        """
+        Move this coord _distance_ along _heading_
+
+        Args:
+            heading (int): Angle in whole degrees - North = 0, clockwise incremental rotation
+            distance (int): distance in sub-cell units
+        """
+        sin, cos = _SIN_COS[ heading % 360 ]
+        self.fx += ( sin * distance + TRIG_HALF ) >> TRIG_SHIFT
+        self.fy -= ( cos * distance + TRIG_HALF ) >> TRIG_SHIFT
+
+    def suggestRando( self, distance ):
+        """
+        Suggest a Random location _distance_ away from this coord's current position.
+
+        Args:
+            distance (int): distance away, in sub-cell units
+
+        Returns:
+            FixedCoord: New coordinate randomly away from self's position
+        """
+        new_pos = FixedCoord()
+        new_pos.fx = self.fx
+        new_pos.fy = self.fy
+        new_pos.vector( random.randrange( 360 ), distance )
+        return new_pos
+
+    @classmethod
+    def quantizeHeading( cls, angle ):
+        """
+        Lock the supplied angle to one of the compass headings we know about
+
+        Args:
+            angle (int): an angle in whole degrees, can be > 360
+
+        Returns:
+            int: nearest compass point from HEADING
+        """
+        return quantizeDeg( int( angle ) )
+
+    def headingTo( self, position ):
+        """
+        Get the angle from this coord to the position
+
+        Args:
+            position (FixedCoord): Place we want to inspect
+
+        Returns:
+            int: angle to the position, in whole degrees
+        """
+        return atan2Deg( position.fx - self.fx, self.fy - position.fy )
+
+    def headingToQnt( self, position ):
+        """
+        Get the Quantized Heading to some position
+
+        Args:
+            position (FixedCoord): opsition we're heading to
+
+        Returns:
+            int: compass point to bring us close
+        """
+        return quantizedAtan2Deg( position.fx - self.fx, self.fy - position.fy )
+
+
+_FIXED_CLASSES = {}
+
+
+def fixedPoint( cls ):
+    """
+    The fixed point version of a Coord subclass, eg. an Entity class.  The new class has
+    the same name, so saves and snapshots don't care which was used.
+
+    Args:
+        cls (class): Coord subclass
+
+    Returns:
+        class: cls with FixedCoord's positions and maths
+    """
+    if( issubclass( cls, FixedCoord ) ):
+        return cls
+    fixed = _FIXED_CLASSES.get( cls )
+    if( fixed is None ):
+        fixed = type( cls.__name__, ( FixedCoord, cls ), { "__module__": cls.__module__ } )
+        _FIXED_CLASSES[ cls ] = fixed
+    return fixed
+
+
+if( __name__ == "__main__" ):
+    import timeit
+
+    # Benchmark the float path against fixed point
+    number = 200000
+
+    a = Coord( 10.5, 20.25 )
+    b = Coord( 3.0, 7.75 )
+    fa = FixedCoord( 10.5, 20.25 )
+    fb = FixedCoord( 3.0, 7.75 )
+
+    tests = (
+        ( "vector",     lambda: a.vector( 45., 0.1 ),   lambda: fa.vector( 45, 26 ) ),
+        ( "headingTo",  lambda: a.headingTo( b ),       lambda: fa.headingTo( fb ) ),
+        ( "headingQnt", lambda: a.quantizeHeading( a.headingTo( b ) ), lambda: fa.headingToQnt( fb ) ),
+        ( "distanceTo", lambda: a.distanceTo( b ),      lambda: fa.distanceTo( fb ) ),
+    )
+
+    for name, float_fn, fixed_fn in tests:
+        t_float = timeit.timeit( float_fn, number=number )
+        t_fixed = timeit.timeit( fixed_fn, number=number )
+        print( "{: <12} float {:6.1f}ns  fixed {:6.1f}ns  x{:.2f}".format(
+            name, t_float / number * 1e9, t_fixed / number * 1e9, t_float / t_fixed ) )
+
+    t_float = timeit.timeit( lambda: a.quantizeHeading( a.headingTo( b ) ), number=number )
+    t_octant = timeit.timeit( lambda: a.headingToQnt( b ), number=number )
+    print( "float headingToQnt by octant x{:.2f}".format( t_float / t_octant ) )
+
+    # The float octant test should agree with quantizing the float heading, and the
+    # integer maths with it's float equivalent, but for vectors right on an edge
+    rng = random.Random( 1 )
+    differ = 0
+    worst = 0
+    for _ in range( 100000 ):
+        probe = Coord( rng.uniform( -50., 50. ), rng.uniform( -50., 50. ) )
+        if( a.headingToQnt( probe ) != a.quantizeHeading( a.headingTo( probe ) ) ):
+            differ += 1
+        f_probe = FixedCoord( probe.x, probe.y )
+        err = abs( ( fa.headingTo( f_probe ) - a.headingTo( probe ) + 180 ) % 360 - 180 )
+        worst = max( worst, err )
+        if( fa.distanceTo( f_probe ) != math.isqrt( fa.distanceSq( f_probe ) ) ):
+            differ += 1
+    print( "disagreements in 100000 random headings and distances: {}".format( differ ) )
+    print( "worst integer heading error: {:.2f} degrees".format( worst ) )
 
-        
\ No newline at end of file
+    # Worst error of the integer heading against the float one
+    worst = 0.
+    for deg in range( 0, 3600 ):
+        probe = FixedCoord( 0, 0 )
+        probe.vector( deg // 10, SUB_CELL * 64 )
+        err = abs( ( FixedCoord().headingTo( probe ) - ( deg // 10 ) + 180 ) % 360 - 180 )
+        worst = max( worst, err )
+    print( "worst heading round trip error: {} degrees".format( worst ) )
@@ -0,0 +1,316 @@
+# economy - a faction's money, power, and production, as running totals
+#
+# Rather than walking every building each tick to find the power balance, the Ledger
+# keeps totals that are updated when something is built, lost, or harvested, so the HUD
+# and the AI can ask about the economy for free however big the base gets.  Builds are
+# queued and paid for as money allows, and finish on the mission clock.
+
+from collections import deque
+
+from entities import Structure
+
+
+class BuildJob( object ):
+
+    """
+    Something waiting to be built, or being built.
+
+    Attributes:
+        cost (int): Price, paid when the build starts
+        done (callable): Called with the entity when it's finished
+        entity (Entity): What's being built
+        finish (int): Tick it'll be finished, None if it hasn't started
+    """
+
+    def __init__( self, entity, done=None ):
+        self.entity = entity
+        self.cost = entity.cost
+        self.done = done
+        self.finish = None
+        self._handle = None
+
+
+class Ledger( object ):
+
+    """
+    Running totals of a faction's economy.
+
+    Builds take twice as long while the faction is short of power.
+
+    A Ledger made for a faction from a loaded save picks up the saved build queue and
+    harvests from faction.ledger_state.  The done callbacks of saved builds are lost.
+
+    Attributes:
+        clock (Clock): The mission clock
+        consumed (int): Power drawn by the faction's buildings
+        faction (Faction): Whose books these are
+        lines (int): Builds that can be in progress at once
+        pending_cost (int): Cost of queued builds that haven't been paid for
+        produced (int): Power made by the faction's buildings
+        window (int): Ticks the harvest income is averaged over
+    """
+
+    def __init__( self, faction, clock, window=15 * 30, lines=1 ):
+        self.faction = faction
+        self.clock = clock
+        self.window = window
+        self.lines = lines
+
+        self.produced = 0
+        self.consumed = 0
+        for building in faction.buildings:
+            self.produced += building.power_output
+            self.consumed += building.power_draw
+
+        # harvest per tick over the last _window_ ticks, a ring indexed by tick
+        self._harvest = [ 0 ] * window
+        self._harvest_total = 0
+        self._harvest_tick = clock.now
+
+        self.pending_cost = 0
+        self._queue = deque()
+        self._building = []
+
+        faction.ledger = self
+        self._updatePower()
+
+        if( faction.ledger_state is not None ):
+            self._restore( faction.ledger_state )
+            faction.ledger_state = None
+
+    # Events #################################################################
+
+    def built( self, entity ):
+        """
+        Something joined the faction, built or captured.
+
+        Args:
+            entity (Entity): The new arrival
+        """
+        entity.alegiance = self.faction
+        if( isinstance( entity, Structure ) ):
+            self.faction.buildings.append( entity )
+            self.produced += entity.power_output
+            self.consumed += entity.power_draw
+            self._updatePower()
+        else:
+            self.faction.units.append( entity )
+
+    def lost( self, entity ):
+        """
+        Something left the faction, destroyed, sold or captured.
+
+        Args:
+            entity (Entity): The departed
+        """
+        if( isinstance( entity, Structure ) ):
+            if( entity in self.faction.buildings ):
+                self.faction.buildings.remove( entity )
+                self.produced -= entity.power_output
+                self.consumed -= entity.power_draw
+                self._updatePower()
+        elif( entity in self.faction.units ):
+            self.faction.units.remove( entity )
+
+    def harvested( self, amount ):
+        """
+        A harvester dropped off it's load.
+
+        Args:
+            amount (int): Money earned
+        """
+        self._roll()
+        self._harvest[ self.clock.now % self.window ] += amount
+        self._harvest_total += amount
+        self.faction.money += amount
+        self._startBuilds()
+
+    def spend( self, amount ):
+        """
+        Pay for something outside the build queue, if the faction can afford it.
+
+        Args:
+            amount (int): Price
+
+        Returns:
+            bool: True if it was paid for
+        """
+        if( amount > self.faction.money ):
+            return False
+        self.faction.money -= amount
+        return True
+
+    # Production #############################################################
+
+    def queueBuild( self, entity, done=None ):
+        """
+        Add something to the build queue.  It starts once there's a free line and the
+        money to pay for it.
+
+        Args:
+            entity (Entity): What to build, with it's cost and build_time set
+            done (callable): Called with the entity when it's finished
+
+        Returns:
+            BuildJob: Handle that can be passed to cancel()
+        """
+        job = BuildJob( entity, done )
+        self._queue.append( job )
+        self.pending_cost += job.cost
+        self._startBuilds()
+        return job
+
+    def cancel( self, job ):
+        """
+        Stop a build, refunding it if it was already paid for.
+
+        Args:
+            job (BuildJob): As returned by queueBuild()
+        """
+        if( job.finish is None ):
+            if( job in self._queue ):
+                self._queue.remove( job )
+                self.pending_cost -= job.cost
+            return
+
+        if( job in self._building ):
+            self.clock.cancel( job._handle )
+            self._building.remove( job )
+            self.faction.money += job.cost
+            job.finish = None
+            self._startBuilds()
+
+    def _startBuilds( self ):
+        queue = self._queue
+        while( queue and (len( self._building ) < self.lines) and (queue[0].cost <= self.faction.money) ):
+            job = queue.popleft()
+            self.pending_cost -= job.cost
+            self.faction.money -= job.cost
+
+            ticks = job.entity.build_time
+            if( self.lowPower() ):
+                ticks *= 2
+            job.finish = self.clock.now + ticks
+            job._handle = self.clock.schedule( job.finish, self._finished, job )
+            self._building.append( job )
+
+    def _finished( self, job ):
+        self._building.remove( job )
+        self.built( job.entity )
+        if( job.done is not None ):
+            job.done( job.entity )
+        self._startBuilds()
+
+    # Queries ################################################################
+
+    def balance( self ):
+        """
+        Returns:
+            int: Power spare, negative when short
+        """
+        return self.produced - self.consumed
+
+    def lowPower( self ):
+        """
+        Returns:
+            bool: The faction's buildings want more power than it makes
+        """
+        return self.consumed > self.produced
+
+    def income( self ):
+        """
+        Returns:
+            float: Harvest money per tick, over the last _window_ ticks
+        """
+        self._roll()
+        return self._harvest_total / self.window
+
+    def spendable( self ):
+        """
+        Returns:
+            int: Money left once the queued builds are paid for
+        """
+        return self.faction.money - self.pending_cost
+
+    def queued( self ):
+        """
+        Returns:
+            int: Builds waiting to start
+        """
+        return len( self._queue )
+
+    def inProgress( self ):
+        """
+        Returns:
+            list: BuildJobs being built
+        """
+        return list( self._building )
+
+    # Saving #################################################################
+
+    def state( self ):
+        """
+        What a save needs to rebuild the ledger, see _restore().
+
+        Returns:
+            dict: "queued" list of entities waiting to be built, "building" list of
+                ( entity, finish tick ) paid for and being built, "harvest" list of
+                ( tick, amount ) harvests in the window
+        """
+        self._roll()
+        now = self.clock.now
+        harvest = []
+        for tick in range( now - self.window + 1, now + 1 ):
+            amount = self._harvest[ tick % self.window ]
+            if( amount ):
+                harvest.append( ( tick, amount ) )
+
+        return {
+            "queued"   : [ job.entity for job in self._queue ],
+            "building" : [ ( job.entity, job.finish ) for job in self._building ],
+            "harvest"  : harvest,
+        }
+
+    def _restore( self, state ):
+        """
+        Pick up where a saved ledger left off.  Builds in progress were paid for before
+        the save, so they just finish on the tick they were going to.
+
+        Args:
+            state (dict): As from state()
+        """
+        for entity, finish in state[ "building" ]:
+            job = BuildJob( entity )
+            job.finish = finish
+            job._handle = self.clock.schedule( finish, self._finished, job )
+            self._building.append( job )
+
+        for entity in state[ "queued" ]:
+            job = BuildJob( entity )
+            self._queue.append( job )
+            self.pending_cost += job.cost
+
+        now = self.clock.now
+        for tick, amount in state[ "harvest" ]:
+            if( now - self.window < tick <= now ):
+                self._harvest[ tick % self.window ] += amount
+                self._harvest_total += amount
+
+        self._startBuilds()
+
+    # Bookkeeping ############################################################
+
+    def _updatePower( self ):
+        self.faction.power = self.produced - self.consumed
+
+    def _roll( self ):
+        """
+        Forget harvests that have fallen out of the window.
+        """
+        now = self.clock.now
+        stale = min( now - self._harvest_tick, self.window )
+        for tick in range( now - stale + 1, now + 1 ):
+            slot = tick % self.window
+            self._harvest_total -= self._harvest[ slot ]
+            self._harvest[ slot ] = 0
+        self._harvest_tick = now
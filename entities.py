@@ -1,36 +1,56 @@
 # factions - the players and AI
 # entities - Base class, and superclasses of all units
 
+import heapq
+
 from coord import Coord
+from mapping import TRN_LAND
 
 
 class Faction( object ):
 
     """
     A Faction at war in the battlefield.  This could be a Human or computer Player.
+
+    PLANNER_STATE names the attributes prosecute() keeps between decisions, eg. the
+    enemy it's picked and the battle phase.  They're copied to the planner, and the
+    planner's values are copied back when it's orders are issued.  Subclasses extend it.
     
     Attributes:
+        ai_budget (int): Planning steps the 'AI' gets per decision, see prosecute
         buildings (list): All buildings controlled by this faction
+        is_ai (bool): Is this faction run by the computer
+        ledger (Ledger): Running totals of the economy, see economy.Ledger
+        ledger_state (dict): A loaded save's build queue and harvests, for the next
+            Ledger made, see economy.Ledger
         money (int): Resources to buy buildings and units.
         name (string): Name
         power (int): Power to run buildings
-        squads (TBD): Groups of units, allows coordination, and inter-unit comms
+        squads (list): Groups of units, allows coordination, and inter-unit comms, see squads.Squad
         tech_level (int): what's the max level we can build.
         units (list): All units controlled by this faction
     """
     
+    PLANNER_STATE = ()
+
     def __init__( self, name ):
         self.name = name
 
         # Faction capabilities
         self.tech_level = 0
 
+        # 'AI' players think off the simulation thread, see strategy.StrategyPool
+        self.is_ai = False
+        self.ai_budget = 100
+
         # "In America, first you get the Mushrooms, then you get the Power, then you get the Women."
         self.money = 0
         self.power = 0
+        self.ledger = None
+        self.ledger_state = None
 
         # Combat
-        self.squads = None
+        self.squads = []
 
         # Managment
         self.buildings = []
@@ -54,7 +74,7 @@ class Faction( object ):
         """
         pass
 
-    def prosecute( self ):
+    def prosecute( self, snapshot ):
         """
         Prosecute war against the OpFor.
         For 'AI' players this is a State machine to chose:
@@ -63,8 +83,33 @@ class Faction( object ):
             Next Phase
 
         Then execute strategies to move to the next phase.
+
+        This runs in a worker process, on a copy of the faction made from it's class
+        and name (see strategy.StrategyPool), so it can only know what's in the snapshot
+        and the PLANNER_STATE it left last time.  Set PLANNER_STATE attributes to carry
+        the state machine on to the next decision.
+
+        It's a generator, planning in steps.  Each yield ends a step, and gives the
+        orders decided in it.  The planner gets ai_budget steps, then it's stopped and
+        the orders it's given so far are issued, so decide the important things first.
+        Counting steps, not time, means it plans the same however fast the machine is.
+
+        Args:
+            snapshot (WorldSnapshot): Read-only picture of the battlefield
+
+        Yields:
+            list: of ( entity id, Frago ) orders to issue, see commands.Frago
         """
-        pass
+        yield []
+
+    def entityLUT( self ):
+        """
+        Returns:
+            dict: entity id to the entity, for all units and buildings
+        """
+        lut = { ent.id: ent for ent in self.buildings }
+        lut.update( { ent.id: ent for ent in self.units } )
+        return lut
 
 
 """
@@ -83,6 +128,8 @@ class Entity( Coord ):
         alegiance (faction): Faction commanding this entity
         altitude (int): Hight above ground level, suppose could be below sea level for submarines
         armour (Armour): Type of armour (needs to be a matrix of Wepon vs Armour )
+        build_time (int): Ticks it takes to build
+        cost (int): Money it takes to build
         grudge_list (TBD): list of Factions and or units that have done this entity damage.
         heat (int): Heat signature of the unit
         hit_points (int): Life
@@ -98,7 +145,7 @@ class Entity( Coord ):
     """
     
     def __init__( self ):
-        super( Entity, self ).__init__( self )
+        super( Entity, self ).__init__()
 
         # Managment
         self.id = -1
@@ -106,6 +153,10 @@ class Entity( Coord ):
         self.is_destructable = False
         self.alegiance = None
 
+        # Production
+        self.cost = 0
+        self.build_time = 0
+
         # Drawing
         self.sprite = None
 
@@ -180,14 +231,23 @@ class Commandable( Entity ):
     A Unit that a faction could issue commands to
     
     Attributes:
-        command_queue (TBD): List of commands to execute
+        command_queue (list): heap of [ -urgency, seq, frago ] waiting to be carried out
+        dispatcher (Dispatcher): Hands out this unit's orders, see commands.Dispatcher
+        order (Frago): The order being carried out
     """
     
     def __init__( self ):
-        super( Commandable, self ).__init__( self )
+        super( Commandable, self ).__init__()
 
         # commandable attrs
-        self.command_queue = None
+        self.command_queue = []
+        self.order = None
+        self.dispatcher = None
+
+        # kind -> waiting queue entry, for replacing superseded orders
+        self._standing = {}
+        self._order_seq = 0
+        self._dead = 0
 
     def frago( self, command ):
         """
@@ -197,12 +257,79 @@ class Commandable( Entity ):
             Mission
             Tasks
             Coordination
-        Need to simplify a bit for use here.
+        Need to simplify a bit for use here, see commands.Frago.
+
+        The order waits in the command_queue, most urgent first.  An order of the same
+        kind as one still waiting replaces it, so spamming orders doesn't pile them up.
         
         Args:
-            command (list-like): Encapsulation of the Frago
+            command (Frago): Encapsulation of the Frago
+
+        Returns:
+            bool: True if it replaced a waiting order
         """
-        pass
+        entry = [ -command.urgency, self._order_seq, command ]
+        self._order_seq += 1
+
+        replaced = False
+        if( command.kind is not None ):
+            old = self._standing.get( command.kind )
+            if( old is not None ):
+                old[2] = None
+                self._dead += 1
+                replaced = True
+            self._standing[ command.kind ] = entry
+
+        heapq.heappush( self.command_queue, entry )
+        if( self._dead * 2 > len( self.command_queue ) ):
+            # Mostly superseded orders, throw them out
+            self.command_queue = [ e for e in self.command_queue if e[2] is not None ]
+            heapq.heapify( self.command_queue )
+            self._dead = 0
+
+        if( self.dispatcher is not None ):
+            self.dispatcher.waiting( self )
+
+        return replaced
+
+    def urgency( self ):
+        """
+        Returns:
+            int: Urgency of the next order, None if there isn't one
+        """
+        queue = self.command_queue
+        while( queue and queue[0][2] is None ):
+            heapq.heappop( queue )
+            self._dead -= 1
+
+        return -queue[0][0] if( queue ) else None
+
+    def nextOrder( self ):
+        """
+        Take the most urgent waiting order off the queue.
+
+        Returns:
+            Frago: The order, None if there isn't one
+        """
+        if( self.urgency() is None ):
+            return None
+
+        entry = heapq.heappop( self.command_queue )
+        command = entry[2]
+        if( self._standing.get( command.kind ) is entry ):
+            del self._standing[ command.kind ]
+        return command
+
+    def obey( self, command ):
+        """
+        ## Implementer Overide ##
+
+        Start carrying out an order.
+
+        Args:
+            command (Frago): The order
+        """
+        self.order = command
 
     def tact_XXX( self ):
         """
@@ -219,25 +346,37 @@ class Commandable( Entity ):
         """
         pass
 
-     def tick( self, clock ):
+    def tick( self, clock ):
         super( Commandable, self ).tick( clock )
 
-class Structure( Commanable ):
+class Structure( Commandable ):
     """
     A building, this could be a dumb Powerplant/Farm, a Factory, or Defensive.
 
     I quite like the Starcraft metaphor that the factory has the buttons to build units,
     rather than the C&C sidebar where all the options get lost off the end.
+
+    Attributes:
+        native (int): Terrain the building must be placed on, docks go on water
+        power_draw (int): Power it needs to run
+        power_output (int): Power it makes, for Powerplants
     """
 
     def __init__( self ):
-        super( Structure, self ).__init__( self )
+        super( Structure, self ).__init__()
+
+        # Placement
+        self.native = TRN_LAND
+
+        # Power
+        self.power_output = 0
+        self.power_draw = 0
 
     def tick( self, clock ):
         super( Structure, self ).tick( clock )
 
 
-class Moveable( Commanable ):
+class Moveable( Commandable ):
     """
     Something that can move about.
 
@@ -247,7 +386,7 @@ class Moveable( Commanable ):
     """
     
     def __init__( self ):
-        super( Moveable, self ).__init__( self )
+        super( Moveable, self ).__init__()
 
         # Movement
         self.speed = 0
@@ -274,7 +413,7 @@ class Moveable( Commanable ):
         pass
 
     def tick( self, clock ):
-        super( Structure, self ).tick( clock )
+        super( Moveable, self ).tick( clock )
 
         
 class Infantry( Moveable ):
@@ -283,7 +422,7 @@ class Infantry( Moveable ):
     """
     
     def __init__( self ):
-        super( Infantry, self ).__init__( self )
+        super( Infantry, self ).__init__()
 
     def tick( self, clock ):
         super( Infantry, self ).tick( clock )
@@ -295,7 +434,7 @@ class Mechanized( Moveable ):
     """
     
     def __init__( self ):
-        super( Mechanized, self ).__init__( self )
+        super( Mechanized, self ).__init__()
 
     def tick( self, clock ):
         super( Mechanized, self ).tick( clock )
@@ -307,7 +446,7 @@ class Aircraft( Moveable ):
     """
     
     def __init__( self ):
-        super( Aircraft, self ).__init__( self )
+        super( Aircraft, self ).__init__()
 
     def tick( self, clock ):
         super( Aircraft, self ).tick( clock )
@@ -319,7 +458,7 @@ class Vessel( Moveable ):
     """
     
     def __init__( self ):
-        super( Vessel, self ).__init__( self )
+        super( Vessel, self ).__init__()
 
     def tick( self, clock ):
         super( Vessel, self ).tick( clock )
\ No newline at end of file
@@ -2,7 +2,11 @@
 #
 # Projectile, Weapon, and Armour models
 
+import math
+import zlib
+
 import coord
+from rng import SUB_WEAPONS
 
 
 class Weapon( object ):
@@ -26,6 +30,7 @@ class Weapon( object ):
         # Shots to fire
         self.rof = 0 # Burst rpm?
         self.range = 0 # in map tiles
+        self.dispersion = 0. # radius shots land within, in map tiles
 
         # Times between shots/bursts in GAME TICKS (assumed 15tps)
         self.warmup = 0 # delay before ready to fire
@@ -65,8 +70,8 @@ class Weapon( object ):
         if( self.state == Weapon.STATE_WAITING ):
             return
 
-        count -= 1
-        if( count < 1 ):
+        self.count -= 1
+        if( self.count < 1 ):
             # Cycle state
             if( self.state == Weapon.STATE_CHARGEUP ):
                 # ready to fire
@@ -88,6 +93,31 @@ class Weapon( object ):
         # make a projectile and shoot it at self.target
         pass
 
+    def scatter( self, streams, tick ):
+        """
+        Where a shot fired this tick lands, relative to the aim point.  Drawn from the
+        mission's counter based streams keyed on the owner and weapon, so it doesn't
+        matter what order the weapons fire in.  Integer headings keep it the same on
+        every machine.
+
+        Args:
+            streams (StreamRNG): The mission's random streams
+            tick (int): Game tick
+
+        Returns:
+            tuple: ( dx, dy ) offset in map tiles
+        """
+        if( self.dispersion <= 0. ):
+            return ( 0., 0. )
+
+        key = self.owner.id
+        n = zlib.crc32( self.name.encode( "utf-8" ) ) << 1
+        heading = streams.randbelow( 360, tick, SUB_WEAPONS, key, n )
+        # sqrt, so shots are even over the disc, not bunched in the middle
+        dist = self.dispersion * math.sqrt( streams.random( tick, SUB_WEAPONS, key, n + 1 ) )
+        return ( coord.SIN_LUT[ heading ] * dist / coord.TRIG_ONE,
+                 -coord.COS_LUT[ heading ] * dist / coord.TRIG_ONE )
+
 
 class Projectile( object ):
     """
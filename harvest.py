@@ -0,0 +1,223 @@
+# harvest - help harvesters find the shrooms
+#
+# Harvesters constantly ask "where's the nearest shrooms I can drive to?".  Rather than
+# search per harvester, we keep a multi-source BFS distance field seeded from every tile
+# with shrooms on it, over the passable terrain.  It's patched as shrooms spawn and get
+# eaten, so any harvester can look up it's nearest field, and which way is downhill to
+# it, in O(1).
+
+from collections import deque
+import heapq
+
+from mapping import Map, LYR_SHROOMS, LYR_TERRAIN, LYR_OCCUPANCY
+
+
+UNREACHABLE = -1
+
+
+class ShroomDistanceField( object ):
+
+    """
+    Distance, in tile steps (8-connected), from every tile to the nearest reachable tile
+    with shrooms on it.  Registers itself as a watcher of the map.
+
+    Attributes:
+        dim_x (int): Map Dimention X
+        dim_y (int): Map Dimention Y
+        field (Map): The map
+    """
+
+    # ( dx, dy ) in the order of Map.COMPASS_POINTS
+    STEPS = tuple( Map.NEIGHBORS[ point ] for point in Map.COMPASS_POINTS )
+
+    def __init__( self, field ):
+        self.field = field
+        self.dim_x = field.dim_x
+        self.dim_y = field.dim_y
+
+        self._dist = []
+        self._src = []
+        self._passable = []
+        self._stale = True
+        self.rebuild()
+
+        field.addWatcher( self )
+
+    def close( self ):
+        """
+        Stop watching the map.
+        """
+        self.field.removeWatcher( self )
+
+    def _neighbors( self, idx ):
+        y, x = divmod( idx, self.dim_x )
+        for dx, dy in self.STEPS:
+            nx = x + dx
+            ny = y + dy
+            if( (0 <= nx < self.dim_x) and (0 <= ny < self.dim_y) ):
+                yield nx + ny * self.dim_x
+
+    def rebuild( self ):
+        """
+        Recompute the whole field from scratch.  Done when passable terrain changes.
+        """
+        tiles = [ tile for row in self.field.grid for tile in row ]
+        self._passable = [ tile.isPassable() for tile in tiles ]
+        self._dist = [ UNREACHABLE ] * len( tiles )
+        self._src = [ UNREACHABLE ] * len( tiles )
+
+        frontier = deque()
+        for idx, tile in enumerate( tiles ):
+            if( self._passable[ idx ] and (tile.shrooms > 0) ):
+                self._dist[ idx ] = 0
+                self._src[ idx ] = idx
+                frontier.append( idx )
+
+        self._spread( frontier )
+        self._stale = False
+
+    def _spread( self, frontier ):
+        """
+        BFS out from the frontier, improving any distances we can.
+
+        Args:
+            frontier (deque): ravel ids whose distance is final, nearest first
+        """
+        dist = self._dist
+        src = self._src
+        passable = self._passable
+        while( frontier ):
+            idx = frontier.popleft()
+            step = dist[ idx ] + 1
+            for n_idx in self._neighbors( idx ):
+                if( not passable[ n_idx ] ):
+                    continue
+                if( (dist[ n_idx ] == UNREACHABLE) or (dist[ n_idx ] > step) ):
+                    dist[ n_idx ] = step
+                    src[ n_idx ] = src[ idx ]
+                    frontier.append( n_idx )
+
+    def _addSource( self, idx ):
+        self._dist[ idx ] = 0
+        self._src[ idx ] = idx
+        self._spread( deque( ( idx, ) ) )
+
+    def _removeSource( self, idx ):
+        dist = self._dist
+        src = self._src
+
+        # Everything that was fed by this source, they're connected through it's BFS tree
+        orphans = { idx }
+        todo = [ idx ]
+        while( todo ):
+            for n_idx in self._neighbors( todo.pop() ):
+                if( (src[ n_idx ] == idx) and (n_idx not in orphans) ):
+                    orphans.add( n_idx )
+                    todo.append( n_idx )
+
+        for o_idx in orphans:
+            dist[ o_idx ] = UNREACHABLE
+            src[ o_idx ] = UNREACHABLE
+
+        # Refill the hole from it's edges, which are at differing distances
+        edge = []
+        for o_idx in orphans:
+            for n_idx in self._neighbors( o_idx ):
+                if( dist[ n_idx ] != UNREACHABLE ):
+                    edge.append( ( dist[ n_idx ], n_idx ) )
+        heapq.heapify( edge )
+
+        while( edge ):
+            d, e_idx = heapq.heappop( edge )
+            if( d != dist[ e_idx ] ):
+                continue
+            step = d + 1
+            for n_idx in self._neighbors( e_idx ):
+                if( not self._passable[ n_idx ] ):
+                    continue
+                if( (dist[ n_idx ] == UNREACHABLE) or (dist[ n_idx ] > step) ):
+                    dist[ n_idx ] = step
+                    src[ n_idx ] = src[ e_idx ]
+                    heapq.heappush( edge, ( step, n_idx ) )
+
+    def tileChanged( self, tile, layer, old ):
+        """
+        Map watcher callback, patch the field as shrooms appear and vanish.
+        """
+        if( (layer == LYR_TERRAIN) or (layer == LYR_OCCUPANCY) ):
+            idx = tile.ravel_id
+            if( (not self._stale) and (self._passable[ idx ] != tile.isPassable()) ):
+                # Roads opened or closed, start again when next asked
+                self._stale = True
+            return
+
+        if( (layer != LYR_SHROOMS) or self._stale ):
+            return
+
+        idx = tile.ravel_id
+        if( not self._passable[ idx ] ):
+            return
+
+        if( (old <= 0) and (tile.shrooms > 0) ):
+            self._addSource( idx )
+
+        elif( (old > 0) and (tile.shrooms <= 0) ):
+            self._removeSource( idx )
+
+    # Queries ################################################################
+
+    def distance( self, x, y ):
+        """
+        Args:
+            x (int): X coord
+            y (int): Y coord
+
+        Returns:
+            int: Steps to the nearest shrooms, UNREACHABLE if there's none
+        """
+        if( self._stale ):
+            self.rebuild()
+        return self._dist[ x + y * self.dim_x ]
+
+    def nearest( self, x, y ):
+        """
+        Args:
+            x (int): X coord
+            y (int): Y coord
+
+        Returns:
+            tuple: ( x, y, steps ) of the nearest reachable shrooms, None if there's none
+        """
+        if( self._stale ):
+            self.rebuild()
+        idx = x + y * self.dim_x
+        src = self._src[ idx ]
+        if( src == UNREACHABLE ):
+            return None
+        sy, sx = divmod( src, self.dim_x )
+        return ( sx, sy, self._dist[ idx ] )
+
+    def downhill( self, x, y ):
+        """
+        Which way to go to get one step closer to the shrooms.
+
+        Args:
+            x (int): X coord
+            y (int): Y coord
+
+        Returns:
+            string: Compass point from Map.COMPASS_POINTS, None if we're on them or
+                there's none reachable
+        """
+        here = self.distance( x, y )
+        if( here < 1 ):
+            return None
+
+        for point, ( dx, dy ) in zip( Map.COMPASS_POINTS, self.STEPS ):
+            nx = x + dx
+            ny = y + dy
+            if( (0 <= nx < self.dim_x) and (0 <= ny < self.dim_y) and
+                (self._dist[ nx + ny * self.dim_x ] == here - 1) ):
+                return point
+
+        return None
@@ -0,0 +1,290 @@
+# influence - who controls which bit of the battlefield
+#
+# Every unit and structure stamps it's strength onto it's faction's influence layer
+# through a distance-decay kernel.  When something moves (or is hurt) only it's old
+# stamp is taken off and the new one put on, so the layers are never recomputed
+# wholesale.  Faction.prosecute uses them to find the front, safe routes, and soft
+# targets.  Stamps are integer so adding and removing them never drifts.
+
+import heapq
+import math
+
+from mapping import Map
+
+
+# Kernel weight at the centre, weights fall off linearly to 0 past the radius
+INF_SCALE = 256
+
+# Size of the blocks cluster strength is totalled in
+CLUSTER_CHUNK = 8
+
+
+def strengthOf( entity ):
+    """
+    How much an entity counts for.
+
+    Args:
+        entity (Entity): The entity
+
+    Returns:
+        int: Strength, at least 1
+    """
+    return max( int( entity.hit_points ), 1 )
+
+
+class InfluenceMap( object ):
+
+    """
+    Per faction influence layers over a Map.
+
+    Attributes:
+        dim_x (int): Map Dimention X
+        dim_y (int): Map Dimention Y
+        field (Map): The map
+        radius (int): Reach of a stamp, in tiles
+    """
+
+    def __init__( self, field, radius=6 ):
+        self.field = field
+        self.dim_x = field.dim_x
+        self.dim_y = field.dim_y
+        self.radius = radius
+
+        area = self.dim_x * self.dim_y
+
+        # ( dx, dy, weight ) of the stamp
+        self._kernel = []
+        for dy in range( -radius, radius + 1 ):
+            for dx in range( -radius, radius + 1 ):
+                dist = math.hypot( dx, dy )
+                if( dist <= radius ):
+                    weight = int( INF_SCALE * ( 1. - dist / ( radius + 1 ) ) )
+                    self._kernel.append( ( dx, dy, weight ) )
+
+        # faction name -> influence per tile
+        self._layers = {}
+        self._total = [ 0 ] * area
+        # faction name -> tiles where it and it's enemies are both strong
+        self._contested = {}
+        # faction name -> { chunk ravel: strength }
+        self._clusters = {}
+
+        # entity id -> ( faction name, x, y, strength )
+        self._stamps = {}
+
+    def _layer( self, name ):
+        layer = self._layers.get( name )
+        if( layer is None ):
+            layer = [ 0 ] * ( self.dim_x * self.dim_y )
+            self._layers[ name ] = layer
+            self._contested[ name ] = set()
+            self._clusters[ name ] = {}
+        return layer
+
+    # Stamping ###############################################################
+
+    def update( self, entity ):
+        """
+        Put an entity on it's faction's layer, or move it's stamp if it's changed cell
+        or strength.  Call when it moves, is hurt, or is built.
+
+        Args:
+            entity (Entity): Entity with an alegiance and unique id
+        """
+        x, y = entity.asCellPos()
+        stamp = ( entity.alegiance.name, x, y, strengthOf( entity ) )
+        old = self._stamps.get( entity.id )
+        if( old == stamp ):
+            return
+
+        if( old is not None ):
+            self._stamp( old, -1 )
+        self._stamps[ entity.id ] = stamp
+        self._stamp( stamp, 1 )
+
+    def remove( self, entity ):
+        """
+        Take an entity off the map, eg. it's been destroyed.
+
+        Args:
+            entity (Entity): The entity
+        """
+        old = self._stamps.pop( entity.id, None )
+        if( old is not None ):
+            self._stamp( old, -1 )
+
+    def updateFaction( self, faction ):
+        """
+        update() every unit and building of a faction.
+
+        Args:
+            faction (Faction): The faction
+        """
+        for entity in faction.buildings:
+            self.update( entity )
+        for entity in faction.units:
+            self.update( entity )
+
+    def _stamp( self, stamp, sign ):
+        name, cx, cy, strength = stamp
+        layer = self._layer( name )
+        total = self._total
+        dim_x = self.dim_x
+        dim_y = self.dim_y
+        touched = []
+
+        for dx, dy, weight in self._kernel:
+            x = cx + dx
+            y = cy + dy
+            if( (x < 0) or (y < 0) or (x >= dim_x) or (y >= dim_y) ):
+                continue
+            idx = x + y * dim_x
+            delta = sign * weight * strength
+            layer[ idx ] += delta
+            total[ idx ] += delta
+            touched.append( idx )
+
+        clusters = self._clusters[ name ]
+        chunk = ( cx // CLUSTER_CHUNK ) + ( cy // CLUSTER_CHUNK ) * self._chunksX()
+        clusters[ chunk ] = clusters.get( chunk, 0 ) + sign * strength
+        if( clusters[ chunk ] == 0 ):
+            del clusters[ chunk ]
+
+        self._updateContested( touched )
+
+    def _chunksX( self ):
+        return -(-self.dim_x // CLUSTER_CHUNK)
+
+    def _updateContested( self, cells ):
+        total = self._total
+        for name, layer in self._layers.items():
+            contested = self._contested[ name ]
+            for idx in cells:
+                own = layer[ idx ]
+                threat = total[ idx ] - own
+                if( (own > 0) and (threat > 0) and (abs( own - threat ) * 2 <= own + threat) ):
+                    # Within a factor of 3 of each other
+                    contested.add( idx )
+                else:
+                    contested.discard( idx )
+
+    # Queries ################################################################
+
+    def influenceAt( self, name, x, y ):
+        """
+        Args:
+            name (string): Faction name
+            x (int): X coord
+            y (int): Y coord
+
+        Returns:
+            int: The faction's influence on the tile
+        """
+        return self._layer( name )[ x + y * self.dim_x ]
+
+    def threatAt( self, name, x, y ):
+        """
+        Args:
+            name (string): Faction name
+            x (int): X coord
+            y (int): Y coord
+
+        Returns:
+            int: Everyone else's influence on the tile
+        """
+        idx = x + y * self.dim_x
+        return self._total[ idx ] - self._layer( name )[ idx ]
+
+    def frontline( self, name ):
+        """
+        Tiles where the faction and it's enemies are evenly matched.
+
+        Args:
+            name (string): Faction name
+
+        Returns:
+            list: ( x, y ) of the contested tiles
+        """
+        self._layer( name )
+        return [ ( idx % self.dim_x, idx // self.dim_x ) for idx in sorted( self._contested[ name ] ) ]
+
+    def weakestEnemyCluster( self, name ):
+        """
+        The enemy concentration with the least strength in it.
+
+        Args:
+            name (string): Faction name, whose enemies we're looking at
+
+        Returns:
+            tuple: ( enemy name, x, y, strength ) with x, y the top left of the cluster's
+                block, None if there's no enemies
+        """
+        best = None
+        chunks_x = self._chunksX()
+        for enemy in sorted( self._clusters ):
+            if( enemy == name ):
+                continue
+            for chunk, strength in self._clusters[ enemy ].items():
+                if( (best is None) or (strength < best[3]) ):
+                    cy, cx = divmod( chunk, chunks_x )
+                    best = ( enemy, cx * CLUSTER_CHUNK, cy * CLUSTER_CHUNK, strength )
+        return best
+
+    def safestPath( self, name, start, goal, threat_weight=1. ):
+        """
+        A* over passable land, where a step costs more the more threatened the tile is.
+
+        Args:
+            name (string): Faction name
+            start (tuple): ( x, y ) cell
+            goal (tuple): ( x, y ) cell
+            threat_weight (float): Extra cost of a step per INF_SCALE of threat
+
+        Returns:
+            tuple: ( path, cost ), path is a list of ( x, y ) cells from start to goal,
+                ( None, None ) if the goal can't be reached
+        """
+        dim_x = self.dim_x
+        dim_y = self.dim_y
+        layer = self._layer( name )
+        total = self._total
+        grid = self.field.grid
+        steps = [ Map.NEIGHBORS[ point ] for point in Map.COMPASS_POINTS ]
+        gx, gy = goal
+
+        def guess( x, y ):
+            return max( abs( x - gx ), abs( y - gy ) )
+
+        start_idx = start[0] + start[1] * dim_x
+        best = { start_idx: 0. }
+        came_from = {}
+        todo = [ ( guess( *start ), 0., start_idx ) ]
+        while( todo ):
+            _, cost, idx = heapq.heappop( todo )
+            if( cost > best.get( idx, cost ) ):
+                continue
+            y, x = divmod( idx, dim_x )
+            if( (x == gx) and (y == gy) ):
+                path = [ ( x, y ) ]
+                while( idx in came_from ):
+                    idx = came_from[ idx ]
+                    path.append( ( idx % dim_x, idx // dim_x ) )
+                path.reverse()
+                return ( path, cost )
+
+            for dx, dy in steps:
+                nx = x + dx
+                ny = y + dy
+                if( (nx < 0) or (ny < 0) or (nx >= dim_x) or (ny >= dim_y) ):
+                    continue
+                if( not grid[ ny ][ nx ].isPassable() ):
+                    continue
+                n_idx = nx + ny * dim_x
+                threat = max( total[ n_idx ] - layer[ n_idx ], 0 )
+                n_cost = cost + 1. + threat_weight * threat / INF_SCALE
+                if( n_cost < best.get( n_idx, n_cost + 1. ) ):
+                    best[ n_idx ] = n_cost
+                    came_from[ n_idx ] = idx
+                    heapq.heappush( todo, ( n_cost + guess( nx, ny ), n_cost, n_idx ) )
+
+        return ( None, None )
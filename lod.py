@@ -0,0 +1,396 @@
+# lod - run the environment less often where nothing is happening
+#
+# On a big map most of the ground has no units on it and nobody looking at it, but
+# growShrooms and heatDecay would still visit every tile every tick.  The map is split into
+# chunks: HOT chunks have units in them and run every tick, WARM chunks are next to the
+# action or being watched and run every few ticks, COLD chunks run every _cold_every_
+# ticks.  A chunk that runs late catches up all the ticks it missed in one go, and is
+# caught up straight away when it's promoted.
+#
+# Catching up a chunk replays the ticks it missed, but only for the tiles over the grow or
+# spread limit, the rest of the map just sits there until shrooms spread onto it.  Heat is
+# closed form, max( 0, heat - decay * n ).  Each replayed tick is decided by
+# mapping.shroomTick, like Map.growShrooms, and spreads into a chunk that hasn't been
+# stepped that far yet wait for it, so inside a chunk the result is the same as stepping every tick.  The
+# only difference is shrooms spreading into a chunk that has already been stepped past
+# that tick, they're added late, with the growth the tile missed since, but it doesn't
+# spread from them until it's next stepped.
+
+from operator import attrgetter
+
+from mapping import LYR_OCCUPANCY, OCY_COMMANDABLE, shroomTick
+
+
+# Levels of detail
+LOD_COLD = 0
+LOD_WARM = 1
+LOD_HOT  = 2
+
+# Size of the chunks
+LOD_CHUNK = 16
+
+
+class LODManager( object ):
+
+    """
+    Steps shroom growth and heat decay chunk by chunk, as often as each chunk deserves.
+    Use it in place of calling Map.growShrooms and Map.heatDecay every tick.
+
+    Attributes:
+        catch_ups (int): Chunk catch ups done, over the lifetime of the manager
+        chunk (int): Chunk size in tiles
+        chunks_x (int): Chunks across the map
+        chunks_y (int): Chunks down the map
+        cold_every (int): Ticks between steps of a COLD chunk
+        field (Map): The map
+        mission (Mission): The mission
+        warm_every (int): Ticks between steps of a WARM chunk
+    """
+
+    def __init__( self, mission, chunk=LOD_CHUNK, warm_every=2, cold_every=16 ):
+        self.mission = mission
+        self.field = mission.field
+        self.chunk = chunk
+        self.warm_every = warm_every
+        self.cold_every = cold_every
+        self.catch_ups = 0
+
+        field = self.field
+        self.chunks_x = ( field.dim_x + chunk - 1 ) // chunk
+        self.chunks_y = ( field.dim_y + chunk - 1 ) // chunk
+        count = self.chunks_x * self.chunks_y
+
+        self._tiles = [ [] for _ in range( count ) ]
+        for row in field.grid:
+            for tile in row:
+                self._tiles[ self._chunkOf( *tile.pos ) ].append( tile )
+
+        # Tiles with units on, per chunk, and the same summed over the chunk and it's neighbours
+        self._units = [ 0 ] * count
+        self._near = [ 0 ] * count
+        # Observers looking at each chunk
+        self._viewed = [ 0 ] * count
+
+        self._level = [ LOD_COLD ] * count
+        self._hot = set()
+        self._warm = set()
+
+        # Last tick each chunk has been stepped to
+        self._now = mission.clock.now - 1
+        self._done = [ self._now ] * count
+        # chunk -> { tick: [ tiles ] } spread onto it by chunks that were stepped first
+        self._pending = {}
+
+        for tiles in self._tiles:
+            for tile in tiles:
+                if( tile.occupancy_flags & OCY_COMMANDABLE ):
+                    self._addUnits( tile, 1 )
+
+        field.addWatcher( self )
+        self._handle = None
+
+    def _chunkOf( self, x, y ):
+        return ( x // self.chunk ) + ( y // self.chunk ) * self.chunks_x
+
+    def close( self ):
+        """
+        Stop watching the map.
+        """
+        self.field.removeWatcher( self )
+
+    # Classification #########################################################
+
+    def tileChanged( self, tile, layer, old ):
+        """
+        Map watcher callback, notice units arriving and leaving.
+        """
+        if( layer != LYR_OCCUPANCY ):
+            return
+
+        was = bool( old & OCY_COMMANDABLE )
+        now = bool( tile.occupancy_flags & OCY_COMMANDABLE )
+        if( was != now ):
+            self._addUnits( tile, 1 if( now ) else -1 )
+
+    def _addUnits( self, tile, delta ):
+        c_x = tile.pos[0] // self.chunk
+        c_y = tile.pos[1] // self.chunk
+        self._units[ c_x + c_y * self.chunks_x ] += delta
+
+        for n_y in range( max( c_y - 1, 0 ), min( c_y + 2, self.chunks_y ) ):
+            for n_x in range( max( c_x - 1, 0 ), min( c_x + 2, self.chunks_x ) ):
+                idx = n_x + n_y * self.chunks_x
+                self._near[ idx ] += delta
+                self._classify( idx )
+
+    def observe( self, x0, y0, x1, y1 ):
+        """
+        Something is watching this area, a player's view or a spectator, keep it WARM.
+
+        Args:
+            x0 (int): Left, in tiles
+            y0 (int): Top
+            x1 (int): Right, exclusive
+            y1 (int): Bottom, exclusive
+
+        Returns:
+            tuple: Handle to pass to unobserve()
+        """
+        handle = ( max( x0, 0 ) // self.chunk, max( y0, 0 ) // self.chunk,
+                   min( ( max( x1, 1 ) - 1 ) // self.chunk + 1, self.chunks_x ),
+                   min( ( max( y1, 1 ) - 1 ) // self.chunk + 1, self.chunks_y ) )
+        self._view( handle, 1 )
+        return handle
+
+    def unobserve( self, handle ):
+        """
+        Stop watching an area.
+
+        Args:
+            handle (tuple): As returned by observe()
+        """
+        self._view( handle, -1 )
+
+    def _view( self, handle, delta ):
+        c_x0, c_y0, c_x1, c_y1 = handle
+        for c_y in range( c_y0, c_y1 ):
+            for c_x in range( c_x0, c_x1 ):
+                idx = c_x + c_y * self.chunks_x
+                self._viewed[ idx ] += delta
+                self._classify( idx )
+
+    def _classify( self, idx ):
+        if( self._units[ idx ] ):
+            level = LOD_HOT
+        elif( self._near[ idx ] or self._viewed[ idx ] ):
+            level = LOD_WARM
+        else:
+            level = LOD_COLD
+
+        old = self._level[ idx ]
+        if( level == old ):
+            return
+
+        if( level > old ):
+            # Promoted, bring it up to date before it runs faster
+            self._catchUp( idx, self._now )
+
+        self._hot.discard( idx )
+        self._warm.discard( idx )
+        if( level == LOD_HOT ):
+            self._hot.add( idx )
+        elif( level == LOD_WARM ):
+            self._warm.add( idx )
+        self._level[ idx ] = level
+
+    # Queries ################################################################
+
+    def levelAt( self, x, y ):
+        """
+        Args:
+            x (int): Tile X
+            y (int): Tile Y
+
+        Returns:
+            int: LOD_XXX of the chunk the tile is in
+        """
+        return self._level[ self._chunkOf( x, y ) ]
+
+    def counts( self ):
+        """
+        Returns:
+            tuple: ( hot, warm, cold ) chunk counts
+        """
+        hot = len( self._hot )
+        warm = len( self._warm )
+        return ( hot, warm, len( self._level ) - hot - warm )
+
+    # Stepping ###############################################################
+
+    def step( self, tick=None ):
+        """
+        Grow and cool the map for this tick.  HOT chunks step now, others step if
+        they're due, catching up what they missed.
+
+        Args:
+            tick (int): Game tick, defaults to the mission clock
+        """
+        if( tick is None ):
+            tick = self.mission.clock.now
+
+        for idx in sorted( self._hot ):
+            self._catchUp( idx, tick )
+
+        for idx in sorted( self._warm ):
+            if( tick - self._done[ idx ] >= self.warm_every ):
+                self._catchUp( idx, tick )
+
+        # A slice of the map each tick, so each chunk comes round every cold_every ticks
+        level = self._level
+        for idx in range( tick % self.cold_every, len( level ), self.cold_every ):
+            if( level[ idx ] == LOD_COLD ):
+                self._catchUp( idx, tick )
+
+        self._now = tick
+
+    def flush( self ):
+        """
+        Bring every chunk up to date, eg. before saving or publishing the whole map.
+        """
+        for idx in range( len( self._level ) ):
+            self._catchUp( idx, self._now )
+
+    def _catchUp( self, idx, tick ):
+        """
+        Apply all the ticks a chunk missed, up to and including _tick_, in one go.
+
+        Args:
+            idx (int): The chunk
+            tick (int): Tick to bring it up to
+        """
+        start = self._done[ idx ]
+        missed = tick - start
+        if( missed <= 0 ):
+            return
+        self._done[ idx ] = tick
+        self.catch_ups += 1
+
+        mission = self.mission
+        amount = mission.shroom_grow_amount
+        grow_limit = mission.shroom_grow_limit
+        spread_limit = mission.shroom_spread_limit
+        quiet = min( grow_limit, spread_limit )
+        tiles = self._tiles[ idx ]
+
+        drop = mission.heat_decay * missed
+        for tile in tiles:
+            if( tile.heat > 0 ):
+                tile.heat -= drop
+
+        # Tiles at or under both limits don't do anything until something spreads onto them
+        active = [ tile for tile in tiles if( tile.shrooms > quiet ) ]
+        arrivals = self._pending.pop( idx, {} )
+        if( (not active) and (not arrivals) ):
+            return
+
+        ravel_id = attrgetter( "ravel_id" )
+        for now in range( start + 1, tick + 1 ):
+            if( active ):
+                growing, spreads = shroomTick( mission, now, active, [ tile.shrooms for tile in active ], ravel_id )
+
+                for tile in growing:
+                    tile.shrooms += amount
+
+                woken = []
+                for tile, dx, dy in spreads:
+                    target = tile.accessOffset( ( dx, dy ) )
+                    if( target is not None ):
+                        self._arrive( target, now, idx, woken )
+                active.extend( woken )
+
+            # Spread on from neighbouring chunks that were stepped past this tick first
+            for target in arrivals.pop( now, () ):
+                if( target.shroomCanSpawn() ):
+                    quiet_before = target.shrooms <= quiet
+                    target.shrooms += amount
+                    if( quiet_before and (target.shrooms > quiet) ):
+                        active.append( target )
+
+        if( arrivals ):
+            self._pending[ idx ] = arrivals
+
+    def _arrive( self, target, now, idx, woken ):
+        """
+        Shrooms spread onto _target_ on tick _now_, from a tile in chunk _idx_.
+
+        Args:
+            target (Tile): Where they landed
+            now (int): Tick they spread on
+            idx (int): Chunk they came from
+            woken (list): Tiles in chunk _idx_ that became active
+        """
+        t_idx = self._chunkOf( *target.pos )
+        if( (t_idx != idx) and (self._done[ t_idx ] < now) ):
+            # That chunk hasn't got to this tick yet, it'll pick them up when it does
+            self._pending.setdefault( t_idx, {} ).setdefault( now, [] ).append( target )
+            return
+
+        if( not target.shroomCanSpawn() ):
+            return
+
+        mission = self.mission
+        quiet = min( mission.shroom_grow_limit, mission.shroom_spread_limit )
+        before = target.shrooms
+        target.shrooms = before + mission.shroom_grow_amount
+        if( t_idx == idx ):
+            if( (before <= quiet) and (target.shrooms > quiet) ):
+                woken.append( target )
+
+        elif( (before <= mission.shroom_grow_limit) and (target.shrooms > mission.shroom_grow_limit) ):
+            # That chunk is already past this tick, give it the growth it missed since
+            target.shrooms += mission.shroom_grow_amount * ( self._done[ t_idx ] - now )
+
+    # Clock ##################################################################
+
+    def start( self, clock ):
+        """
+        Step on every tick of the clock.
+
+        Args:
+            clock (Clock): The mission clock
+        """
+        self._handle = clock.scheduleIn( 1, self._tick, clock )
+
+    def stop( self, clock ):
+        """
+        Stop stepping on the clock.
+
+        Args:
+            clock (Clock): The mission clock
+        """
+        if( self._handle is not None ):
+            clock.cancel( self._handle )
+            self._handle = None
+
+    def _tick( self, clock ):
+        self.step( clock.now )
+        self._handle = clock.scheduleIn( 1, self._tick, clock )
+
+
+if( __name__ == "__main__" ):
+    # lod.py [size] [ticks] - check LOD stepping against stepping every tile every tick
+    import sys
+    import time
+
+    from mapgen import MapGenerator
+
+    size  = int( sys.argv[1] ) if( len( sys.argv ) > 1 ) else 128
+    ticks = int( sys.argv[2] ) if( len( sys.argv ) > 2 ) else 160
+
+    worst = 0.
+    for seed in ( 1, 2, 3, 5 ):
+        totals = []
+        for use_lod in ( False, True ):
+            mission = MapGenerator( size, size, seed ).mission()
+            manager = LODManager( mission ) if( use_lod ) else None
+            start = time.perf_counter()
+            for _ in range( ticks ):
+                if( use_lod ):
+                    manager.step()
+                else:
+                    mission.field.growShrooms()
+                    mission.field.heatDecay()
+                mission.tick()
+            if( use_lod ):
+                manager.flush()
+            elapsed = time.perf_counter() - start
+            totals.append( ( sum( tile.shrooms for row in mission.field.grid for tile in row ), elapsed ) )
+
+        ( full, full_t ), ( lod, lod_t ) = totals
+        ratio = lod / max( full, 1 )
+        worst = max( worst, abs( ratio - 1. ) )
+        print( "seed {}: shrooms {} full rate, {} LOD, ratio {:.4f}, time x{:.2f}".format(
+            seed, full, lod, ratio, lod_t / max( full_t, 1e-9 ) ) )
+
+    print( "worst difference {:.2%}".format( worst ) )
+    sys.exit( 0 if( worst < 0.02 ) else 1 )
@@ -0,0 +1,365 @@
+# mapgen - make big random maps for stress testing
+#
+# Terrain comes from a few layers of seeded value noise: a height field gives water and
+# land, the edges of the high ground become cliffs, contour lines of a second field
+# become rivers, and the land next to water becomes shoreline.  Shroom fields and rough
+# ground come from two more noise fields.
+#
+# The noise is made a row at a time, and the shape work (edges, shorelines, widening
+# rivers) is done on whole rows at once, each row held as one big int with a bit per
+# tile, so shifts and ands do a row in one go.  Byte rows are mapped with translate()
+# tables, again a row in one go.
+
+import json
+from random import Random
+import re
+import sys
+
+from mapping import Tile, TRN_LAND, TRN_IMPASS, TRN_LIMINAL
+from mission import Mission
+from rng import StreamRNG, subsystemId
+
+
+# Noise fields, the draw number each is made with
+NSE_HEIGHT  = 0
+NSE_RIVERS  = 1
+NSE_SHROOMS = 2
+NSE_SPEED   = 3
+
+# '0' / '1' -> 0 / 1
+_BITS_TO_BYTES = bytes.maketrans( b"01", b"\x00\x01" )
+
+# A run of the same byte
+_RUN = re.compile( rb"(.)\1*", re.DOTALL )
+
+
+def noiseRows( dim_x, dim_y, seed, field, scale, octaves=4, persistence=0.5 ):
+    """
+    Fractal value noise, a row at a time.
+
+    Args:
+        dim_x (int): Map Dimention X
+        dim_y (int): Map Dimention Y
+        seed (int): Map seed
+        field (int): NSE_XXX, different fields from the same seed are unrelated
+        scale (float): Size in tiles of the biggest features
+        octaves (int): Layers of finer detail
+        persistence (float): How much weaker each layer of detail is
+
+    Yields:
+        bytes: Noise in 0..255 for each tile in the row
+    """
+    streams = StreamRNG( seed )
+    sub = subsystemId( "mapgen" )
+    norm = sum( persistence ** o for o in range( octaves ) )
+
+    layers = []
+    for octave in range( octaves ):
+        cell = max( scale / ( 2 ** octave ), 1. )
+        amp = 255.999 * ( persistence ** octave ) / norm
+        lat_w = int( dim_x / cell ) + 2
+
+        # lattice column and smoothed fraction for each x
+        xs = []
+        for x in range( dim_x ):
+            f = x / cell
+            i = int( f )
+            t = f - i
+            xs.append( ( i, t * t * ( 3. - 2. * t ) ) )
+
+        layers.append( ( octave, cell, amp, lat_w, xs, {} ) )
+
+    for y in range( dim_y ):
+        vals = [ 0. ] * dim_x
+        for octave, cell, amp, lat_w, xs, lattice in layers:
+            f = y / cell
+            j = int( f )
+            t = f - j
+            t = t * t * ( 3. - 2. * t )
+
+            for row in ( j, j + 1 ):
+                if( row not in lattice ):
+                    lattice[ row ] = streams.randomMany( octave, sub, range( row * lat_w, ( row + 1 ) * lat_w ), field )
+            for row in [ row for row in lattice if row < j ]:
+                del lattice[ row ]
+
+            a = lattice[ j ]
+            b = lattice[ j + 1 ]
+            lo = [ amp * ( p + ( q - p ) * t ) for p, q in zip( a, b ) ]
+            dd = [ q - p for p, q in zip( lo, lo[1:] ) ] + [ 0. ]
+            vals = [ v + lo[i] + dd[i] * u for v, ( i, u ) in zip( vals, xs ) ]
+
+        yield bytes( map( int, vals ) )
+
+
+# Row masks ##################################################################
+
+def threshold( row, level ):
+    """
+    Args:
+        row (bytes): Noise row
+        level (int): Threshold
+
+    Returns:
+        int: Row mask, bit set for tiles at or over _level_.  The first tile is the top bit
+    """
+    table = bytes( 49 if( v >= level ) else 48 for v in range( 256 ) )
+    return int( row.translate( table ), 2 )
+
+
+def maskBytes( mask, dim_x ):
+    """
+    Args:
+        mask (int): Row mask
+        dim_x (int): Map Dimention X
+
+    Returns:
+        bytes: 1 for set tiles, 0 otherwise
+    """
+    return format( mask, "0{}b".format( dim_x ) ).encode( "ascii" ).translate( _BITS_TO_BYTES )
+
+
+def dilate( masks, dim_x ):
+    """
+    Grow set tiles into their 8 neighbours.
+
+    Args:
+        masks (list): Row masks
+        dim_x (int): Map Dimention X
+
+    Returns:
+        list: Grown row masks
+    """
+    full = ( 1 << dim_x ) - 1
+    wide = [ m | ( ( m << 1 ) & full ) | ( m >> 1 ) for m in masks ]
+    last = len( wide ) - 1
+    return [ wide[ max( y - 1, 0 ) ] | w | wide[ min( y + 1, last ) ] for y, w in enumerate( wide ) ]
+
+
+def erode( masks, dim_x ):
+    """
+    Shrink set tiles, keeping only those with all 8 neighbours set.  Off the edge of
+    the map counts as set, so nothing erodes from the edge.
+
+    Args:
+        masks (list): Row masks
+        dim_x (int): Map Dimention X
+
+    Returns:
+        list: Shrunk row masks
+    """
+    full = ( 1 << dim_x ) - 1
+    top = 1 << ( dim_x - 1 )
+    narrow = [ m & ( ( ( m << 1 ) | 1 ) & full ) & ( ( m >> 1 ) | top ) for m in masks ]
+    last = len( narrow ) - 1
+    return [ ( narrow[ y - 1 ] if( y > 0 ) else full ) & n & ( narrow[ y + 1 ] if( y < last ) else full )
+             for y, n in enumerate( narrow ) ]
+
+
+def edges( masks, dim_x ):
+    """
+    Args:
+        masks (list): Row masks
+        dim_x (int): Map Dimention X
+
+    Returns:
+        list: The set tiles that have an unset neighbour
+    """
+    return [ m & ~e for m, e in zip( masks, erode( masks, dim_x ) ) ]
+
+
+def runs( row, skip ):
+    """
+    Args:
+        row (bytes): Layer row
+        skip (int): Value to leave out, the layer's default
+
+    Yields:
+        tuple: ( start, val, num ) for each run of the same value
+    """
+    for match in _RUN.finditer( row ):
+        val = row[ match.start() ]
+        if( val != skip ):
+            yield ( match.start(), val, match.end() - match.start() )
+
+
+class MapGenerator( object ):
+
+    """
+    A seeded random map.  The same seed and settings always make the same map.
+
+    Attributes:
+        cliff_level (int): Height (0..255) the high ground starts at, it's edge is cliffs
+        dim_x (int): Map Dimention X
+        dim_y (int): Map Dimention Y
+        river_width (int): Tiles across a river
+        scale (float): Size in tiles of the biggest land masses
+        sea_level (int): Height (0..255) land starts at
+        seed (int): Map seed, also the mission's rand_seed
+        settings (dict): MISSION_SETUP for the generated mission
+        shroom_level (int): Noise (0..255) shroom fields start at
+        shrooms (list): bytes row per y, when generated
+        speed (list): bytes row per y of move_limit, when generated
+        terrain (list): bytes row per y of TRN_XXX, when generated
+    """
+
+    def __init__( self, dim_x, dim_y, seed=1, scale=64., sea_level=100, cliff_level=200,
+                  river_width=1, shroom_level=180, settings=None ):
+        self.dim_x = dim_x
+        self.dim_y = dim_y
+        self.seed = seed
+        self.scale = scale
+        self.sea_level = sea_level
+        self.cliff_level = cliff_level
+        self.river_width = river_width
+        self.shroom_level = shroom_level
+
+        self.settings = {
+            "shroom_grow_amount"  : 6,
+            "shroom_grow_limit"   : 20,
+            "shroom_spread_limit" : 76,
+            "shroom_cap"          : 100,
+        }
+        self.settings.update( settings or {} )
+        self.settings[ "rand_seed" ] = seed
+
+        self.terrain = None
+        self.shrooms = None
+        self.speed = None
+
+    def generate( self ):
+        """
+        Make the map layers.
+
+        Returns:
+            MapGenerator: self, for chaining
+        """
+        dim_x, dim_y, seed = self.dim_x, self.dim_y, self.seed
+        full = ( 1 << dim_x ) - 1
+
+        # Water, land, and high ground
+        land = []
+        high = []
+        for row in noiseRows( dim_x, dim_y, seed, NSE_HEIGHT, self.scale ):
+            land.append( threshold( row, self.sea_level ) )
+            high.append( threshold( row, self.cliff_level ) )
+
+        # Rivers follow a contour line of another field
+        rivers = edges( [ threshold( row, 128 ) for row in
+                          noiseRows( dim_x, dim_y, seed, NSE_RIVERS, self.scale, octaves=3 ) ], dim_x )
+        for _ in range( self.river_width - 1 ):
+            rivers = dilate( rivers, dim_x )
+
+        cliffs = edges( high, dim_x )
+        wet = dilate( [ full & ~m for m in land ], dim_x )
+
+        # Shroom amount and move_limit for a noise value
+        cap = self.settings[ "shroom_cap" ]
+        span = max( 255 - self.shroom_level, 1 )
+        shroom_tab = bytes( 0 if( v < self.shroom_level ) else min( cap, 1 + ( ( v - self.shroom_level ) * cap ) // span )
+                            for v in range( 256 ) )
+        speed_tab = bytes( min( v // 64, 3 ) if( v >= 128 ) else 0 for v in range( 256 ) )
+
+        self.terrain = []
+        self.shrooms = []
+        self.speed = []
+        shroom_rows = noiseRows( dim_x, dim_y, seed, NSE_SHROOMS, self.scale / 4., octaves=2 )
+        speed_rows = noiseRows( dim_x, dim_y, seed, NSE_SPEED, self.scale / 2., octaves=2 )
+        for y in range( dim_y ):
+            impass = land[y] & ( cliffs[y] | rivers[y] )
+            shore = land[y] & ~impass & wet[y]
+            ground = land[y] & ~impass & ~shore
+
+            # The classes don't overlap, so adding them byte-wise can't carry
+            codes = ( int.from_bytes( maskBytes( ground, dim_x ), "big" ) * TRN_LAND
+                      + int.from_bytes( maskBytes( impass, dim_x ), "big" ) * TRN_IMPASS
+                      + int.from_bytes( maskBytes( shore, dim_x ), "big" ) * TRN_LIMINAL )
+            self.terrain.append( codes.to_bytes( dim_x, "big" ) )
+
+            # Shrooms only grow on land, and only land units care about the ground
+            on_land = int.from_bytes( maskBytes( ground, dim_x ), "big" ) * 0xFF
+            passable = int.from_bytes( maskBytes( ground | shore, dim_x ), "big" ) * 0xFF
+            shroom = int.from_bytes( next( shroom_rows ).translate( shroom_tab ), "big" ) & on_land
+            speed = int.from_bytes( next( speed_rows ).translate( speed_tab ), "big" ) & passable
+            self.shrooms.append( shroom.to_bytes( dim_x, "big" ) )
+            self.speed.append( speed.to_bytes( dim_x, "big" ) )
+
+        return self
+
+    # Output #################################################################
+
+    def _layers( self ):
+        if( self.terrain is None ):
+            self.generate()
+
+        # JSON key, rows, default value
+        return (
+            ( "TERRAIN_LIST", self.terrain, TRN_LAND ),
+            ( "SHROOM_LIST",  self.shrooms, 0 ),
+            ( "SPEED_LIST",   self.speed,   0 ),
+        )
+
+    def writeJSON( self, path ):
+        """
+        Write the map as a mission JSON, like test_map.json.  The RLE lists are written
+        as they're made, so a huge map doesn't have to be held as JSON in memory.
+
+        Args:
+            path (string): File to write
+        """
+        with open( path, "w" ) as fh:
+            fh.write( "{\n    \"MISSION_SETUP\" : " )
+            fh.write( json.dumps( self.settings ) )
+            fh.write( ",\n    \"MAP_SETUP\" : {\n" )
+            fh.write( "        \"DIMS\" : [{},{}],\n".format( self.dim_x, self.dim_y ) )
+            fh.write( "        \"BASE_TERRAIN\" : {},\n".format( TRN_LAND ) )
+            fh.write( "        \"TERRAIN_ART_LIST\" : [],\n" )
+            fh.write( "        \"DODAD_LIST\" : [],\n" )
+
+            for num, ( key, rows, skip ) in enumerate( self._layers() ):
+                fh.write( "        \"{}\" : [".format( key ) )
+                sep = ""
+                for y, row in enumerate( rows ):
+                    base = y * self.dim_x
+                    entries = [ "[{},{},{}]".format( base + start, val, count ) for start, val, count in runs( row, skip ) ]
+                    if( entries ):
+                        fh.write( sep + ", ".join( entries ) )
+                        sep = ",\n            "
+                fh.write( "],\n" if( num < 2 ) else "]\n" )
+
+            fh.write( "    }\n}\n" )
+
+    def mission( self ):
+        """
+        Make the Mission directly, skipping the JSON.
+
+        Returns:
+            Mission: The mission
+        """
+        mission = Mission( None )
+        for k, v in self.settings.items():
+            setattr( mission, k, v )
+        mission.rand = Random( mission.rand_seed )
+        mission.streams = StreamRNG( mission.rand_seed )
+
+        mission.buildField( self.dim_x, self.dim_y, TRN_LAND )
+        grid = mission.field.grid
+        for key, rows, skip in self._layers():
+            attr = Tile.DATA_ATTERS[ key ]
+            for y, row in enumerate( rows ):
+                tiles = grid[y]
+                for start, val, count in runs( row, skip ):
+                    for tile in tiles[ start:start + count ]:
+                        setattr( tile, attr, val )
+
+        return mission
+
+
+if( __name__ == "__main__" ):
+    # mapgen.py out.json [dim_x] [dim_y] [seed]
+    out_fq = sys.argv[1] if( len( sys.argv ) > 1 ) else "gen_map.json"
+    dim_x  = int( sys.argv[2] ) if( len( sys.argv ) > 2 ) else 256
+    dim_y  = int( sys.argv[3] ) if( len( sys.argv ) > 3 ) else dim_x
+    seed   = int( sys.argv[4] ) if( len( sys.argv ) > 4 ) else 1
+
+    MapGenerator( dim_x, dim_y, seed ).writeJSON( out_fq )
@@ -1,5 +1,9 @@
 # mapping - classes to describe the map and the tiles
 
+from operator import attrgetter
+
+from rng import SUB_SHROOMS
+
 
 # Terrain types
 TRN_WATER   = 0
@@ -17,6 +21,19 @@ OCY_COMMANDABLE = 1 << 3 # Units
 
 MASK_SPAWN_OK   = OCY_DESTRUCT | OCY_COMMANDABLE # Shrooms can spawn under destructables, or units
 MASK_SPAWN_NO   = OCY_IMMOVEABLE | OCY_BUILDING  # Ground based blockers won't allow spawning
+MASK_BLOCKING   = OCY_IMMOVEABLE | OCY_BUILDING  # Land units can't drive through these
+
+# Land units can drive on these
+PASSABLE_TERRAIN = ( TRN_LAND, TRN_LIMINAL )
+
+# Tile layers that report changes to the Map's watchers
+LYR_TERRAIN   = "terrain"
+LYR_OCCUPANCY = "occupancy_flags"
+LYR_HEAT      = "heat"
+LYR_SHROOMS   = "shrooms"
+
+# Size of the blocks dirty regions are tracked in
+DIRTY_CHUNK = 8
 
 class Map( object ):
 
@@ -33,6 +50,7 @@ class Map( object ):
         mission (Mission): mission specification
         occupied_tiles (set): Set of tiles with occupancy
         viewer_tiles (set): Set of tiles viewed? TBD
+        watchers (list): Things that want to know when a tile layer changes
     """
     
     NEIGHBORS = {
@@ -62,6 +80,9 @@ class Map( object ):
         self.occupied_tiles = set()
         self.viewer_tiles = set()
 
+        # Change notification
+        self.watchers = []
+
     def setMap( self, grid, dim_x, dim_y ):
         """
         Attach the supplied grid of tiles
@@ -76,6 +97,11 @@ class Map( object ):
         self.dim_y = dim_y
         self.ravel_max = dim_y * dim_x
 
+        # Tiles may have been made before we knew the dims
+        for row in grid:
+            for tile in row:
+                tile.ravel_id = tile.pos[0] + (tile.pos[1] * dim_x)
+
     def accessRavel( self, idx ):
         """
         Access a tile by it's "ravel" index eg as if the matrix was flat
@@ -85,9 +111,9 @@ class Map( object ):
         Returns:
             tile: requested tile if valid, None if not
         """
-        if( (idx < 0) or (idx > self.ravel_max) ):
+        if( (idx < 0) or (idx >= self.ravel_max) ):
             return None
-        y, x = divmod( idx, self.dim_y )
+        y, x = divmod( idx, self.dim_x )
         return self.accessXY( x, y )
 
     def accessXY( self, x, y ):
@@ -101,39 +127,88 @@ class Map( object ):
         Returns:
             tile: requested tile if valid, None if not
         """
-        if( (x > self.dim_x) or (x < 0) or
-            (y > self.dim_y) or (y < 0) ):
+        if( (x >= self.dim_x) or (x < 0) or
+            (y >= self.dim_y) or (y < 0) ):
             return None
         return self.grid[ y ][ x ]
 
+    # Change tracking ################################################################
+
+    def addWatcher( self, watcher ):
+        """
+        Have _watcher_.tileChanged( tile, layer, old ) called whenever a tile's terrain,
+        occupancy, heat, or shrooms change.
+
+        Args:
+            watcher (object): Anything with a tileChanged method
+        """
+        if( watcher not in self.watchers ):
+            self.watchers.append( watcher )
+
+    def removeWatcher( self, watcher ):
+        """
+        Stop telling _watcher_ about changes.
+
+        Args:
+            watcher (object): A watcher previously added
+        """
+        if( watcher in self.watchers ):
+            self.watchers.remove( watcher )
+
+    def tileChanged( self, tile, layer, old ):
+        """
+        Called by tiles when one of their layers changes value.
+
+        Args:
+            tile (Tile): The tile that changed
+            layer (string): One of the LYR_XXX names
+            old (int): The value before the change
+        """
+        for watcher in self.watchers:
+            watcher.tileChanged( tile, layer, old )
+
+    def trackDirty( self, layers=None, chunk=DIRTY_CHUNK ):
+        """
+        Start tracking which parts of the map change.
+
+        Args:
+            layers (iterable): LYR_XXX names to track, None for all of them
+            chunk (int): Size of the blocks dirty rectangles are made from
+
+        Returns:
+            DirtyRegions: the tracker, call stopTracking() on it when done
+        """
+        tracker = DirtyRegions( self, layers, chunk )
+        self.addWatcher( tracker )
+        return tracker
+
     def randomDirection( self ):
         return self.mission.rand.choice( self.COMPASS_POINTS )
 
     # Map Automation routines ########################################################
 
-    def growShrooms( self ):
-        """
-        Manage Shroom regrowth and spawning.
+    def growShrooms( self, tick=None ):
         """
-        for row in self.grid:
-            for tile in row:
+        Manage Shroom regrowth and spawning, see shroomTick.
 
-                if( tile.shroomCanGrow() ):
-                    tile.shrooms += self.mission.shroom_grow_amount
+        Args:
+            tick (int): Game tick to draw for, defaults to the mission clock
+        """
+        mission = self.mission
+        if( tick is None ):
+            tick = mission.clock.now
+        amount = mission.shroom_grow_amount
 
-                if( tile.shroomCanSpread() ):
-                    pos = self.NEIGHBORS[ self.randomDirection() ]
+        tiles = [ tile for row in self.grid for tile in row ]
+        growing, spreads = shroomTick( mission, tick, tiles, [ tile.shrooms for tile in tiles ], attrgetter( "ravel_id" ) )
 
-                    if( self.mission.rand.randint(0,100) > 95 ):
-                        # big sneaze
-                        new = ( pos[0] * 2, pos[1] * 2 )
-                        target = tile.accessOffset( new )
-                        
-                    else:
-                        target = tile.accessOffset( pos )
+        for tile in growing:
+            tile.shrooms += amount
 
-                    if( (target is not None) and target.shroomCanSpawn() ):
-                        target.shrooms += self.mission.shroom_grow_amount
+        for tile, dx, dy in spreads:
+            target = tile.accessOffset( ( dx, dy ) )
+            if( (target is not None) and target.shroomCanSpawn() ):
+                target.shrooms += amount
 
     def heatDecay( self ):
         """
@@ -145,7 +220,63 @@ class Map( object ):
                     tile.heat -= self.mission.heat_decay
                 # TODO: Accumulate Heat from units on the tile
 
-                    
+
+# Offsets in the order of Map.COMPASS_POINTS, stream draws pick from these
+SPREAD = tuple( Map.NEIGHBORS[ point ] for point in Map.COMPASS_POINTS )
+
+
+def shroomTick( mission, tick, items, values, key ):
+    """
+    Decide one tick of shroom growth: which tiles grow and where each spreading tile
+    spreads to.  Everything that steps shrooms (Map.growShrooms, batch.MissionBatch,
+    lod.LODManager) decides here, so they all make the same choices.
+
+    Who grows and who spreads is decided from the shrooms as they were at the start
+    of the tick, and spread directions come from the mission's counter based streams
+    keyed on the tile, so the result doesn't depend on the order tiles are visited.
+    Applying the result, and checking the target can take shrooms, is up to the caller.
+
+    Args:
+        mission (Mission): Limits, cap, and random streams
+        tick (int): Game tick to draw for
+        items (list): The tiles, in whatever form the caller keeps them
+        values (iterable): Start of tick shrooms of each item
+        key (callable): The item's ravel id within it's map, the stream key
+
+    Returns:
+        tuple: ( growing, spreads ), the items that grow by shroom_grow_amount, and
+            ( item, dx, dy ) for each item that spreads, the offset it spreads onto
+    """
+    amount = mission.shroom_grow_amount
+    grow_limit = mission.shroom_grow_limit
+    spread_limit = mission.shroom_spread_limit
+    cap = mission.shroom_cap
+
+    growing = []
+    spreading = []
+    for item, shrooms in zip( items, values ):
+        if( shrooms > grow_limit ):
+            growing.append( item )
+            shrooms = min( shrooms + amount, cap )
+
+        if( shrooms > spread_limit ):
+            spreading.append( item )
+
+    keys = [ key( item ) for item in spreading ]
+    directions = mission.streams.randbelowMany( len( SPREAD ), tick, SUB_SHROOMS, keys, 0 )
+    sneezes = mission.streams.randbelowMany( 101, tick, SUB_SHROOMS, keys, 1 )
+
+    spreads = []
+    for item, direction, sneeze in zip( spreading, directions, sneezes ):
+        dx, dy = SPREAD[ direction ]
+        if( sneeze > 95 ):
+            # big sneaze
+            dx *= 2
+            dy *= 2
+        spreads.append( ( item, dx, dy ) )
+
+    return growing, spreads
+
 class Tile( object ):
 
     """
@@ -179,14 +310,14 @@ class Tile( object ):
         self.mission = field.mission # Mission settings
         self.pos = pos
 
-        self.ravel_id = ( self.pos[0] + (self.pos[1] * self.field.dim_y) )
+        self.ravel_id = ( self.pos[0] + (self.pos[1] * self.field.dim_x) )
 
         # Mapping
         self.is_uncovered = None # Needs to be a flag for each faction that has seen this tile
 
         ### Things that can be placed on the Map tile ###
         # Navigation, Placement
-        self.terrain = terrain
+        self.__terrain = terrain
         self.dodad = None # DoDads have a physical presences and interfear with placement and nav
 
         # Drawing
@@ -198,13 +329,13 @@ class Tile( object ):
 
         # Occupancy
         # ??? DTRT
-        self.occupancy_flags = OCY_NONE
+        self.__occupancy_flags = OCY_NONE
 
         # Heat
-        self.heat = 0
+        self.__heat = 0
 
         # Shrroms
-        self.shrooms = 0
+        self.__shrooms = 0
 
     def accessOffset( self, offset ):
         """
@@ -271,13 +402,63 @@ class Tile( object ):
             x (int): New 'shroom count
         """
         if( x <= 0 ):
-            self.__shrooms = 0
+            x = 0
 
         elif( x > self.mission.shroom_cap ):
-            self.__shrooms = self.mission.shroom_cap
+            x = self.mission.shroom_cap
+
+        old = self.__shrooms
+        self.__shrooms = x
+        if( (x != old) and self.field.watchers ):
+            self.field.tileChanged( self, LYR_SHROOMS, old )
 
-        else:
-            self.__shrooms = x
+    # Navigation & Occupancy ##################################################
+
+    @property
+    def terrain( self ):
+        """
+        Getter for the terrain type
+
+        Returns:
+            int: TRN_XXX terrain
+        """
+        return self.__terrain
+
+    @terrain.setter
+    def terrain( self, x ):
+        """
+        Setter for the terrain type, a bridge blown or a river dammed.
+
+        Args:
+            x (int): New TRN_XXX terrain
+        """
+        old = self.__terrain
+        self.__terrain = x
+        if( (x != old) and self.field.watchers ):
+            self.field.tileChanged( self, LYR_TERRAIN, old )
+
+    @property
+    def occupancy_flags( self ):
+        """
+        Getter for the occupancy flags
+
+        Returns:
+            int: OCY_XXX bitfield
+        """
+        return self.__occupancy_flags
+
+    @occupancy_flags.setter
+    def occupancy_flags( self, x ):
+        """
+        Setter for the occupancy flags
+
+        Args:
+            x (int): New OCY_XXX bitfield
+        """
+        old = self.__occupancy_flags
+        self.__occupancy_flags = x
+        if( (x != old) and self.field.watchers ):
+            self.field.tileChanged( self, LYR_OCCUPANCY, old )
 
     # Heat Logic ##############################################################
 
@@ -300,13 +481,15 @@ class Tile( object ):
             x (int): New heat factor
         """
         if( x <= 0 ):
-            self.__heat = 0
+            x = 0
 
         elif( x > self.mission.heat_cap ):
-            self.__heat = self.mission.heat_cap
+            x = self.mission.heat_cap
 
-        else:
-            self.__heat = x
+        old = self.__heat
+        self.__heat = x
+        if( (x != old) and self.field.watchers ):
+            self.field.tileChanged( self, LYR_HEAT, old )
 
     def getHeat( self ):
         """
@@ -317,6 +500,17 @@ class Tile( object ):
         """
         pass
 
+    # Movement Logic ##########################################################
+
+    def isPassable( self ):
+        """
+        Test if a land unit could drive onto this tile.
+
+        Returns:
+            bool: passability
+        """
+        return bool( (self.terrain in PASSABLE_TERRAIN) and not (self.occupancy_flags & MASK_BLOCKING) )
+
     # Building Logic ##########################################################
 
     def canBuildHere( self, native=TRN_LAND ):
@@ -331,4 +525,118 @@ class Tile( object ):
         Returns:
             bool: If Buildable
         """
-        return bool( (self.occupancy_flags == OCY_NONE) and (self.terrain == native) )
\ No newline at end of file
+        return bool( (self.occupancy_flags == OCY_NONE) and (self.terrain == native) )
+
+
+class DirtyRegions( object ):
+
+    """
+    Watches a Map and remembers which tiles have changed since it was last asked, so
+    a renderer only has to redraw what's changed.  Get one from Map.trackDirty.
+
+    Attributes:
+        chunk (int): Size of the blocks dirty rectangles are made from
+        field (Map): The map being watched
+        layers (set): LYR_XXX names being tracked
+    """
+
+    def __init__( self, field, layers=None, chunk=DIRTY_CHUNK ):
+        self.field = field
+        self.chunk = chunk
+        if( layers is None ):
+            layers = ( LYR_TERRAIN, LYR_OCCUPANCY, LYR_HEAT, LYR_SHROOMS )
+        self.layers = set( layers )
+
+        self._cells = set()
+
+    def tileChanged( self, tile, layer, old ):
+        """
+        Map watcher callback, note the tile if it's a layer we care about.
+        """
+        if( layer in self.layers ):
+            self._cells.add( tile.pos )
+
+    def stopTracking( self ):
+        """
+        Stop watching the map.
+        """
+        self.field.removeWatcher( self )
+
+    def isDirty( self ):
+        """
+        Returns:
+            bool: Has anything changed
+        """
+        return bool( self._cells )
+
+    def markAll( self ):
+        """
+        Flag the whole map as changed, eg. after a new map is set.
+        """
+        self._cells.update( tile.pos for row in self.field.grid for tile in row )
+
+    def popCells( self ):
+        """
+        Get the changed tiles, and reset.
+
+        Returns:
+            set: ( x, y ) of every changed tile
+        """
+        cells = self._cells
+        self._cells = set()
+        return cells
+
+    def popRects( self ):
+        """
+        Get the changed areas as rectangles, and reset.  Changed tiles are gathered into
+        chunk sized blocks, runs of blocks along a row are joined, and runs that line up
+        on consecutive rows are merged.
+
+        Returns:
+            list: of ( x, y, w, h ) tile rectangles, clipped to the map
+        """
+        chunk = self.chunk
+        blocks = {}
+        for x, y in self.popCells():
+            blocks.setdefault( y // chunk, set() ).add( x // chunk )
+
+        # Horizontal runs of blocks, per block row
+        rects = []
+        open_runs = {} # ( bx0, bx1 ) -> [ bx0, by0, bx1, by1 ] still growing down
+        for by in sorted( blocks ):
+            runs = []
+            cols = sorted( blocks[ by ] )
+            start = prev = cols[0]
+            for bx in cols[1:]:
+                if( bx != prev + 1 ):
+                    runs.append( ( start, prev ) )
+                    start = bx
+                prev = bx
+            runs.append( ( start, prev ) )
+
+            still_open = {}
+            for run in runs:
+                rect = open_runs.pop( run, None )
+                if( (rect is not None) and (rect[3] == by - 1) ):
+                    rect[3] = by
+                else:
+                    if( rect is not None ):
+                        rects.append( rect )
+                    rect = [ run[0], by, run[1], by ]
+                still_open[ run ] = rect
+
+            rects.extend( open_runs.values() )
+            open_runs = still_open
+
+        rects.extend( open_runs.values() )
+
+        # Blocks to tiles
+        out = []
+        for bx0, by0, bx1, by1 in rects:
+            x = bx0 * chunk
+            y = by0 * chunk
+            w = min( (bx1 + 1) * chunk, self.field.dim_x ) - x
+            h = min( (by1 + 1) * chunk, self.field.dim_y ) - y
+            out.append( ( x, y, w, h ) )
+
+        return out
@@ -6,7 +6,10 @@
 import json
 from random import Random
 
-from mapping import Map, Tile
+from clock import Clock
+from coord import fixedPoint
+from mapping import Map, Tile, TRN_LAND
+from rng import StreamRNG
 
 
 class Mission( object ):
@@ -15,12 +18,17 @@ class Mission( object ):
     Defines the mission parameters.  limits on tech level, settings for heat decay and shroom growth.
     
     Attributes:
+        clock (Clock): The mission clock, and scheduler of future events
+        factions (list): Factions at war in this mission
         field (list of lists): The battlefield as a 2D array of Tiles
+        fixed_point (bool): Entities use fixed point positions, see coord.FixedCoord,
+            so lockstep games move the same on every machine
         heat_cap (int): max heat a tile can absorbe.
         heat_decay (int): how much heat is lost per heat tick
         map_fq (string): fully qualified path to the mission JSON
         rand (Random): Random with a fixed seed, so some randomness is shared
         rand_seed (int): the shared seed
+        streams (StreamRNG): Counter based random streams, draws don't depend on order
         shroom_cap (int): max shrooms that can exist on a tile
         shroom_grow_amount (int): how much the shrooms grow, if they can
         shroom_grow_limit (int): Shrooms can only grow above a theashold
@@ -34,6 +42,12 @@ class Mission( object ):
         # The Batlefield
         self.field = None
 
+        # The Belligerents
+        self.factions = []
+
+        # Game Time
+        self.clock = Clock()
+
         # Shrooms - my take on Tibiriam
         self.shroom_grow_amount  =   6
         self.shroom_grow_limit   =  20
@@ -47,6 +61,9 @@ class Mission( object ):
         # Shared random seed
         self.rand_seed = 1
 
+        # Positions
+        self.fixed_point = False
+
         # ???
 
         if( self.map_fq is not None ):
@@ -73,18 +90,15 @@ class Mission( object ):
         for k, v in json_dict[ "MISSION_SETUP" ].items():
             setattr( self, k, v )
 
-        # load the PRNG
+        # load the PRNGs
         self.rand = Random( self.rand_seed )
+        self.streams = StreamRNG( self.rand_seed )
         
         # Load the Map
         map_dict = json_dict[ "MAP_SETUP" ]
-        self.field = Map( self )
 
         dim_x, dim_y = map_dict["DIMS"]
-
-        grid = [ [Tile( self.field, (x,y), map_dict["BASE_TERRAIN"] ) for x in range(dim_x)] for y in range(dim_y) ]
-        
-        self.field.setMap( grid, dim_x, dim_x )
+        self.buildField( dim_x, dim_y, map_dict["BASE_TERRAIN"] )
 
         # Work through the enviroment tile RLE lists
         for key, accessor in Tile.DATA_ATTERS.items():
@@ -92,4 +106,43 @@ class Mission( object ):
                 for i in range( num ):
                     tile = self.field.accessRavel( idx+i )
                     if( tile is not None ):
-                        setattr( tile, accessor, val )
\ No newline at end of file
+                        setattr( tile, accessor, val )
+
+    def entityClass( self, cls ):
+        """
+        The class to make entities of _cls_ with in this mission, the fixed point version
+        if the mission is fixed_point.
+
+        Args:
+            cls (class): Entity class
+
+        Returns:
+            class: The class to instantiate
+        """
+        if( self.fixed_point ):
+            return fixedPoint( cls )
+        return cls
+
+    def buildField( self, dim_x, dim_y, base_terrain=TRN_LAND ):
+        """
+        Make a fresh battlefield of blank tiles.
+
+        Args:
+            dim_x (int): Map Dimention in X
+            dim_y (int): Map Dimention in Y
+            base_terrain (int): Terrain every tile starts as
+        """
+        self.field = Map( self )
+
+        grid = [ [Tile( self.field, (x,y), base_terrain ) for x in range(dim_x)] for y in range(dim_y) ]
+
+        self.field.setMap( grid, dim_x, dim_y )
+
+    def tick( self ):
+        """
+        Advance the mission one game tick, running any events scheduled for it.
+
+        Returns:
+            int: The new tick
+        """
+        return self.clock.advance()
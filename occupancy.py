@@ -0,0 +1,242 @@
+# occupancy - keep Tile.occupancy_flags and Map.occupied_tiles in step with the entities
+#
+# Each entity's footprint (from it's Coord and size) is registered on the tiles under it,
+# and every tile keeps a count of occupants per OCY_XXX flag.  Moves are queued and
+# applied once per tick, and a unit that hasn't left it's cell costs nothing, so only
+# the cells entered and left get touched.
+
+from entities import Structure, Commandable
+from mapping import OCY_DESTRUCT, OCY_IMMOVEABLE, OCY_BUILDING, OCY_COMMANDABLE
+
+
+# The flags we count occupants for
+OCY_FLAGS = ( OCY_DESTRUCT, OCY_IMMOVEABLE, OCY_BUILDING, OCY_COMMANDABLE )
+
+
+def occupancyFlag( entity ):
+    """
+    What sort of blocker is this entity.
+
+    Args:
+        entity (Entity): The entity
+
+    Returns:
+        int: OCY_XXX flag, OCY_NONE (0) for things that don't touch the ground
+    """
+    if( entity.altitude > 0 ):
+        # Flying, doesn't get in anyone's way
+        return 0
+    if( isinstance( entity, Structure ) ):
+        return OCY_BUILDING
+    if( isinstance( entity, Commandable ) ):
+        return OCY_COMMANDABLE
+    if( entity.is_destructable ):
+        return OCY_DESTRUCT
+    return OCY_IMMOVEABLE
+
+
+class OccupancyManager( object ):
+
+    """
+    Registers entity footprints on the map's tiles.
+
+    Flags that were on tiles before the manager was made (ruins placed by the map) are
+    left alone, the manager only sets and clears the flags of the entities it knows about.
+
+    Attributes:
+        dim_x (int): Map Dimention X
+        dim_y (int): Map Dimention Y
+        field (Map): The map
+        moves_applied (int): Footprint changes applied, over the lifetime of the manager
+    """
+
+    def __init__( self, field ):
+        self.field = field
+        self.dim_x = field.dim_x
+        self.dim_y = field.dim_y
+
+        area = self.dim_x * self.dim_y
+        self._tiles = [ tile for row in field.grid for tile in row ]
+        self._static = [ tile.occupancy_flags for tile in self._tiles ]
+        field.occupied_tiles.update( tile for tile in self._tiles if tile.occupancy_flags )
+
+        # flag -> occupant count per tile
+        self._counts = { flag: [ 0 ] * area for flag in OCY_FLAGS }
+        self._occupants = [ 0 ] * area
+
+        # entity id -> ( x0, y0, x1, y1, flag ) cell rect it's registered on, end exclusive
+        self._footprints = {}
+        # entity id -> entity, waiting for the next flush, in the order they moved
+        self._pending = {}
+
+        self._handle = None
+        self.moves_applied = 0
+
+    # Registration ###########################################################
+
+    def _rectOf( self, entity ):
+        x, y = entity.asCellPos()
+        w, h = entity.size
+        w = max( int( w ), 1 )
+        h = max( int( h ), 1 )
+        return ( max( x, 0 ), max( y, 0 ), min( x + w, self.dim_x ), min( y + h, self.dim_y ) )
+
+    def register( self, entity ):
+        """
+        Put an entity on the map now.
+
+        Args:
+            entity (Entity): Entity to register, must have a unique id
+        """
+        self.unregister( entity )
+        flag = occupancyFlag( entity )
+        if( flag == 0 ):
+            return
+
+        rect = self._rectOf( entity )
+        self._footprints[ entity.id ] = rect + ( flag, )
+        self._add( rect, flag, 1 )
+
+    def unregister( self, entity ):
+        """
+        Take an entity off the map now, eg. it's been destroyed.
+
+        Args:
+            entity (Entity): Entity to remove
+        """
+        self._pending.pop( entity.id, None )
+        footprint = self._footprints.pop( entity.id, None )
+        if( footprint is not None ):
+            self._add( footprint[:4], footprint[4], -1 )
+
+    def moved( self, entity ):
+        """
+        Note that an entity has moved, the map is updated on the next flush.
+
+        Args:
+            entity (Entity): The mover
+        """
+        if( entity.id in self._footprints ):
+            self._pending[ entity.id ] = entity
+
+    def flush( self ):
+        """
+        Apply all the moves since the last flush.
+
+        Returns:
+            int: Number of entities that changed cells
+        """
+        pending = self._pending
+        self._pending = {}
+        changed = 0
+
+        for ent_id, entity in pending.items():
+            old = self._footprints[ ent_id ]
+            rect = self._rectOf( entity )
+            if( rect == old[:4] ):
+                # Still in the same cells
+                continue
+
+            flag = old[4]
+            self._footprints[ ent_id ] = rect + ( flag, )
+            self._move( old[:4], rect, flag )
+            changed += 1
+
+        self.moves_applied += changed
+        return changed
+
+    def start( self, clock ):
+        """
+        Flush on every tick of the clock.
+
+        Args:
+            clock (Clock): The mission clock
+        """
+        self._handle = clock.scheduleIn( 1, self._tick, clock )
+
+    def stop( self, clock ):
+        """
+        Stop flushing on the clock.
+
+        Args:
+            clock (Clock): The mission clock
+        """
+        if( self._handle is not None ):
+            clock.cancel( self._handle )
+            self._handle = None
+
+    def _tick( self, clock ):
+        self.flush()
+        self._handle = clock.scheduleIn( 1, self._tick, clock )
+
+    # Cell bookkeeping #######################################################
+
+    def _move( self, old, new, flag ):
+        """
+        Move a footprint, only touching the cells that differ.
+        """
+        ox0, oy0, ox1, oy1 = old
+        nx0, ny0, nx1, ny1 = new
+        counts = self._counts[ flag ]
+        dim_x = self.dim_x
+
+        for y in range( oy0, oy1 ):
+            for x in range( ox0, ox1 ):
+                if( not ( (nx0 <= x < nx1) and (ny0 <= y < ny1) ) ):
+                    self._bump( x + y * dim_x, counts, flag, -1 )
+
+        for y in range( ny0, ny1 ):
+            for x in range( nx0, nx1 ):
+                if( not ( (ox0 <= x < ox1) and (oy0 <= y < oy1) ) ):
+                    self._bump( x + y * dim_x, counts, flag, 1 )
+
+    def _add( self, rect, flag, delta ):
+        x0, y0, x1, y1 = rect
+        counts = self._counts[ flag ]
+        for y in range( y0, y1 ):
+            for x in range( x0, x1 ):
+                self._bump( x + y * self.dim_x, counts, flag, delta )
+
+    def _bump( self, idx, counts, flag, delta ):
+        before = counts[ idx ]
+        counts[ idx ] = before + delta
+        self._occupants[ idx ] += delta
+
+        if( (before == 0) or (before + delta == 0) ):
+            # The flag came or went
+            tile = self._tiles[ idx ]
+            flags = self._static[ idx ]
+            for f in OCY_FLAGS:
+                if( self._counts[ f ][ idx ] > 0 ):
+                    flags |= f
+            tile.occupancy_flags = flags
+
+            if( flags ):
+                self.field.occupied_tiles.add( tile )
+            else:
+                self.field.occupied_tiles.discard( tile )
+
+    # Queries ################################################################
+
+    def occupantsAt( self, x, y ):
+        """
+        Args:
+            x (int): X coord
+            y (int): Y coord
+
+        Returns:
+            int: Number of registered entities on the tile
+        """
+        return self._occupants[ x + y * self.dim_x ]
+
+    def countAt( self, x, y, flag ):
+        """
+        Args:
+            x (int): X coord
+            y (int): Y coord
+            flag (int): OCY_XXX flag
+
+        Returns:
+            int: Number of registered entities of that sort on the tile
+        """
+        return self._counts[ flag ][ x + y * self.dim_x ]
@@ -0,0 +1,273 @@
+# placement - where can a Structure go?
+#
+# Tile.canBuildHere only answers for one tile, but Structures cover several.  Placement
+# previews ask about every candidate spot under the cursor every frame, so we keep, per
+# native terrain, a buildable mask of the map, and per footprint size a count of blocked
+# tiles under the footprint anchored (top left) at every tile.  The counts come from a
+# box filter of the mask, and are patched as terrain and occupancy change.
+
+from mapping import TRN_LAND, TRN_WATER, LYR_TERRAIN, LYR_OCCUPANCY
+
+
+class PlacementIndex( object ):
+
+    """
+    Buildable masks and footprint clearance over a Map.  Registers itself as a watcher
+    of the map.  Footprint sizes are indexed the first time they're asked about.
+
+    Attributes:
+        dim_x (int): Map Dimention X
+        dim_y (int): Map Dimention Y
+        field (Map): The map
+        natives (tuple): Native terrains being indexed (land, water docks)
+    """
+
+    def __init__( self, field, natives=( TRN_LAND, TRN_WATER ) ):
+        self.field = field
+        self.natives = tuple( natives )
+        self.dim_x = field.dim_x
+        self.dim_y = field.dim_y
+
+        # native -> bytearray, 1 if buildable
+        self._buildable = {}
+        # ( native, w, h ) -> list of blocked tile counts per anchor
+        self._blocked = {}
+
+        tiles = [ tile for row in field.grid for tile in row ]
+        for native in self.natives:
+            self._buildable[ native ] = bytearray( tile.canBuildHere( native ) for tile in tiles )
+
+        field.addWatcher( self )
+
+    def close( self ):
+        """
+        Stop watching the map.
+        """
+        self.field.removeWatcher( self )
+
+    def _footprint( self, native, w, h ):
+        """
+        Get, or box filter up, the blocked counts for a footprint size.
+
+        Args:
+            native (int): Native terrain
+            w (int): Footprint width
+            h (int): Footprint height
+
+        Returns:
+            list: Blocked tile count per anchor, w*h+1 where the footprint is off the map
+        """
+        key = ( native, w, h )
+        counts = self._blocked.get( key )
+        if( counts is not None ):
+            return counts
+
+        dim_x = self.dim_x
+        dim_y = self.dim_y
+        mask = self._buildable[ native ]
+        off_map = w * h + 1
+
+        # Horizontal pass, sliding window of width w
+        rows = [ off_map ] * ( dim_x * dim_y )
+        for y in range( dim_y ):
+            base = y * dim_x
+            run = 0
+            for x in range( dim_x ):
+                run += 1 - mask[ base + x ]
+                if( x >= w ):
+                    run -= 1 - mask[ base + x - w ]
+                if( x >= w - 1 ):
+                    rows[ base + x - w + 1 ] = run
+
+        # Vertical pass, sliding window of height h
+        counts = [ off_map ] * ( dim_x * dim_y )
+        for x in range( dim_x - w + 1 ):
+            run = 0
+            for y in range( dim_y ):
+                run += rows[ x + y * dim_x ]
+                if( y >= h ):
+                    run -= rows[ x + ( y - h ) * dim_x ]
+                if( y >= h - 1 ):
+                    counts[ x + ( y - h + 1 ) * dim_x ] = run
+
+        self._blocked[ key ] = counts
+        return counts
+
+    def tileChanged( self, tile, layer, old ):
+        """
+        Map watcher callback, patch the masks and counts for the tile.
+        """
+        if( (layer != LYR_TERRAIN) and (layer != LYR_OCCUPANCY) ):
+            return
+
+        x, y = tile.pos
+        idx = x + y * self.dim_x
+        for native in self.natives:
+            now = int( tile.canBuildHere( native ) )
+            mask = self._buildable[ native ]
+            if( mask[ idx ] == now ):
+                continue
+            mask[ idx ] = now
+            delta = -1 if( now ) else 1
+
+            for ( f_native, w, h ), counts in self._blocked.items():
+                if( f_native != native ):
+                    continue
+                # Every anchor whose footprint covers this tile
+                for ay in range( max( y - h + 1, 0 ), min( y, self.dim_y - h ) + 1 ):
+                    for ax in range( max( x - w + 1, 0 ), min( x, self.dim_x - w ) + 1 ):
+                        counts[ ax + ay * self.dim_x ] += delta
+
+    # Queries ################################################################
+
+    def canPlace( self, native, x, y, w, h ):
+        """
+        Can a w x h building, native to _native_, be placed with it's top left at x, y.
+
+        Args:
+            native (int): Native terrain
+            x (int): Anchor X
+            y (int): Anchor Y
+            w (int): Footprint width
+            h (int): Footprint height
+
+        Returns:
+            bool: If Buildable
+        """
+        if( (x < 0) or (y < 0) or (x >= self.dim_x) or (y >= self.dim_y) ):
+            return False
+        return self._footprint( native, w, h )[ x + y * self.dim_x ] == 0
+
+    def canPlaceStructure( self, structure, x, y ):
+        """
+        Args:
+            structure (Structure): Building to place, uses it's size and native terrain
+            x (int): Anchor X
+            y (int): Anchor Y
+
+        Returns:
+            bool: If Buildable
+        """
+        w, h = footprintOf( structure )
+        return self.canPlace( structure.native, x, y, w, h )
+
+    def nearestSpot( self, native, x, y, w, h, max_radius=16 ):
+        """
+        Find the closest anchor to x, y where the footprint fits, searching outwards in
+        square rings.  A spot in a later ring can be closer than one in a corner of an
+        earlier ring, so the search carries on until the rings are further away than
+        the best spot found.
+
+        This is a bounded search, not a lookup: it checks O(r^2) anchors, r being the
+        distance to the spot found, and ( 2 * max_radius + 1 )^2 anchors when there's
+        nowhere to go.  Each check is one read of the footprint counts.  A distance
+        transform of the free anchors would make it O(1), but it would have to be
+        rebuilt every time a unit crosses a tile, and a placement preview only searches
+        a few rings around the cursor.
+
+        Args:
+            native (int): Native terrain
+            x (int): Wanted anchor X
+            y (int): Wanted anchor Y
+            w (int): Footprint width
+            h (int): Footprint height
+            max_radius (int): Give up after this many rings
+
+        Returns:
+            tuple: ( x, y ) anchor, None if there's nowhere close enough
+        """
+        counts = self._footprint( native, w, h )
+        dim_x = self.dim_x
+        dim_y = self.dim_y
+
+        best = None
+        best_d = None
+        for radius in range( max_radius + 1 ):
+            if( (best is not None) and (radius * radius > best_d) ):
+                # Nothing in this ring or beyond is closer
+                break
+            for ay in range( y - radius, y + radius + 1 ):
+                if( (ay < 0) or (ay >= dim_y) ):
+                    continue
+                edge = ( ay == y - radius ) or ( ay == y + radius )
+                step = 1 if( edge ) else max( radius * 2, 1 )
+                for ax in range( x - radius, x + radius + 1, step ):
+                    if( (ax < 0) or (ax >= dim_x) or counts[ ax + ay * dim_x ] ):
+                        continue
+                    d = ( ax - x ) ** 2 + ( ay - y ) ** 2
+                    if( (best is None) or (d < best_d) ):
+                        best = ( ax, ay )
+                        best_d = d
+
+        return best
+
+
+def footprintOf( entity ):
+    """
+    Args:
+        entity (Entity): Thing with a size
+
+    Returns:
+        tuple: ( w, h ) in tiles, at least 1 x 1
+    """
+    w, h = entity.size
+    return ( max( int( w ), 1 ), max( int( h ), 1 ) )
+
+
+if( __name__ == "__main__" ):
+    # placement.py [queries] - check nearestSpot against trying every anchor in range
+    import random
+    import sys
+
+    from mapgen import MapGenerator
+    from mapping import OCY_NONE, OCY_BUILDING
+
+    queries = int( sys.argv[1] ) if( len( sys.argv ) > 1 ) else 3000
+
+    mission = MapGenerator( 96, 80, 4 ).mission()
+    field = mission.field
+    index = PlacementIndex( field )
+    rand = random.Random( 4 )
+
+    def fits( native, ax, ay, w, h ):
+        """Tile by tile, without the index"""
+        if( (ax + w > field.dim_x) or (ay + h > field.dim_y) ):
+            return False
+        return all( field.grid[ y ][ x ].canBuildHere( native )
+                    for y in range( ay, ay + h ) for x in range( ax, ax + w ) )
+
+    def brute( native, x, y, w, h, max_radius ):
+        """Squared distance to the nearest anchor that fits, None if none in range"""
+        best = None
+        for ay in range( max( y - max_radius, 0 ), min( y + max_radius + 1, field.dim_y ) ):
+            for ax in range( max( x - max_radius, 0 ), min( x + max_radius + 1, field.dim_x ) ):
+                d = ( ax - x ) ** 2 + ( ay - y ) ** 2
+                if( ((best is None) or (d < best)) and fits( native, ax, ay, w, h ) ):
+                    best = d
+        return best
+
+    failed = 0
+    for query in range( queries ):
+        if( query % 10 == 0 ):
+            # Buildings go up and come down, the counts are patched as they do
+            for _ in range( 20 ):
+                tile = field.grid[ rand.randrange( field.dim_y ) ][ rand.randrange( field.dim_x ) ]
+                tile.occupancy_flags = OCY_BUILDING if( tile.occupancy_flags == OCY_NONE ) else OCY_NONE
+
+        native = rand.choice( index.natives )
+        w = rand.randint( 1, 3 )
+        h = rand.randint( 1, 3 )
+        x = rand.randrange( field.dim_x )
+        y = rand.randrange( field.dim_y )
+        max_radius = rand.choice( ( 2, 8, 16 ) )
+
+        got = index.nearestSpot( native, x, y, w, h, max_radius )
+        want = brute( native, x, y, w, h, max_radius )
+        got_d = None if( got is None ) else ( got[0] - x ) ** 2 + ( got[1] - y ) ** 2
+        if( (got_d != want) or ((got is not None) and not fits( native, got[0], got[1], w, h )) ):
+            failed += 1
+            print( "nearestSpot( {}, {}, {}, {}, {}, {} ) gave {}, brute force distance^2 {}".format(
+                native, x, y, w, h, max_radius, got, want ) )
+
+    print( "{} queries, {} wrong".format( queries, failed ) )
+    sys.exit( 1 if( failed ) else 0 )
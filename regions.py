@@ -0,0 +1,376 @@
+# regions - fast regional queries over the map layers
+#
+# AI and harvesters want to know "how many shrooms in this area", "where's hottest", or
+# "where are the most units".  Walking Map.grid to answer is O(area) a time, so we keep
+# a summed-area table for O(1) rectangle sums, and a sum / max mip pyramid for
+# O(log n) searches.  The pyramid is kept current from tile changes, the summed-area
+# tables are rebuilt lazily, at most once per economy tick.
+
+import heapq
+
+from mapping import LYR_SHROOMS, LYR_HEAT, LYR_OCCUPANCY, OCY_COMMANDABLE
+
+
+# How a raw tile layer value counts towards the index
+LAYER_VALUES = {
+    LYR_SHROOMS   : lambda raw: raw,
+    LYR_HEAT      : lambda raw: raw,
+    LYR_OCCUPANCY : lambda raw: 1 if( raw & OCY_COMMANDABLE ) else 0,
+}
+
+
+class _Pyramid( object ):
+
+    """
+    Sum and Max mip levels of one layer.  Level 0 is the layer itself, each level up
+    halves the resolution until it's a single cell.
+
+    Attributes:
+        dims (list): ( dim_x, dim_y ) of each level
+        maxes (list): Flat list per level of the max value under each cell
+        sums (list): Flat list per level of the total value under each cell
+    """
+
+    def __init__( self, values, dim_x, dim_y ):
+        self.dims = [ ( dim_x, dim_y ) ]
+        self.sums = [ list( values ) ]
+        self.maxes = [ list( values ) ]
+
+        while( (dim_x > 1) or (dim_y > 1) ):
+            lo_x, lo_y = dim_x, dim_y
+            dim_x = -(-dim_x // 2)
+            dim_y = -(-dim_y // 2)
+            lo_sum = self.sums[-1]
+            lo_max = self.maxes[-1]
+            sums = [ 0 ] * ( dim_x * dim_y )
+            maxes = [ 0 ] * ( dim_x * dim_y )
+            for y in range( lo_y ):
+                row = ( y // 2 ) * dim_x
+                for x in range( lo_x ):
+                    src = x + y * lo_x
+                    dst = row + ( x // 2 )
+                    sums[ dst ] += lo_sum[ src ]
+                    if( lo_max[ src ] > maxes[ dst ] ):
+                        maxes[ dst ] = lo_max[ src ]
+
+            self.dims.append( ( dim_x, dim_y ) )
+            self.sums.append( sums )
+            self.maxes.append( maxes )
+
+    def update( self, x, y, delta, value ):
+        """
+        Push a change at level 0 up the pyramid.
+
+        Args:
+            x (int): X coord
+            y (int): Y coord
+            delta (int): Change in value
+            value (int): The new value
+        """
+        dim_x = self.dims[0][0]
+        self.sums[0][ x + y * dim_x ] = value
+        self.maxes[0][ x + y * dim_x ] = value
+
+        for level in range( 1, len( self.dims ) ):
+            lo_x, lo_y = self.dims[ level - 1 ]
+            cx = ( x // 2 ) * 2
+            cy = ( y // 2 ) * 2
+            x //= 2
+            y //= 2
+            dim_x = self.dims[ level ][0]
+            idx = x + y * dim_x
+            self.sums[ level ][ idx ] += delta
+
+            lo_max = self.maxes[ level - 1 ]
+            best = 0
+            for yy in range( cy, min( cy + 2, lo_y ) ):
+                for xx in range( cx, min( cx + 2, lo_x ) ):
+                    if( lo_max[ xx + yy * lo_x ] > best ):
+                        best = lo_max[ xx + yy * lo_x ]
+            self.maxes[ level ][ idx ] = best
+
+    def children( self, level, x, y ):
+        """
+        Args:
+            level (int): Level of the parent cell, > 0
+            x (int): Parent X
+            y (int): Parent Y
+
+        Returns:
+            list: ( x, y ) of the parent's cells in the level below
+        """
+        lo_x, lo_y = self.dims[ level - 1 ]
+        return [ ( xx, yy ) for yy in range( y * 2, min( y * 2 + 2, lo_y ) )
+                            for xx in range( x * 2, min( x * 2 + 2, lo_x ) ) ]
+
+
+class RegionIndex( object ):
+
+    """
+    Summed-area tables and mip pyramids over some of a Map's layers.  Registers
+    itself as a watcher of the map.
+
+    Attributes:
+        dim_x (int): Map Dimention X
+        dim_y (int): Map Dimention Y
+        field (Map): The map being indexed
+        layers (tuple): LYR_XXX names being indexed
+    """
+
+    def __init__( self, field, layers=( LYR_SHROOMS, LYR_HEAT, LYR_OCCUPANCY ) ):
+        self.field = field
+        self.layers = tuple( layers )
+        self.dim_x = field.dim_x
+        self.dim_y = field.dim_y
+
+        self._values = {}
+        self._pyramids = {}
+        self._sats = {}
+        self._stale = set()
+
+        for layer in self.layers:
+            value = LAYER_VALUES[ layer ]
+            values = [ value( getattr( tile, layer ) ) for row in field.grid for tile in row ]
+            self._values[ layer ] = values
+            self._pyramids[ layer ] = _Pyramid( values, self.dim_x, self.dim_y )
+            self._stale.add( layer )
+
+        field.addWatcher( self )
+
+    def close( self ):
+        """
+        Stop watching the map.
+        """
+        self.field.removeWatcher( self )
+
+    def tileChanged( self, tile, layer, old ):
+        """
+        Map watcher callback, update the pyramid and mark the summed-area table stale.
+        """
+        if( layer not in self._values ):
+            return
+
+        value = LAYER_VALUES[ layer ]
+        new_val = value( getattr( tile, layer ) )
+        delta = new_val - value( old )
+        if( delta == 0 ):
+            return
+
+        x, y = tile.pos
+        self._values[ layer ][ x + y * self.dim_x ] = new_val
+        self._pyramids[ layer ].update( x, y, delta, new_val )
+        self._stale.add( layer )
+
+    def refresh( self ):
+        """
+        Rebuild any stale summed-area tables.  Call once per economy tick, or let the
+        queries do it on demand.
+        """
+        for layer in tuple( self._stale ):
+            self._buildSAT( layer )
+
+    def _buildSAT( self, layer ):
+        values = self._values[ layer ]
+        dim_x = self.dim_x
+        stride = dim_x + 1
+        sat = [ 0 ] * ( stride * ( self.dim_y + 1 ) )
+        for y in range( self.dim_y ):
+            run = 0
+            src = y * dim_x
+            above = y * stride
+            here = above + stride
+            for x in range( dim_x ):
+                run += values[ src + x ]
+                sat[ here + x + 1 ] = sat[ above + x + 1 ] + run
+        self._sats[ layer ] = sat
+        self._stale.discard( layer )
+
+    # Queries ################################################################
+
+    def rectSum( self, layer, x, y, w, h ):
+        """
+        Total of a layer over a rectangle, clipped to the map.  O(1).
+
+        Args:
+            layer (string): LYR_XXX name
+            x (int): Left
+            y (int): Top
+            w (int): Width
+            h (int): Height
+
+        Returns:
+            int: The total
+        """
+        if( layer in self._stale ):
+            self._buildSAT( layer )
+
+        x0 = max( x, 0 )
+        y0 = max( y, 0 )
+        x1 = min( x + w, self.dim_x )
+        y1 = min( y + h, self.dim_y )
+        if( (x1 <= x0) or (y1 <= y0) ):
+            return 0
+
+        sat = self._sats[ layer ]
+        stride = self.dim_x + 1
+        return ( sat[ x1 + y1 * stride ] - sat[ x0 + y1 * stride ]
+               - sat[ x1 + y0 * stride ] + sat[ x0 + y0 * stride ] )
+
+    def blockSum( self, layer, level, bx, by ):
+        """
+        Total of a layer over an aligned 2^level block.
+
+        Args:
+            layer (string): LYR_XXX name
+            level (int): Pyramid level
+            bx (int): Block X, in blocks
+            by (int): Block Y, in blocks
+
+        Returns:
+            int: The total
+        """
+        pyramid = self._pyramids[ layer ]
+        return pyramid.sums[ level ][ bx + by * pyramid.dims[ level ][0] ]
+
+    def peak( self, layer ):
+        """
+        Find the tile with the highest value, following the max pyramid down.  O(log n).
+
+        Args:
+            layer (string): LYR_XXX name
+
+        Returns:
+            tuple: ( x, y, value )
+        """
+        pyramid = self._pyramids[ layer ]
+        x = y = 0
+        for level in range( len( pyramid.dims ) - 1, 0, -1 ):
+            lo_max = pyramid.maxes[ level - 1 ]
+            lo_x = pyramid.dims[ level - 1 ][0]
+            x, y = max( pyramid.children( level, x, y ),
+                        key=lambda pos: lo_max[ pos[0] + pos[1] * lo_x ] )
+
+        return ( x, y, pyramid.maxes[0][ x + y * self.dim_x ] )
+
+    def bestRegion( self, layer, size, exact=True ):
+        """
+        Find the densest aligned block.
+
+        Exact is best first down the pyramid.  No block of the wanted size under a cell
+        can total more than the cell's sum, or it's max times the block's area, so the
+        first block of the wanted size off the heap is the best.  The max bound makes a
+        saturated field, where the sums can't tell blocks apart, a straight dive, but a
+        field of many near equal blocks can still expand most of the pyramid above the
+        wanted size, O(n / size^2) at worst.  Layer values mustn't be negative.
+
+        Not exact follows the largest sum down, O(log n), but a dense area straddling
+        block boundaries can be missed.
+
+        Args:
+            layer (string): LYR_XXX name
+            size (int): Block size wanted, rounded up to a power of 2
+            exact (bool): Find the best block, rather than a good one quickly
+
+        Returns:
+            tuple: ( x, y, size, total ) of the block in tiles
+        """
+        pyramid = self._pyramids[ layer ]
+        top = len( pyramid.dims ) - 1
+        stop = min( max( size - 1, 0 ).bit_length(), top )
+        span = 1 << stop
+        if( stop == 0 ):
+            # The max pyramid goes straight there
+            x, y, value = self.peak( layer )
+            return ( x, y, 1, value )
+
+        if( not exact ):
+            x = y = 0
+            for level in range( top, stop, -1 ):
+                lo_sum = pyramid.sums[ level - 1 ]
+                lo_x = pyramid.dims[ level - 1 ][0]
+                x, y = max( pyramid.children( level, x, y ),
+                            key=lambda pos: lo_sum[ pos[0] + pos[1] * lo_x ] )
+            return ( x * span, y * span, span, self.blockSum( layer, stop, x, y ) )
+
+        area = span * span
+        # ( -bound, level, y, x ), ties go to the deeper, then top left, block
+        bound = min( pyramid.sums[ top ][0], pyramid.maxes[ top ][0] * area )
+        heap = [ ( -bound, top, 0, 0 ) ]
+        while( True ):
+            neg_bound, level, y, x = heapq.heappop( heap )
+            if( level == stop ):
+                break
+            lo_sum = pyramid.sums[ level - 1 ]
+            lo_max = pyramid.maxes[ level - 1 ]
+            lo_x = pyramid.dims[ level - 1 ][0]
+            for xx, yy in pyramid.children( level, x, y ):
+                idx = xx + yy * lo_x
+                bound = min( lo_sum[ idx ], lo_max[ idx ] * area )
+                heapq.heappush( heap, ( -bound, level - 1, yy, xx ) )
+
+        # At the wanted size the bound is the sum
+        return ( x * span, y * span, span, -neg_bound )
+
+
+if( __name__ == "__main__" ):
+    # regions.py [size] - check bestRegion against totalling every aligned block
+    import random
+    import sys
+    import time
+
+    from mapgen import MapGenerator
+
+    size = int( sys.argv[1] ) if( len( sys.argv ) > 1 ) else 128
+
+    def scan( index, layer, span ):
+        """The best aligned block the slow way, ( x, y, size, total )"""
+        best = None
+        for y in range( 0, index.dim_y, span ):
+            for x in range( 0, index.dim_x, span ):
+                total = index.rectSum( layer, x, y, span, span )
+                if( (best is None) or (total > best[3]) ):
+                    best = ( x, y, span, total )
+        return best
+
+    failed = 0
+    checked = 0
+    slowest = 0.
+    for seed, dim_x, dim_y in ( ( 1, size, size ), ( 2, size, size ), ( 3, size - 28, size // 2 + 5 ) ):
+        mission = MapGenerator( dim_x, dim_y, seed ).mission()
+        field = mission.field
+        index = RegionIndex( field )
+        rand = random.Random( seed )
+
+        for stage in ( "generated", "edited", "saturated" ):
+            if( stage == "edited" ):
+                # Push some changes through the pyramid
+                for _ in range( 500 ):
+                    tile = field.grid[ rand.randrange( dim_y ) ][ rand.randrange( dim_x ) ]
+                    tile.shrooms = rand.randrange( mission.shroom_cap + 1 )
+            elif( stage == "saturated" ):
+                # Near equal blocks, the worst case for the exact search
+                for row in field.grid:
+                    for tile in row:
+                        tile.shrooms = mission.shroom_cap - rand.randrange( 2 )
+
+            for span in ( 1, 2, 4, 8, 16, 32 ):
+                want = scan( index, LYR_SHROOMS, span )
+                start = time.perf_counter()
+                got = index.bestRegion( LYR_SHROOMS, span )
+                slowest = max( slowest, time.perf_counter() - start )
+                greedy = index.bestRegion( LYR_SHROOMS, span, exact=False )
+                checked += 1
+
+                x, y, got_span, total = got
+                ok = ( ( total == want[3] ) and ( got_span == span )
+                       and ( index.rectSum( LYR_SHROOMS, x, y, span, span ) == total )
+                       and ( greedy[3] <= total )
+                       and ( index.rectSum( LYR_SHROOMS, greedy[0], greedy[1], span, span ) == greedy[3] ) )
+                if( not ok ):
+                    failed += 1
+                    print( "seed {} {} size {}: got {}, greedy {}, scan {}".format( seed, stage, span, got, greedy, want ) )
+
+        index.close()
+
+    print( "{} searches, {} wrong, slowest {:.2f}ms".format( checked, failed, slowest * 1e3 ) )
+    sys.exit( 1 if( failed ) else 0 )
@@ -0,0 +1,223 @@
+# render - draw the battlefield in a terminal
+#
+# Only cells that have changed since the last frame are redrawn, using ANSI cursor
+# addressing, so a frame costs what changed rather than the size of the map.
+
+import sys
+
+import mapping as maps
+
+
+TRN_GLYPHS = {
+    maps.TRN_WATER   : "w",
+    maps.TRN_LAND    : "l",
+    maps.TRN_IMPASS  : "x",
+    maps.TRN_LIMINAL : "s",
+}
+
+# Radar shading by shroom density, sparse to dense
+RADAR_SHROOMS = " .:*#"
+RADAR_TERRAIN = {
+    maps.TRN_WATER   : "~",
+    maps.TRN_IMPASS  : "^",
+}
+
+CSI = "\x1b["
+
+
+def moveTo( row, col ):
+    """
+    Args:
+        row (int): Terminal row, 1 based
+        col (int): Terminal column, 1 based
+
+    Returns:
+        string: ANSI sequence to put the cursor there
+    """
+    return "{}{};{}H".format( CSI, row, col )
+
+
+class TerminalView( object ):
+
+    """
+    The tile grid as text, terrain and shroom count per cell.  Cells are wide enough
+    for the mission's shroom_cap.
+
+    Attributes:
+        cell_w (int): Characters per cell
+        field (Map): Map being drawn
+        origin (tuple): ( row, col ) of the top left cell on the terminal, 1 based
+        out (file): Where to write
+    """
+
+    def __init__( self, field, out=None, origin=( 1, 1 ) ):
+        self.field = field
+        self.out = out or sys.stdout
+        self.origin = origin
+
+        # terrain glyph, shroom count, space
+        self._digits = max( len( str( field.mission.shroom_cap ) ), 2 )
+        self._most = 10 ** self._digits - 1
+        self.cell_w = self._digits + 2
+
+        self._dirty = field.trackDirty( ( maps.LYR_TERRAIN, maps.LYR_SHROOMS ) )
+        self._drawn = False
+
+    def close( self ):
+        """
+        Stop watching the map.
+        """
+        self._dirty.stopTracking()
+
+    def cellText( self, tile ):
+        """
+        Args:
+            tile (Tile): Tile to draw
+
+        Returns:
+            string: The tile as text
+        """
+        # Clamped, a wider cell would write over the next one
+        shrooms = min( tile.shrooms, self._most )
+        return "{}{: >{}} ".format( TRN_GLYPHS[ tile.terrain ], shrooms, self._digits )
+
+    def draw( self ):
+        """
+        Draw the changes since the last frame, or everything if this is the first.
+
+        Returns:
+            int: Number of cells drawn
+        """
+        row0, col0 = self.origin
+        grid = self.field.grid
+        chunks = []
+
+        if( not self._drawn ):
+            self._dirty.popCells()
+            for y, row in enumerate( grid ):
+                chunks.append( moveTo( row0 + y, col0 ) )
+                chunks.extend( self.cellText( tile ) for tile in row )
+            drawn = self.field.dim_x * self.field.dim_y
+            self._drawn = True
+
+        else:
+            cells = self._dirty.popCells()
+            for x, y in sorted( cells, key=lambda pos: ( pos[1], pos[0] ) ):
+                chunks.append( moveTo( row0 + y, col0 + x * self.cell_w ) )
+                chunks.append( self.cellText( grid[ y ][ x ] ) )
+            drawn = len( cells )
+
+        if( chunks ):
+            # Park the cursor under the map
+            chunks.append( moveTo( row0 + self.field.dim_y, 1 ) )
+            self.out.write( "".join( chunks ) )
+            self.out.flush()
+
+        return drawn
+
+
+class RadarView( object ):
+
+    """
+    A downsampled minimap.  Each radar pixel covers a _scale_ x _scale_ block of
+    tiles, it's shroom total and terrain counts are kept up to date from tile changes,
+    so only blocks that changed are redrawn.
+
+    Attributes:
+        field (Map): Map being drawn
+        origin (tuple): ( row, col ) of the top left pixel on the terminal, 1 based
+        out (file): Where to write
+        scale (int): Tiles per radar pixel, along each side
+    """
+
+    def __init__( self, field, scale=4, out=None, origin=( 1, 1 ) ):
+        self.field = field
+        self.scale = scale
+        self.out = out or sys.stdout
+        self.origin = origin
+
+        self._dim_x = -(-field.dim_x // scale)
+        self._dim_y = -(-field.dim_y // scale)
+
+        num = self._dim_x * self._dim_y
+        self._shrooms = [ 0 ] * num
+        self._tiles = [ 0 ] * num
+        self._terrain = [ [ 0 ] * len( TRN_GLYPHS ) for _ in range( num ) ]
+        for row in field.grid:
+            for tile in row:
+                block = self._block( tile )
+                self._shrooms[ block ] += tile.shrooms
+                self._tiles[ block ] += 1
+                self._terrain[ block ][ tile.terrain ] += 1
+
+        self._dirty = set( range( num ) )
+        field.addWatcher( self )
+
+    def close( self ):
+        """
+        Stop watching the map.
+        """
+        self.field.removeWatcher( self )
+
+    def _block( self, tile ):
+        x, y = tile.pos
+        return ( x // self.scale ) + ( y // self.scale ) * self._dim_x
+
+    def tileChanged( self, tile, layer, old ):
+        """
+        Map watcher callback, keep the block totals current.
+        """
+        if( layer == maps.LYR_SHROOMS ):
+            block = self._block( tile )
+            self._shrooms[ block ] += tile.shrooms - old
+            self._dirty.add( block )
+
+        elif( layer == maps.LYR_TERRAIN ):
+            block = self._block( tile )
+            self._terrain[ block ][ old ] -= 1
+            self._terrain[ block ][ tile.terrain ] += 1
+            self._dirty.add( block )
+
+    def pixelText( self, block ):
+        """
+        Args:
+            block (int): Radar pixel index
+
+        Returns:
+            string: Character to draw for the block
+        """
+        counts = self._terrain[ block ]
+        most = max( range( len( counts ) ), key=counts.__getitem__ )
+        if( most in RADAR_TERRAIN ):
+            return RADAR_TERRAIN[ most ]
+
+        full = self._tiles[ block ] * self.field.mission.shroom_cap
+        density = self._shrooms[ block ] / full if( full ) else 0.
+        if( density <= 0. ):
+            return RADAR_SHROOMS[0]
+        steps = len( RADAR_SHROOMS ) - 1
+        return RADAR_SHROOMS[ min( 1 + int( density * steps ), steps ) ]
+
+    def draw( self ):
+        """
+        Draw the radar pixels that have changed.
+
+        Returns:
+            int: Number of pixels drawn
+        """
+        if( not self._dirty ):
+            return 0
+
+        row0, col0 = self.origin
+        chunks = []
+        for block in sorted( self._dirty ):
+            by, bx = divmod( block, self._dim_x )
+            chunks.append( moveTo( row0 + by, col0 + bx ) )
+            chunks.append( self.pixelText( block ) )
+        chunks.append( moveTo( row0 + self._dim_y, 1 ) )
+
+        drawn = len( self._dirty )
+        self._dirty = set()
+        self.out.write( "".join( chunks ) )
+        self.out.flush()
+        return drawn
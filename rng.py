@@ -0,0 +1,152 @@
+# rng - counter based random streams
+#
+# Mission.rand is one shared sequence, so what you get depends on who asked first.  That
+# rules out vectorizing, sharding, or reordering anything that uses it.  Here every draw
+# is a hash of ( seed, tick, subsystem, key, counter ), SplitMix64 style, so a draw
+# doesn't depend on any other, and can be made in any order, in bulk, or on another
+# core, and still come out the same.
+
+import zlib
+
+
+MASK_64 = ( 1 << 64 ) - 1
+GOLDEN  = 0x9E3779B97F4A7C15
+
+# Subsystems that draw from the streams
+SUB_SHROOMS = 1
+SUB_WEAPONS = 2
+SUB_LOD     = 3
+
+
+def mix64( z ):
+    """
+    SplitMix64 finaliser, a good 64 bit scramble.
+
+    Args:
+        z (int): 64 bit value
+
+    Returns:
+        int: Scrambled 64 bit value
+    """
+    z = ( ( z ^ ( z >> 30 ) ) * 0xBF58476D1CE4E5B9 ) & MASK_64
+    z = ( ( z ^ ( z >> 27 ) ) * 0x94D049BB133111EB ) & MASK_64
+    return z ^ ( z >> 31 )
+
+
+def subsystemId( name ):
+    """
+    Stable id for a subsystem named by a string, for ones without a SUB_XXX.
+
+    Args:
+        name (string): Subsystem name
+
+    Returns:
+        int: Id to pass as a subsystem
+    """
+    return zlib.crc32( name.encode( "utf-8" ) ) | ( 1 << 32 )
+
+
+class StreamRNG( object ):
+
+    """
+    Counter based random numbers.  Every method takes the ( tick, subsystem, key, n )
+    the draw is for, the key is usually a tile ravel id or entity id, and n counts
+    draws for the same thing on the same tick.
+
+    Attributes:
+        seed (int): The mission seed
+    """
+
+    def __init__( self, seed ):
+        self.seed = seed
+        self._base = mix64( ( seed * GOLDEN ) & MASK_64 )
+
+    def _stream( self, tick, subsystem ):
+        h = mix64( ( self._base + GOLDEN + tick ) & MASK_64 )
+        return mix64( ( h + GOLDEN + subsystem ) & MASK_64 )
+
+    def raw( self, tick, subsystem, key, n=0 ):
+        """
+        Args:
+            tick (int): Game tick
+            subsystem (int): SUB_XXX
+            key (int): Ravel id, entity id, ...
+            n (int): Draw number
+
+        Returns:
+            int: 64 random bits
+        """
+        h = mix64( ( self._stream( tick, subsystem ) + GOLDEN + key ) & MASK_64 )
+        return mix64( ( h + GOLDEN + n ) & MASK_64 )
+
+    def randbelow( self, limit, tick, subsystem, key, n=0 ):
+        """
+        Args:
+            limit (int): Exclusive upper bound
+            tick (int): Game tick
+            subsystem (int): SUB_XXX
+            key (int): Ravel id, entity id, ...
+            n (int): Draw number
+
+        Returns:
+            int: in 0 <= x < limit
+        """
+        return ( self.raw( tick, subsystem, key, n ) * limit ) >> 64
+
+    def random( self, tick, subsystem, key, n=0 ):
+        """
+        Args:
+            tick (int): Game tick
+            subsystem (int): SUB_XXX
+            key (int): Ravel id, entity id, ...
+            n (int): Draw number
+
+        Returns:
+            float: in 0. <= x < 1.
+        """
+        return ( self.raw( tick, subsystem, key, n ) >> 11 ) * ( 1. / ( 1 << 53 ) )
+
+    # Bulk draws #############################################################
+
+    def rawMany( self, tick, subsystem, keys, n=0 ):
+        """
+        Args:
+            tick (int): Game tick
+            subsystem (int): SUB_XXX
+            keys (iterable): Keys to draw for
+            n (int): Draw number
+
+        Returns:
+            list: 64 random bits for each key
+        """
+        stream = self._stream( tick, subsystem ) + GOLDEN
+        tail = GOLDEN + n
+        return [ mix64( ( mix64( ( stream + key ) & MASK_64 ) + tail ) & MASK_64 ) for key in keys ]
+
+    def randbelowMany( self, limit, tick, subsystem, keys, n=0 ):
+        """
+        Args:
+            limit (int): Exclusive upper bound
+            tick (int): Game tick
+            subsystem (int): SUB_XXX
+            keys (iterable): Keys to draw for
+            n (int): Draw number
+
+        Returns:
+            list: in 0 <= x < limit, for each key
+        """
+        return [ ( bits * limit ) >> 64 for bits in self.rawMany( tick, subsystem, keys, n ) ]
+
+    def randomMany( self, tick, subsystem, keys, n=0 ):
+        """
+        Args:
+            tick (int): Game tick
+            subsystem (int): SUB_XXX
+            keys (iterable): Keys to draw for
+            n (int): Draw number
+
+        Returns:
+            list: in 0. <= x < 1., for each key
+        """
+        scale = 1. / ( 1 << 53 )
+        return [ ( bits >> 11 ) * scale for bits in self.rawMany( tick, subsystem, keys, n ) ]
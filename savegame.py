@@ -0,0 +1,661 @@
+# savegame - save and load a running Mission
+#
+# A save is a small header followed by tagged blocks, each zlib compressed.  The map
+# layers go in as raw arrays, the PRNG state as raw words, and the (much smaller)
+# faction, entity, and weapon records as JSON.
+#
+# Autosaves take their snapshot on the simulation thread, which is just copying some
+# arrays that are kept in step with the map, and the entities' attrs into tuples, then
+# encode, compress and write on a background thread so the game doesn't stall.
+
+from array import array
+import json
+from operator import attrgetter
+import os
+import queue
+from random import Random
+import struct
+import threading
+import zlib
+
+from commands import Frago
+from coord import Coord
+import entities
+from equipment import Weapon
+from mapping import LYR_TERRAIN, LYR_OCCUPANCY, LYR_HEAT, LYR_SHROOMS, OCY_BUILDING, OCY_COMMANDABLE
+from mission import Mission
+from rng import StreamRNG
+
+
+SAVE_MAGIC   = b"BRWNSAVE"
+SAVE_VERSION = 1
+
+# magic, version, tick, number of blocks
+HEADER = struct.Struct( "<8sHQI" )
+# tag, raw length, compressed length
+BLOCK = struct.Struct( "<4sII" )
+
+# Mission settings that go in the save
+MISSION_ATTRS = (
+    "map_fq", "rand_seed",
+    "shroom_grow_amount", "shroom_grow_limit", "shroom_spread_limit", "shroom_cap",
+    "heat_cap", "heat_decay", "fixed_point",
+)
+
+# Entity attrs that go in the save, if the entity has them
+ENTITY_ATTRS = (
+    "id", "x", "y", "altitude", "size", "heat", "sight_range", "hit_points",
+    "is_active", "is_destructable", "is_movable", "speed", "native",
+    "cost", "build_time", "power_output", "power_draw",
+)
+
+WEAPON_ATTRS = ( "name", "state", "count", "rof", "range", "warmup", "cooldown", "dispersion" )
+
+# Frago attrs that go in the save, the target is saved by id or position, and the
+# coordination (squads) isn't saved
+FRAGO_ATTRS = ( "kind", "urgency", "tasks", "issued" )
+
+FACTION_ATTRS = ( "name", "tech_level", "money", "power", "is_ai", "ai_budget" )
+
+# Layer block tag -> ( map layer, array typecode )
+LAYER_BLOCKS = {
+    b"TERR" : ( LYR_TERRAIN,   "B" ),
+    b"OCCY" : ( LYR_OCCUPANCY, "B" ),
+    b"HEAT" : ( LYR_HEAT,      "i" ),
+    b"SHRM" : ( LYR_SHROOMS,   "i" ),
+    b"MOVE" : ( "move_limit",  "i" ),
+}
+
+
+# Occupancy flags that come from the factions' entities.  They're registered again from
+# the entities by an OccupancyManager on the loaded mission, so only the flags the map
+# itself put down (ruins, trees) are saved.
+OCY_DYNAMIC = OCY_BUILDING | OCY_COMMANDABLE
+_STATIC_OCY = bytes( flags & ~OCY_DYNAMIC for flags in range( 256 ) )
+
+
+class SaveError( Exception ):
+    """
+    The save file is damaged, from an unknown version, or not a save at all.
+    """
+    pass
+
+
+class LayerMirror( object ):
+
+    """
+    Flat arrays of the map layers, kept in step with the map by watching it, so a
+    snapshot is a handful of memory copies instead of a walk over every Tile.  The
+    speed layer isn't watched, it doesn't change during a mission.
+
+    Attributes:
+        field (Map): The map being mirrored
+        layers (dict): layer name -> array in ravel order
+    """
+
+    def __init__( self, field ):
+        self.field = field
+        tiles = [ tile for row in field.grid for tile in row ]
+        self.layers = {}
+        for layer, typecode in LAYER_BLOCKS.values():
+            self.layers[ layer ] = array( typecode, ( getattr( tile, layer ) for tile in tiles ) )
+
+        field.addWatcher( self )
+
+    def close( self ):
+        """
+        Stop watching the map.
+        """
+        self.field.removeWatcher( self )
+
+    def tileChanged( self, tile, layer, old ):
+        """
+        Map watcher callback, copy the new value.
+        """
+        mirror = self.layers.get( layer )
+        if( mirror is not None ):
+            mirror[ tile.ravel_id ] = getattr( tile, layer )
+
+
+class Snapshot( object ):
+
+    """
+    Everything needed to restore a mission, uncompressed.  The factions are kept as
+    captured, and only made into JSON when written.
+
+    Attributes:
+        blocks (list): ( tag, raw bytes ) to write
+        factions (list): Captured factions, see _captureFaction()
+        tick (int): Game tick of the snapshot
+    """
+
+    def __init__( self, tick, blocks, factions=() ):
+        self.tick = tick
+        self.blocks = blocks
+        self.factions = factions
+
+    @classmethod
+    def capture( cls, mission, mirror=None ):
+        """
+        Take a consistent snapshot of the mission.
+
+        Args:
+            mission (Mission): The mission
+            mirror (LayerMirror): Up to date copy of the map layers, makes this quick
+
+        Returns:
+            Snapshot: The snapshot
+        """
+        field = mission.field
+        if( mirror is None ):
+            mirror = LayerMirror( field )
+            mirror.close()
+
+        settings = { attr: getattr( mission, attr, None ) for attr in MISSION_ATTRS }
+        settings[ "DIMS" ] = [ field.dim_x, field.dim_y ]
+
+        rand_version, rand_words, gauss_next = mission.rand.getstate()
+        settings[ "RAND" ] = [ rand_version, gauss_next ]
+
+        blocks = [ ( b"MISN", json.dumps( settings ).encode( "utf-8" ) ) ]
+        for tag, ( layer, _ ) in LAYER_BLOCKS.items():
+            raw = mirror.layers[ layer ].tobytes()
+            if( layer == LYR_OCCUPANCY ):
+                raw = raw.translate( _STATIC_OCY )
+            blocks.append( ( tag, raw ) )
+        blocks.append( ( b"RAND", array( "I", rand_words ).tobytes() ) )
+
+        factions = [ _captureFaction( faction ) for faction in mission.factions ]
+
+        return cls( mission.clock.now, blocks, factions )
+
+    def write( self, path ):
+        """
+        Compress and write the snapshot.  Written to the side and moved into place, so
+        a crash mid-write doesn't wreck an existing save.
+
+        Args:
+            path (string): File to write
+        """
+        records = [ _factionRecord( raw ) for raw in self.factions ]
+        blocks = self.blocks + [ ( b"ENTS", json.dumps( records ).encode( "utf-8" ) ) ]
+
+        tmp = path + ".tmp"
+        with open( tmp, "wb" ) as fh:
+            fh.write( HEADER.pack( SAVE_MAGIC, SAVE_VERSION, self.tick, len( blocks ) ) )
+            for tag, raw in blocks:
+                packed = zlib.compress( raw )
+                fh.write( BLOCK.pack( tag, len( raw ), len( packed ) ) )
+                fh.write( packed )
+        os.replace( tmp, path )
+
+
+# Capturing ####################################################################
+#
+# On the clock the factions and entities are only copied into tuples, attrgetters do
+# that in C.  They're made into records and encoded on the writer.  Attr values are
+# kept by reference, which is fine for numbers and strings, and entity sizes, which are
+# replaced rather than changed in place.
+
+_FACTION_GET = attrgetter( *FACTION_ATTRS )
+_WEAPON_GET = attrgetter( *WEAPON_ATTRS )
+
+# Entity class -> ( class name, ENTITY_ATTRS it has, attrgetter of them, is Commandable )
+_ENTITY_GETS = {}
+
+
+def _captureFaction( faction ):
+    # Builds and harvests, so a Ledger on the loaded mission carries on
+    state = faction.ledger.state() if( faction.ledger is not None ) else faction.ledger_state
+    ledger = None
+    if( state is not None ):
+        ledger = (
+            _captureEntities( state[ "queued" ] ),
+            _captureEntities( [ ent for ent, _ in state[ "building" ] ] ),
+            [ finish for _, finish in state[ "building" ] ],
+            list( state[ "harvest" ] ),
+        )
+
+    return ( _FACTION_GET( faction ), _captureEntities( faction.buildings + faction.units ),
+             len( faction.buildings ), ledger )
+
+
+def _captureEntities( ents ):
+    """
+    Returns:
+        tuple: ( count, classes, weapons, orders ).  classes is a list of ( ( class
+            name, attr names, getter, is Commandable ), indices, attr values ) per entity
+            class.  weapons and orders are { index: captured } for the entities that
+            have any
+    """
+    groups = {}
+    for idx, cls in enumerate( map( type, ents ) ):
+        indices = groups.get( cls )
+        if( indices is None ):
+            indices = groups[ cls ] = []
+        indices.append( idx )
+
+    classes = []
+    for cls, indices in groups.items():
+        gets = _ENTITY_GETS.get( cls )
+        if( gets is None ):
+            gets = _entityGets( ents[ indices[0] ] )
+        members = ents if( len( groups ) == 1 ) else [ ents[ idx ] for idx in indices ]
+        classes.append( ( gets, indices, list( map( gets[2], members ) ) ) )
+
+    weapons = { idx: tuple( ( _WEAPON_GET( weapon ), _targetId( weapon.target ) ) for weapon in ent.weapon )
+                for idx, ent in enumerate( ents ) if ent.weapon }
+
+    commandable = entities.Commandable
+    orders = { idx: _captureOrders( ent ) for idx, ent in enumerate( ents )
+               if( isinstance( ent, commandable ) and (ent.command_queue or (ent.order is not None)) ) }
+
+    return ( len( ents ), classes, weapons, orders )
+
+
+def _entityGets( entity ):
+    cls = type( entity )
+    names = tuple( attr for attr in ENTITY_ATTRS if hasattr( entity, attr ) )
+    gets = ( cls.__name__, names, attrgetter( *names ), isinstance( entity, entities.Commandable ) )
+    _ENTITY_GETS[ cls ] = gets
+    return gets
+
+
+def _captureOrders( entity ):
+    # Fragos don't change once issued, so the orders themselves are kept.  In the order
+    # they'll be carried out, so loading keeps it
+    waiting = sorted( e for e in entity.command_queue if e[2] is not None )
+    return ( [ e[2] for e in waiting ], entity.order )
+
+
+def _targetId( target ):
+    return getattr( target, "id", None ) if( target is not None ) else None
+
+
+def _factionRecord( raw ):
+    values, captured, buildings, ledger = raw
+    rec = dict( zip( FACTION_ATTRS, values ) )
+    rec[ "entities" ] = _entityRecords( captured )
+    rec[ "buildings" ] = buildings
+    if( ledger is not None ):
+        queued, building, finishes, harvest = ledger
+        rec[ "ledger" ] = {
+            "queued"   : _entityRecords( queued ),
+            "building" : [ [ e_rec, finish ] for e_rec, finish in zip( _entityRecords( building ), finishes ) ],
+            "harvest"  : [ list( entry ) for entry in harvest ],
+        }
+    return rec
+
+
+def _entityRecords( captured ):
+    count, classes, weapons, orders = captured
+    records = [ None ] * count
+    for ( name, names, _, is_commandable ), indices, values in classes:
+        single = len( names ) == 1
+        for idx, vals in zip( indices, values ):
+            rec = dict( zip( names, ( vals, ) if( single ) else vals ) )
+            rec[ "class" ] = name
+            rec[ "weapons" ] = []
+            if( is_commandable ):
+                rec[ "orders" ] = []
+                rec[ "order" ] = None
+            records[ idx ] = rec
+
+    for idx, ( waiting, order ) in orders.items():
+        rec = records[ idx ]
+        rec[ "orders" ] = [ _fragoRecord( frago ) for frago in waiting ]
+        rec[ "order" ] = _fragoRecord( order ) if( order is not None ) else None
+
+    for idx, captured_weapons in weapons.items():
+        w_recs = records[ idx ][ "weapons" ]
+        for w_values, target_id in captured_weapons:
+            w_rec = dict( zip( WEAPON_ATTRS, w_values ) )
+            w_rec[ "target" ] = target_id
+            w_recs.append( w_rec )
+
+    return records
+
+
+def _fragoRecord( frago ):
+    rec = { attr: getattr( frago, attr ) for attr in FRAGO_ATTRS }
+    target = frago.target
+    if( isinstance( target, entities.Entity ) ):
+        rec[ "target" ] = { "id": target.id }
+    elif( isinstance( target, Coord ) ):
+        rec[ "target" ] = { "xy": [ target.x, target.y ] }
+    else:
+        rec[ "target" ] = None
+    return rec
+
+
+def _loadFrago( rec, by_id ):
+    frago = Frago( rec[ "kind" ] )
+    for attr in FRAGO_ATTRS:
+        setattr( frago, attr, rec[ attr ] )
+    target = rec[ "target" ]
+    if( target is None ):
+        pass
+    elif( "id" in target ):
+        frago.target = by_id.get( target[ "id" ] )
+    else:
+        frago.target = Coord( *target[ "xy" ] )
+    return frago
+
+
+def saveGame( mission, path, mirror=None ):
+    """
+    Save a mission, right now, on this thread.
+
+    Args:
+        mission (Mission): The mission
+        path (string): File to write
+        mirror (LayerMirror): Up to date copy of the map layers, if there is one
+    """
+    Snapshot.capture( mission, mirror ).write( path )
+
+
+def loadGame( path, classes=None ):
+    """
+    Restore a saved mission, ready to carry on from the tick it was saved on.
+
+    Scheduled clock events (AI decisions, autosaves) aren't saved, those systems need
+    to be started again on the loaded mission.
+
+    Args:
+        path (string): Save file
+        classes (dict): Class name -> class, for entity classes outside entities.py
+
+    Returns:
+        Mission: The mission
+    """
+    with open( path, "rb" ) as fh:
+        data = fh.read()
+
+    if( len( data ) < HEADER.size ):
+        raise SaveError( "'{}' is too short to be a save".format( path ) )
+    magic, version, tick, count = HEADER.unpack_from( data, 0 )
+    if( magic != SAVE_MAGIC ):
+        raise SaveError( "'{}' is not a save".format( path ) )
+    if( version != SAVE_VERSION ):
+        raise SaveError( "'{}' is save version {}, expected {}".format( path, version, SAVE_VERSION ) )
+
+    blocks = {}
+    offset = HEADER.size
+    for _ in range( count ):
+        if( offset + BLOCK.size > len( data ) ):
+            raise SaveError( "'{}' is truncated".format( path ) )
+        tag, raw_len, packed_len = BLOCK.unpack_from( data, offset )
+        offset += BLOCK.size
+        if( offset + packed_len > len( data ) ):
+            raise SaveError( "'{}' is truncated in block {}".format( path, tag ) )
+        try:
+            raw = zlib.decompress( data[ offset:offset + packed_len ] )
+        except zlib.error as err:
+            raise SaveError( "'{}' block {} is damaged: {}".format( path, tag, err ) ) from err
+        offset += packed_len
+        if( len( raw ) != raw_len ):
+            raise SaveError( "'{}' block {} is damaged".format( path, tag ) )
+        blocks[ tag ] = raw
+
+    for tag in ( b"MISN", b"RAND", b"ENTS" ) + tuple( LAYER_BLOCKS ):
+        if( tag not in blocks ):
+            raise SaveError( "'{}' has no {} block".format( path, tag ) )
+
+    # Mission settings
+    settings = json.loads( blocks[ b"MISN" ].decode( "utf-8" ) )
+    mission = Mission( None )
+    for attr in MISSION_ATTRS:
+        # Saves from before a setting was added keep the default
+        if( attr in settings ):
+            setattr( mission, attr, settings[ attr ] )
+    mission.clock.now = tick
+
+    rand_version, gauss_next = settings[ "RAND" ]
+    rand_words = tuple( array( "I", blocks[ b"RAND" ] ) )
+    mission.rand = Random()
+    mission.rand.setstate( ( rand_version, rand_words, gauss_next ) )
+    mission.streams = StreamRNG( mission.rand_seed )
+
+    # The map
+    dim_x, dim_y = settings[ "DIMS" ]
+    mission.buildField( dim_x, dim_y )
+    tiles = [ tile for row in mission.field.grid for tile in row ]
+    for tag, ( layer, typecode ) in LAYER_BLOCKS.items():
+        raw = blocks[ tag ]
+        if( layer == LYR_OCCUPANCY ):
+            # Saves from before the entity flags were left out
+            raw = raw.translate( _STATIC_OCY )
+        values = array( typecode )
+        values.frombytes( raw )
+        for tile, val in zip( tiles, values ):
+            setattr( tile, layer, val )
+
+    # The belligerents
+    lut = dict( vars( entities ) )
+    lut.update( classes or {} )
+    targets = []
+    orders = []
+    by_id = {}
+    for rec in json.loads( blocks[ b"ENTS" ].decode( "utf-8" ) ):
+        faction = entities.Faction( rec[ "name" ] )
+        for attr in FACTION_ATTRS:
+            setattr( faction, attr, rec[ attr ] )
+
+        for idx, e_rec in enumerate( rec[ "entities" ] ):
+            ent = _loadEntity( e_rec, mission, lut, targets, orders )
+            ent.alegiance = faction
+            by_id[ ent.id ] = ent
+            if( idx < rec[ "buildings" ] ):
+                faction.buildings.append( ent )
+            else:
+                faction.units.append( ent )
+
+        l_rec = rec.get( "ledger" )
+        if( l_rec is not None ):
+            # Picked up by the next Ledger made for the faction
+            faction.ledger_state = {
+                "queued"   : [ _loadEntity( e_rec, mission, lut, targets, orders )
+                               for e_rec in l_rec[ "queued" ] ],
+                "building" : [ ( _loadEntity( e_rec, mission, lut, targets, orders ), finish )
+                               for e_rec, finish in l_rec[ "building" ] ],
+                "harvest"  : [ tuple( harvest ) for harvest in l_rec[ "harvest" ] ],
+            }
+
+        mission.factions.append( faction )
+
+    for weapon, target_id in targets:
+        weapon.target = by_id.get( target_id )
+
+    for ent, e_rec in orders:
+        if( e_rec[ "order" ] is not None ):
+            ent.order = _loadFrago( e_rec[ "order" ], by_id )
+        for f_rec in e_rec[ "orders" ]:
+            ent.frago( _loadFrago( f_rec, by_id ) )
+
+    return mission
+
+
+def _loadEntity( e_rec, mission, lut, targets, orders ):
+    """
+    Make an entity from it's record.  Weapon targets and orders refer to other entities,
+    so they're noted in _targets_ and _orders_ to be sorted out once everything's loaded.
+
+    Returns:
+        Entity: The entity
+    """
+    cls = lut.get( e_rec[ "class" ] )
+    if( cls is None ):
+        raise SaveError( "Unknown entity class '{}'".format( e_rec[ "class" ] ) )
+    ent = mission.entityClass( cls )()
+    for attr in ENTITY_ATTRS:
+        if( attr in e_rec ):
+            setattr( ent, attr, e_rec[ attr ] )
+
+    if( e_rec[ "weapons" ] ):
+        ent.weapon = []
+    for w_rec in e_rec[ "weapons" ]:
+        weapon = Weapon( ent, w_rec[ "name" ] )
+        for attr in WEAPON_ATTRS:
+            if( attr in w_rec ):
+                setattr( weapon, attr, w_rec[ attr ] )
+        ent.weapon.append( weapon )
+        if( w_rec[ "target" ] is not None ):
+            targets.append( ( weapon, w_rec[ "target" ] ) )
+
+    if( "orders" in e_rec ):
+        orders.append( ( ent, e_rec ) )
+
+    return ent
+
+
+class AutoSaver( object ):
+
+    """
+    Saves the mission every _interval_ ticks.  The snapshot is taken on the clock, the
+    compression and disk write happen on a background thread.  If the writer is
+    still behind by a whole save when the next is due, the new one is skipped.
+
+    Attributes:
+        error (OSError): The last write failure, if there was one
+        interval (int): Ticks between saves
+        mission (Mission): The mission
+        path (string): File to write, may contain {tick}
+        saved (int): Saves written
+        skipped (int): Saves skipped because the writer was busy
+    """
+
+    def __init__( self, mission, path, interval=15 * 60 ):
+        self.mission = mission
+        self.path = path
+        self.interval = interval
+
+        self.saved = 0
+        self.skipped = 0
+        self.error = None
+
+        self._mirror = LayerMirror( mission.field )
+        self._queue = queue.Queue( maxsize=1 )
+        self._thread = threading.Thread( target=self._writer, name="autosave", daemon=True )
+        self._thread.start()
+        self._handle = mission.clock.scheduleIn( interval, self.save )
+
+    def save( self ):
+        """
+        Snapshot the mission and hand it to the writer.  Runs on the clock.
+        """
+        self._handle = self.mission.clock.scheduleIn( self.interval, self.save )
+        if( self._queue.full() ):
+            # Don't bother taking a snapshot that can't be written
+            self.skipped += 1
+            return
+        snap = Snapshot.capture( self.mission, self._mirror )
+        try:
+            self._queue.put_nowait( snap )
+        except queue.Full:
+            self.skipped += 1
+
+    def _writer( self ):
+        while( True ):
+            snap = self._queue.get()
+            if( snap is None ):
+                return
+            try:
+                snap.write( self.path.format( tick=snap.tick ) )
+                self.saved += 1
+            except OSError as err:
+                self.error = err
+            finally:
+                self._queue.task_done()
+
+    def stop( self ):
+        """
+        Stop saving, waiting for a save in progress to finish.
+        """
+        if( self._handle is not None ):
+            self.mission.clock.cancel( self._handle )
+            self._handle = None
+        self._queue.join()
+        self._queue.put( None )
+        self._thread.join()
+        self._mirror.close()
+
+
+if( __name__ == "__main__" ):
+    # savegame.py [ticks] - save a faction mid build, load it, and check a new Ledger
+    # carries on exactly as the original does
+    import sys
+    import tempfile
+
+    from economy import Ledger
+    from mapgen import MapGenerator
+
+    ticks = int( sys.argv[1] ) if( len( sys.argv ) > 1 ) else 300
+    save_at = 60
+
+    def harvest( tick ):
+        """The same drip of money on both sides"""
+        return 45 if( tick % 7 == 0 ) else 0
+
+    def structure( cost, build_time, power_output=0, power_draw=0 ):
+        building = entities.Structure()
+        building.cost = cost
+        building.build_time = build_time
+        building.power_output = power_output
+        building.power_draw = power_draw
+        return building
+
+    mission = MapGenerator( 32, 32, 7 ).mission()
+    faction = entities.Faction( "red" )
+    faction.money = 500
+    plant = structure( 300, 40, power_output=10 )
+    plant.id = 1
+    faction.buildings.append( plant )
+    mission.factions.append( faction )
+
+    ledger = Ledger( faction, mission.clock, window=50 )
+    # The second build pushes the power short, so the ones after it take twice as long
+    for cost, build_time, draw in ( ( 300, 40, 4 ), ( 400, 30, 8 ), ( 200, 25, 2 ), ( 250, 20, 1 ) ):
+        ledger.queueBuild( structure( cost, build_time, power_draw=draw ) )
+
+    def state( ledger ):
+        """Everything the HUD and AI can see of the economy"""
+        faction = ledger.faction
+        return ( faction.money, faction.power, len( faction.buildings ), ledger.pending_cost,
+                 ledger.queued(), tuple( job.finish for job in ledger.inProgress() ), ledger.income() )
+
+    def step( mission, ledger ):
+        tick = mission.tick()
+        amount = harvest( tick )
+        if( amount ):
+            ledger.harvested( amount )
+        return state( ledger )
+
+    for _ in range( save_at ):
+        step( mission, ledger )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join( tmp, "check.sav" )
+        saveGame( mission, path )
+        loaded = loadGame( path )
+
+    l_faction = loaded.factions[0]
+    l_ledger = Ledger( l_faction, loaded.clock, window=50 )
+
+    failed = 0
+    if( state( l_ledger ) != state( ledger ) ):
+        failed += 1
+        print( "after loading: {} != {}".format( state( l_ledger ), state( ledger ) ) )
+    if( l_faction.ledger_state is not None ):
+        failed += 1
+        print( "the new Ledger left faction.ledger_state behind" )
+
+    for _ in range( ticks ):
+        want = step( mission, ledger )
+        got = step( loaded, l_ledger )
+        if( got != want ):
+            failed += 1
+            print( "tick {}: loaded {} != original {}".format( mission.clock.now, got, want ) )
+
+    print( "saved on tick {}, ran {} ticks after, {} built, {} differences".format(
+        save_at, ticks, len( faction.buildings ) - 1, failed ) )
+    sys.exit( 1 if( failed ) else 0 )
@@ -0,0 +1,313 @@
+# sight - line of sight, and line of fire
+#
+# Entity.fireOn and the fog of war both need "can A see/hit B" through impassable
+# terrain and buildings.  Rays are walked over a packed blocker layer, rather than
+# Map.accessXY, and the answers are cached by ( source cell, target cell ), least
+# recently used going first when the cache is full.  Each blocker cell remembers which
+# cached rays cross it, so a change only throws away the rays it could affect.
+
+from collections import OrderedDict
+
+from mapping import TRN_IMPASS, OCY_BUILDING, OCY_IMMOVEABLE, LYR_TERRAIN, LYR_OCCUPANCY
+
+
+# What gets in the way
+BLOCK_SIGHT = 1
+BLOCK_FIRE  = 1 << 1
+
+# Occupancy that stops a bullet but not a look
+MASK_FIRE_BLOCKING = OCY_BUILDING | OCY_IMMOVEABLE
+
+
+def blockerBits( tile ):
+    """
+    Args:
+        tile (Tile): The tile
+
+    Returns:
+        int: BLOCK_XXX bits for the tile
+    """
+    bits = 0
+    if( tile.terrain == TRN_IMPASS ):
+        # Cliffs and ridges
+        bits |= BLOCK_SIGHT | BLOCK_FIRE
+    if( tile.occupancy_flags & OCY_BUILDING ):
+        bits |= BLOCK_SIGHT
+    if( tile.occupancy_flags & MASK_FIRE_BLOCKING ):
+        bits |= BLOCK_FIRE
+    return bits
+
+
+def rayCells( x0, y0, x1, y1 ):
+    """
+    The cells a ray passes between two cells, Bresenham style, ends excluded.
+
+    Args:
+        x0 (int): Source X
+        y0 (int): Source Y
+        x1 (int): Target X
+        y1 (int): Target Y
+
+    Returns:
+        list: of ( x, y ) cells between the ends
+    """
+    cells = []
+    dx = abs( x1 - x0 )
+    dy = -abs( y1 - y0 )
+    step_x = 1 if( x0 < x1 ) else -1
+    step_y = 1 if( y0 < y1 ) else -1
+    err = dx + dy
+    x = x0
+    y = y0
+    while( True ):
+        if( (x == x1) and (y == y1) ):
+            break
+        e2 = 2 * err
+        if( e2 >= dy ):
+            err += dy
+            x += step_x
+        if( e2 <= dx ):
+            err += dx
+            y += step_y
+        if( (x != x1) or (y != y1) ):
+            cells.append( ( x, y ) )
+    return cells
+
+
+class SightService( object ):
+
+    """
+    Cached line of sight / fire over a Map.  Registers itself as a watcher of the map.
+
+    Attributes:
+        dim_x (int): Map Dimention X
+        dim_y (int): Map Dimention Y
+        field (Map): The map
+        hits (int): Cache hits
+        max_rays (int): Rays to cache
+        misses (int): Cache misses, rays walked
+    """
+
+    def __init__( self, field, max_rays=1 << 16 ):
+        self.field = field
+        self.max_rays = max_rays
+        self.dim_x = field.dim_x
+        self.dim_y = field.dim_y
+
+        self._blockers = bytearray( blockerBits( tile ) for row in field.grid for tile in row )
+
+        # ( src ravel, tgt ravel ) -> ( BLOCK_XXX bits of everything along the ray,
+        # ravels the ray crosses ), least recently used first
+        self._cache = OrderedDict()
+        # ravel -> set of cache keys whose rays cross it
+        self._crossing = {}
+
+        self.hits = 0
+        self.misses = 0
+
+        field.addWatcher( self )
+
+    def close( self ):
+        """
+        Stop watching the map.
+        """
+        self.field.removeWatcher( self )
+
+    def tileChanged( self, tile, layer, old ):
+        """
+        Map watcher callback, update the blocker layer and drop rays through the tile.
+        """
+        if( (layer != LYR_TERRAIN) and (layer != LYR_OCCUPANCY) ):
+            return
+
+        idx = tile.ravel_id
+        bits = blockerBits( tile )
+        if( bits == self._blockers[ idx ] ):
+            return
+        self._blockers[ idx ] = bits
+
+        for key in tuple( self._crossing.get( idx, () ) ):
+            self._drop( key )
+
+    def _drop( self, key ):
+        """
+        Forget a cached ray, and take it off the cells it crosses.
+        """
+        _, cells = self._cache.pop( key )
+        crossing = self._crossing
+        for idx in cells:
+            keys = crossing[ idx ]
+            keys.discard( key )
+            if( not keys ):
+                del crossing[ idx ]
+
+    def _trace( self, src, tgt ):
+        """
+        Get the blockers along a ray, from the cache or by walking it.
+
+        Args:
+            src (tuple): ( x, y ) source cell
+            tgt (tuple): ( x, y ) target cell
+
+        Returns:
+            int: BLOCK_XXX bits of everything between the ends
+        """
+        dim_x = self.dim_x
+        key = ( src[0] + src[1] * dim_x, tgt[0] + tgt[1] * dim_x )
+        cache = self._cache
+        entry = cache.get( key )
+        if( entry is not None ):
+            self.hits += 1
+            cache.move_to_end( key )
+            return entry[0]
+
+        self.misses += 1
+        if( len( cache ) >= self.max_rays ):
+            self._drop( next( iter( cache ) ) )
+
+        bits = 0
+        blockers = self._blockers
+        crossing = self._crossing
+        cells = tuple( x + y * dim_x for x, y in rayCells( src[0], src[1], tgt[0], tgt[1] ) )
+        for idx in cells:
+            bits |= blockers[ idx ]
+            crossing.setdefault( idx, set() ).add( key )
+
+        cache[ key ] = ( bits, cells )
+        return bits
+
+    def _cell( self, where ):
+        if( isinstance( where, tuple ) ):
+            return where
+        return where.asCellPos()
+
+    # Queries ################################################################
+
+    def canSee( self, source, target ):
+        """
+        Args:
+            source (Coord / tuple): Looker, a Coord, Entity, or ( x, y ) cell
+            target (Coord / tuple): Lookee
+
+        Returns:
+            bool: Nothing blocks the view
+        """
+        return not ( self._trace( self._cell( source ), self._cell( target ) ) & BLOCK_SIGHT )
+
+    def canHit( self, source, target ):
+        """
+        Args:
+            source (Coord / tuple): Shooter, a Coord, Entity, or ( x, y ) cell
+            target (Coord / tuple): Shootee
+
+        Returns:
+            bool: Nothing blocks a direct shot
+        """
+        return not ( self._trace( self._cell( source ), self._cell( target ) ) & BLOCK_FIRE )
+
+    def canSeeMany( self, pairs ):
+        """
+        Batched canSee, repeated rays in a batch are only walked once.
+
+        Args:
+            pairs (iterable): ( source, target ) pairs
+
+        Returns:
+            list: bool for each pair
+        """
+        return [ not ( bits & BLOCK_SIGHT ) for bits in self._traceMany( pairs ) ]
+
+    def canHitMany( self, pairs ):
+        """
+        Batched canHit.
+
+        Args:
+            pairs (iterable): ( source, target ) pairs
+
+        Returns:
+            list: bool for each pair
+        """
+        return [ not ( bits & BLOCK_FIRE ) for bits in self._traceMany( pairs ) ]
+
+    def _traceMany( self, pairs ):
+        cell = self._cell
+        trace = self._trace
+        return [ trace( cell( src ), cell( tgt ) ) for src, tgt in pairs ]
+
+    def cacheSize( self ):
+        """
+        Returns:
+            int: Rays in the cache
+        """
+        return len( self._cache )
+
+
+if( __name__ == "__main__" ):
+    # sight.py [queries] [max_rays] - check the cached rays against walking every ray
+    import random
+    import sys
+
+    from mapgen import MapGenerator
+    from mapping import TRN_LAND, OCY_NONE
+
+    queries  = int( sys.argv[1] ) if( len( sys.argv ) > 1 ) else 20000
+    max_rays = int( sys.argv[2] ) if( len( sys.argv ) > 2 ) else 2000
+
+    mission = MapGenerator( 96, 96, 6 ).mission()
+    field = mission.field
+    service = SightService( field, max_rays=max_rays )
+    rand = random.Random( 6 )
+
+    def walk( src, tgt ):
+        """BLOCK_XXX bits along the ray, straight off the tiles"""
+        bits = 0
+        for x, y in rayCells( src[0], src[1], tgt[0], tgt[1] ):
+            bits |= blockerBits( field.accessXY( x, y ) )
+        return bits
+
+    def consistent():
+        """The cache and the crossing sets agree with each other"""
+        cache = service._cache
+        if( len( cache ) > service.max_rays ):
+            return False
+        for key, ( bits, cells ) in cache.items():
+            if( any( key not in service._crossing.get( idx, () ) for idx in cells ) ):
+                return False
+        for idx, keys in service._crossing.items():
+            if( (not keys) or any( idx not in cache[ key ][1] for key in keys ) ):
+                return False
+        return True
+
+    # A few units looking at each other a lot, so rays are asked for again
+    spots = [ ( rand.randrange( field.dim_x ), rand.randrange( field.dim_y ) ) for _ in range( 120 ) ]
+
+    failed = 0
+    for query in range( queries ):
+        if( query % 50 == 0 ):
+            # Buildings go up and come down, ridges get blown open
+            for _ in range( 5 ):
+                tile = field.accessXY( rand.randrange( field.dim_x ), rand.randrange( field.dim_y ) )
+                if( rand.random() < 0.8 ):
+                    tile.occupancy_flags = MASK_FIRE_BLOCKING if( tile.occupancy_flags == OCY_NONE ) else OCY_NONE
+                else:
+                    tile.terrain = TRN_LAND if( tile.terrain == TRN_IMPASS ) else TRN_IMPASS
+
+        src = rand.choice( spots )
+        tgt = rand.choice( spots )
+        bits = walk( src, tgt )
+        if( (service.canSee( src, tgt ) != (not (bits & BLOCK_SIGHT)))
+                or (service.canHit( src, tgt ) != (not (bits & BLOCK_FIRE))) ):
+            failed += 1
+            print( "{} -> {}: cached {}, walked {}".format( src, tgt, service._trace( src, tgt ), bits ) )
+
+        if( (query % 1000 == 0) and not consistent() ):
+            failed += 1
+            print( "cache and crossing sets disagree after {} queries".format( query ) )
+
+    if( not consistent() ):
+        failed += 1
+        print( "cache and crossing sets disagree at the end" )
+
+    print( "{} queries, {} wrong, {} hits, {} misses, {} rays cached".format(
+        queries, failed, service.hits, service.misses, service.cacheSize() ) )
+    sys.exit( 1 if( failed ) else 0 )
@@ -0,0 +1,323 @@
+# squads - move groups of units together
+#
+# A Squad shares one path.  The path is turned into formation slots that travel along
+# it, and every member of every squad is steered towards it's slot in one pass:
+# seek the slot, separate from neighbours, cohere to the squad, and slide off
+# obstacles.  Neighbours come from cell buckets, so it's O(n) not O(n^2) in the
+# number of units.
+
+import math
+
+
+FORMATIONS = ( "column", "line", "wedge", "box" )
+
+
+def formationOffsets( formation, count, spacing ):
+    """
+    Slot offsets for a formation, in the squad's own frame.
+
+    Args:
+        formation (string): One of FORMATIONS
+        count (int): Number of slots
+        spacing (float): Tiles between slots
+
+    Returns:
+        list: of ( right, back ) offsets from the squad's anchor, in tiles
+    """
+    if( not spacing > 0 ):
+        raise ValueError( "Formation spacing must be more than 0, not {}".format( spacing ) )
+
+    if( formation == "column" ):
+        return [ ( 0., i * spacing ) for i in range( count ) ]
+
+    if( formation == "line" ):
+        mid = ( count - 1 ) / 2.
+        return [ ( ( i - mid ) * spacing, 0. ) for i in range( count ) ]
+
+    if( formation == "wedge" ):
+        offsets = []
+        for i in range( count ):
+            rank = ( i + 1 ) // 2
+            side = -1 if( i % 2 ) else 1
+            offsets.append( ( side * rank * spacing, rank * spacing ) )
+        return offsets
+
+    if( formation == "box" ):
+        cols = max( int( math.ceil( math.sqrt( count ) ) ), 1 )
+        mid = ( cols - 1 ) / 2.
+        return [ ( ( i % cols - mid ) * spacing, ( i // cols ) * spacing ) for i in range( count ) ]
+
+    raise ValueError( "Unknown formation '{}'".format( formation ) )
+
+
+class Squad( object ):
+
+    """
+    A group of Moveables following a shared path in formation.
+
+    Attributes:
+        anchor (list): [ x, y ] where the formation's lead slot is, in tiles
+        faction (Faction): Owner
+        formation (string): One of FORMATIONS
+        heading (float): Direction of travel, degrees - North = 0, clockwise
+        members (list): The Moveables
+        path (list): ( x, y ) waypoints still to reach, in tiles
+        spacing (float): Tiles between slots
+    """
+
+    def __init__( self, faction, members, formation="wedge", spacing=1.0 ):
+        self.faction = faction
+        self.members = list( members )
+        self.formation = formation
+        self.spacing = spacing
+
+        self.path = []
+        self.heading = 0.
+        if( self.members ):
+            self.anchor = [ self.members[0].x, self.members[0].y ]
+        else:
+            self.anchor = [ 0., 0. ]
+
+        self._offsets = formationOffsets( formation, len( self.members ), spacing )
+
+    def setPath( self, path ):
+        """
+        Give the squad somewhere to go.
+
+        Args:
+            path (list): ( x, y ) waypoints, in tiles
+        """
+        self.path = list( path )
+
+    def setFormation( self, formation, spacing=None ):
+        """
+        Args:
+            formation (string): One of FORMATIONS
+            spacing (float): Tiles between slots, None to keep the current spacing
+        """
+        if( spacing is None ):
+            spacing = self.spacing
+        self._offsets = formationOffsets( formation, len( self.members ), spacing )
+        self.formation = formation
+        self.spacing = spacing
+
+    def speed( self ):
+        """
+        Returns:
+            float: Tiles per tick the squad can travel at, that of it's slowest member
+        """
+        if( not self.members ):
+            return 0.
+        return min( member.speed for member in self.members )
+
+    def advance( self, held ):
+        """
+        Move the anchor along the path.
+
+        Args:
+            held (bool): Stragglers are too far behind, wait for them
+        """
+        if( held or not self.path ):
+            return
+
+        step = self.speed()
+        while( self.path and step > 0. ):
+            tx, ty = self.path[0]
+            dx = tx - self.anchor[0]
+            dy = ty - self.anchor[1]
+            dist = math.hypot( dx, dy )
+            if( dist > 0. ):
+                self.heading = math.degrees( math.atan2( dx, -dy ) ) % 360.
+
+            if( dist <= step ):
+                self.anchor = [ tx, ty ]
+                self.path.pop( 0 )
+                step -= dist
+            else:
+                self.anchor[0] += dx / dist * step
+                self.anchor[1] += dy / dist * step
+                step = 0.
+
+    def slots( self ):
+        """
+        Returns:
+            list: ( x, y ) formation slot of each member, in tiles
+        """
+        rad = math.radians( self.heading )
+        fwd_x = math.sin( rad )
+        fwd_y = -math.cos( rad )
+        # right of forward is forward rotated 90 clockwise
+        rgt_x = -fwd_y
+        rgt_y = fwd_x
+        ax, ay = self.anchor
+
+        if( len( self._offsets ) != len( self.members ) ):
+            # Someone joined or died
+            self._offsets = formationOffsets( self.formation, len( self.members ), self.spacing )
+
+        return [ ( ax + rgt_x * right - fwd_x * back, ay + rgt_y * right - fwd_y * back )
+                 for right, back in self._offsets ]
+
+
+class SquadMover( object ):
+
+    """
+    Steps every squad's members in one pass.
+
+    Attributes:
+        SEEK (float): Weight of heading for the slot
+        SEPARATE (float): Weight of keeping clear of neighbours
+        COHERE (float): Weight of staying with the squad
+        HOLD (float): Slot error, in spacings, at which a squad waits for stragglers
+
+        field (Map): The map, for obstacle avoidance
+        occupancy (OccupancyManager): Told about moves, if given
+        squads (list): Squads being moved
+    """
+
+    SEEK     = 1.0
+    SEPARATE = 0.6
+    COHERE   = 0.1
+    HOLD     = 2.0
+
+    def __init__( self, field, occupancy=None ):
+        self.field = field
+        self.occupancy = occupancy
+        self.squads = []
+
+    def addSquad( self, squad ):
+        """
+        Args:
+            squad (Squad): Squad to move
+        """
+        if( squad not in self.squads ):
+            self.squads.append( squad )
+
+    def removeSquad( self, squad ):
+        """
+        Args:
+            squad (Squad): Squad to stop moving
+        """
+        if( squad in self.squads ):
+            self.squads.remove( squad )
+
+    def _passable( self, x, y ):
+        tile = self.field.accessXY( int( math.floor( x ) ), int( math.floor( y ) ) )
+        return ( tile is not None ) and tile.isPassable()
+
+    def tick( self ):
+        """
+        Move every squad one tick.
+
+        Returns:
+            int: Number of units moved
+        """
+        # Gather everyone into flat lists
+        ents = []
+        px = []
+        py = []
+        sx = []
+        sy = []
+        owner = []
+        centres = []
+        for s_idx, squad in enumerate( self.squads ):
+            if( not squad.members ):
+                centres.append( ( 0., 0. ) )
+                continue
+
+            slots = squad.slots()
+            err = sum( math.hypot( m.x - slot[0], m.y - slot[1] )
+                       for m, slot in zip( squad.members, slots ) ) / len( slots )
+            squad.advance( err > self.HOLD * squad.spacing )
+            slots = squad.slots()
+
+            cx = cy = 0.
+            for member, ( slot_x, slot_y ) in zip( squad.members, slots ):
+                ents.append( member )
+                px.append( member.x )
+                py.append( member.y )
+                sx.append( slot_x )
+                sy.append( slot_y )
+                owner.append( s_idx )
+                cx += member.x
+                cy += member.y
+            centres.append( ( cx / len( squad.members ), cy / len( squad.members ) ) )
+
+        if( not ents ):
+            return 0
+
+        # Cell buckets sized to the largest separation radius
+        radius = max( squad.spacing for squad in self.squads ) * 0.9
+        buckets = {}
+        for idx in range( len( ents ) ):
+            key = ( int( px[ idx ] // radius ), int( py[ idx ] // radius ) )
+            buckets.setdefault( key, [] ).append( idx )
+
+        # Work out everyone's step before moving anyone
+        rad_sq = radius * radius
+        nx = list( px )
+        ny = list( py )
+        for idx in range( len( ents ) ):
+            x = px[ idx ]
+            y = py[ idx ]
+            speed = ents[ idx ].speed
+            if( speed <= 0. ):
+                continue
+
+            # Seek the slot
+            vx = ( sx[ idx ] - x ) * self.SEEK
+            vy = ( sy[ idx ] - y ) * self.SEEK
+
+            # Separate from neighbours, friend or foe
+            bx = int( x // radius )
+            by = int( y // radius )
+            for oy in ( -1, 0, 1 ):
+                for ox in ( -1, 0, 1 ):
+                    for other in buckets.get( ( bx + ox, by + oy ), () ):
+                        if( other == idx ):
+                            continue
+                        dx = x - px[ other ]
+                        dy = y - py[ other ]
+                        d_sq = dx * dx + dy * dy
+                        if( d_sq >= rad_sq ):
+                            continue
+                        if( d_sq == 0. ):
+                            # Stacked, nudge apart deterministically
+                            dx = 0.01 * ( 1 if( idx < other ) else -1 )
+                            d_sq = dx * dx
+                        push = ( rad_sq - d_sq ) / rad_sq
+                        d = math.sqrt( d_sq )
+                        vx += dx / d * push * self.SEPARATE
+                        vy += dy / d * push * self.SEPARATE
+
+            # Cohere to the squad
+            cx, cy = centres[ owner[ idx ] ]
+            vx += ( cx - x ) * self.COHERE
+            vy += ( cy - y ) * self.COHERE
+
+            mag = math.hypot( vx, vy )
+            if( mag > speed ):
+                vx *= speed / mag
+                vy *= speed / mag
+
+            # Avoid obstacles, sliding along them if we can
+            if( self._passable( x + vx, y + vy ) ):
+                nx[ idx ] = x + vx
+                ny[ idx ] = y + vy
+            elif( self._passable( x + vx, y ) ):
+                nx[ idx ] = x + vx
+            elif( self._passable( x, y + vy ) ):
+                ny[ idx ] = y + vy
+
+        # Apply
+        moved = 0
+        for idx, ent in enumerate( ents ):
+            if( (nx[ idx ] == px[ idx ]) and (ny[ idx ] == py[ idx ]) ):
+                continue
+            ent.x = nx[ idx ]
+            ent.y = ny[ idx ]
+            moved += 1
+            if( self.occupancy is not None ):
+                self.occupancy.moved( ent )
+
+        return moved
@@ -0,0 +1,305 @@
+# strategy - run the Faction 'AI' off the simulation thread
+#
+# Planning is potentially expensive, and must not stall the tick.  The AI factions think
+# in worker processes, so they don't hold the simulation up fighting it for the GIL,
+# against a read-only snapshot of the world made of plain data, and their FRAGOs are
+# applied at a fixed number of ticks after the snapshot was taken, always, so the result
+# doesn't depend on how fast the workers were.  Planners get a budget of steps rather
+# than seconds, for the same reason.
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from itertools import islice
+import logging
+
+from mapping import LYR_TERRAIN, LYR_HEAT, LYR_SHROOMS
+from savegame import LayerMirror
+
+
+log = logging.getLogger( __name__ )
+
+# Faction attrs the planner gets, it's a fresh copy of the faction in the worker.  The
+# faction's PLANNER_STATE is copied too, and back again with the orders
+PLANNER_ATTRS = ( "tech_level", "is_ai", "ai_budget" )
+
+
+class WorldSnapshot( object ):
+
+    """
+    A read-only picture of the battlefield at a given tick.  Layers are flat arrays in
+    ravel order, ( x + y * dim_x ).
+
+    Attributes:
+        dim_x (int): Map Dimention X
+        dim_y (int): Map Dimention Y
+        forces (dict): Faction name to tuple of ( id, class name, x, y, hit_points )
+        heat (array): Heat of every tile
+        shrooms (array): Shrooms on every tile
+        terrain (bytes): Terrain type of every tile
+        tick (int): Game tick the snapshot was taken on
+        treasury (dict): Faction name to ( money, power )
+    """
+
+    def __init__( self, tick ):
+        self.tick = tick
+
+        self.dim_x = 0
+        self.dim_y = 0
+        self.terrain = b""
+        self.shrooms = array( "i" )
+        self.heat = array( "i" )
+
+        self.forces = {}
+        self.treasury = {}
+
+    @classmethod
+    def capture( cls, mission, mirror=None ):
+        """
+        Copy what the AI needs to know out of the live mission.
+
+        Args:
+            mission (Mission): The mission to photograph
+            mirror (LayerMirror): Up to date copy of the map layers, makes this quick
+
+        Returns:
+            WorldSnapshot: The picture
+        """
+        snap = cls( mission.clock.now )
+
+        field = mission.field
+        if( field is not None ):
+            if( mirror is None ):
+                mirror = LayerMirror( field )
+                mirror.close()
+
+            snap.dim_x = field.dim_x
+            snap.dim_y = field.dim_y
+            snap.terrain = mirror.layers[ LYR_TERRAIN ].tobytes()
+            snap.shrooms = mirror.layers[ LYR_SHROOMS ][:]
+            snap.heat = mirror.layers[ LYR_HEAT ][:]
+
+        for faction in mission.factions:
+            snap.treasury[ faction.name ] = ( faction.money, faction.power )
+            snap.forces[ faction.name ] = tuple(
+                ( ent.id, type( ent ).__name__, ent.x, ent.y, ent.hit_points )
+                for ent in faction.buildings + faction.units
+            )
+
+        return snap
+
+    def accessXY( self, layer, x, y ):
+        """
+        Read a value from one of the snapshot's layers.
+
+        Args:
+            layer (sequence): One of terrain, shrooms, heat
+            x (int): X coord
+            y (int): Y coord
+
+        Returns:
+            int: value, or None if off the map
+        """
+        if( (x >= self.dim_x) or (x < 0) or
+            (y >= self.dim_y) or (y < 0) ):
+            return None
+        return layer[ x + y * self.dim_x ]
+
+
+def _prosecute( faction_cls, name, state, snapshot ):
+    """
+    Plan for a faction, in a worker process.  The planner is stopped after ai_budget
+    steps.
+
+    Args:
+        faction_cls (class): The faction's class
+        name (string): Faction name
+        state (dict): PLANNER_ATTRS and PLANNER_STATE of the faction
+        snapshot (WorldSnapshot): The battlefield
+
+    Returns:
+        tuple: ( list of ( entity id, Frago ) orders, { PLANNER_STATE attr: value } )
+    """
+    planner = faction_cls( name )
+    for attr, val in state.items():
+        setattr( planner, attr, val )
+
+    orders = []
+    plan = planner.prosecute( snapshot )
+    try:
+        for decided in islice( plan, planner.ai_budget ):
+            orders.extend( decided or () )
+    finally:
+        plan.close()
+
+    return ( orders, { attr: getattr( planner, attr ) for attr in planner.PLANNER_STATE } )
+
+
+class StrategyPool( object ):
+
+    """
+    Runs Faction.prosecute for every AI faction in a pool of worker processes.  The
+    planner is a copy of the faction made in the worker from it's class, name,
+    PLANNER_ATTRS and PLANNER_STATE, so the class must be importable, the state must
+    pickle, and everything else it plans from must come from the snapshot.  The
+    planner's PLANNER_STATE is written back to the faction when it's orders are
+    applied.
+
+    Every _interval_ ticks a snapshot is taken and each AI faction starts planning
+    against it.  The orders it returns are applied _latency_ ticks later, in the order
+    the factions appear in mission.factions.
+
+    Whether a plan is used is decided in ticks, never by how long it took.  Planners
+    are stopped after their ai_budget steps, and if a plan hasn't arrived by it's due
+    tick the clock waits for it, which only happens when the game is running much
+    faster than real time.  A faction sits out decisions that come round before it's
+    last plan was applied, ie. when _latency_ isn't less than _interval_.
+
+    A step that never ends can't be stopped by counting, so _timeout_ limits the wait.
+    A plan that runs over it is abandoned, which does depend on timing, and the workers
+    are replaced so it doesn't hold one up forever.  The other plans in progress are
+    started again on the new workers.  Workers can only be replaced in the pool's own
+    executor, not one passed in.
+
+    Attributes:
+        abandoned (dict): Faction name to count of plans that failed or timed out
+        interval (int): Ticks between decisions
+        latency (int): Ticks between the snapshot and the orders being applied
+        mission (Mission): The mission being fought
+        replaced (int): Times the workers were replaced, for a plan that ran over the timeout
+        skipped (dict): Faction name to count of decisions missed while still thinking
+        timeout (float): Seconds to wait for a late plan on it's due tick
+    """
+
+    def __init__( self, mission, workers=2, interval=15, latency=5, timeout=1.0, executor=None ):
+        self.mission = mission
+        self.interval = interval
+        self.latency = latency
+        self.timeout = timeout
+
+        self._workers = workers
+        self._own_executor = executor is None
+        if( executor is None ):
+            executor = ProcessPoolExecutor( max_workers=workers )
+        self._executor = executor
+
+        self._mirror = None
+        if( mission.field is not None ):
+            self._mirror = LayerMirror( mission.field )
+
+        # faction name -> issue tick of the plan waiting to be applied
+        self._thinking = {}
+        # ( faction name, issue tick ) -> ( Future of the plan, _prosecute args )
+        self._plans = {}
+
+        self.abandoned = {}
+        self.skipped = {}
+        self.replaced = 0
+
+        self._handle = None
+
+    def start( self ):
+        """
+        Start making decisions, on the next tick that's a multiple of the interval.
+        """
+        now = self.mission.clock.now
+        first = now + self.interval - ( now % self.interval )
+        self._handle = self.mission.clock.schedule( first, self.decide )
+
+    def stop( self ):
+        """
+        Stop making decisions, and let the workers wind down.
+        """
+        if( self._handle is not None ):
+            self.mission.clock.cancel( self._handle )
+            self._handle = None
+        self._executor.shutdown( wait=False, cancel_futures=True )
+        if( self._mirror is not None ):
+            self._mirror.close()
+            self._mirror = None
+
+    def decide( self ):
+        """
+        Snapshot the world and set the AI factions thinking.  Runs on the clock.
+        """
+        clock = self.mission.clock
+        tick = clock.now
+        self._handle = clock.schedule( tick + self.interval, self.decide )
+
+        snapshot = WorldSnapshot.capture( self.mission, self._mirror )
+
+        for faction in self.mission.factions:
+            if( not faction.is_ai ):
+                continue
+
+            if( faction.name in self._thinking ):
+                self.skipped[ faction.name ] = self.skipped.get( faction.name, 0 ) + 1
+                continue
+
+            self._thinking[ faction.name ] = tick
+            state = { attr: getattr( faction, attr ) for attr in PLANNER_ATTRS + faction.PLANNER_STATE }
+            args = ( type( faction ), faction.name, state, snapshot )
+            self._plans[ ( faction.name, tick ) ] = ( self._executor.submit( _prosecute, *args ), args )
+            clock.schedule( tick + self.latency, self._apply, faction, tick )
+
+    def _apply( self, faction, issued ):
+        """
+        Issue the FRAGOs a faction planned at _issued_.  Runs on the clock.
+
+        Args:
+            faction (Faction): The planner
+            issued (int): Tick the plan was started
+        """
+        future, _ = self._plans.pop( ( faction.name, issued ) )
+        if( self._thinking.get( faction.name ) == issued ):
+            del self._thinking[ faction.name ]
+
+        try:
+            orders, state = future.result( timeout=self.timeout )
+        except TimeoutError:
+            # Stuck, the world has moved on
+            log.warning( "Faction '%s' plan from tick %d timed out", faction.name, issued )
+            self.abandoned[ faction.name ] = self.abandoned.get( faction.name, 0 ) + 1
+            if( not future.cancel() ):
+                self._replaceWorkers()
+            return
+        except Exception:
+            # A broken planner loses it's orders, not the game
+            log.exception( "Faction '%s' plan from tick %d failed", faction.name, issued )
+            self.abandoned[ faction.name ] = self.abandoned.get( faction.name, 0 ) + 1
+            return
+
+        for attr, val in state.items():
+            setattr( faction, attr, val )
+
+        if( not orders ):
+            return
+
+        lut = faction.entityLUT()
+        for ent_id, frago in orders:
+            ent = lut.get( ent_id )
+            if( ent is not None ):
+                # Units that died since the snapshot don't get orders
+                ent.frago( frago )
+
+    def _replaceWorkers( self ):
+        """
+        Kill the workers, one is stuck on a plan, and start the plans still in progress
+        again on new ones.
+        """
+        if( not self._own_executor ):
+            return
+
+        old = self._executor
+        unfinished = [ key for key, ( future, _ ) in self._plans.items() if( not future.done() ) ]
+
+        # A process pool can't stop one task, and has no public way to stop it's
+        # processes, so kill the lot
+        for proc in list( ( old._processes or {} ).values() ):
+            proc.terminate()
+        old.shutdown( wait=False, cancel_futures=True )
+
+        self._executor = ProcessPoolExecutor( max_workers=self._workers )
+        for key in unfinished:
+            args = self._plans[ key ][1]
+            self._plans[ key ] = ( self._executor.submit( _prosecute, *args ), args )
+        self.replaced += 1
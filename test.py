@@ -1,33 +1,23 @@
 # Test the game
 
 from mission import Mission
-import mapping as maps
+from render import TerminalView, RadarView, CSI
 
 
 from pprint import pprint
 from time import sleep
 
-TRN_TPY = {
-    maps.TRN_WATER   : "w",
-    maps.TRN_LAND    : "l",
-    maps.TRN_IMPASS  : "x",
-    maps.TRN_LIMINAL : "s",
-    
-}
-
-def dump_shrooms( field ):
-    data = ""
-    for row in field.grid:
-        for tile in row:
-            data += "{}{: >2} ".format( TRN_TPY[tile.terrain], tile.shrooms )
-        data += "\n"
-    data += "\n"
-
-    print( data )
-    
 my_mission = Mission( "test_map.json" )
+field = my_mission.field
+
+# Clear the screen, radar to the right of the map
+print( CSI + "2J", end="" )
+view = TerminalView( field )
+radar = RadarView( field, scale=4, origin=( 1, field.dim_x * view.cell_w + 3 ) )
 
 for i in range( 20 ):
-    dump_shrooms( my_mission.field )
-    my_mission.field.growShrooms()
+    view.draw()
+    radar.draw()
+    field.growShrooms()
+    my_mission.tick()
     sleep( 0.5 )
@@ -0,0 +1,321 @@
+# worldstate - publish the live map and entities in shared memory
+#
+# The renderer, spectator feed, and analytics run in their own processes and want to see
+# the world every frame.  The simulation copies the tile layers and an array per entity
+# attribute into a shared memory block each tick, and readers look straight at it, no
+# pickling and no copies.
+#
+# There are two buffers.  The simulation only ever writes the one readers aren't being
+# pointed at, then flips them over.  Each buffer has a sequence number that is odd while
+# it's being written (a seqlock), so a reader that was slow enough to still be looking
+# at a buffer when it's rewritten can tell, and look again.  The simulation never waits
+# for a reader.
+
+from array import array
+from multiprocessing import shared_memory, resource_tracker
+import struct
+import sys
+
+from mapping import LYR_TERRAIN, LYR_OCCUPANCY, LYR_HEAT, LYR_SHROOMS
+from savegame import LayerMirror
+
+
+WORLD_MAGIC   = b"BRWNWRLD"
+WORLD_VERSION = 1
+
+# magic, version, front buffer, dim_x, dim_y, max entities
+HEADER = struct.Struct( "<8sHHIII" )
+FRONT = struct.Struct( "<H" )
+FRONT_OFFSET = 10
+# sequence, tick, entity count
+BUF_HEADER = struct.Struct( "<QQI4x" )
+
+# Published tile layers, in buffer order
+LAYERS = (
+    ( LYR_TERRAIN,   "B" ),
+    ( LYR_OCCUPANCY, "B" ),
+    ( LYR_HEAT,      "i" ),
+    ( LYR_SHROOMS,   "i" ),
+    ( "move_limit",  "i" ),
+)
+
+# Published entity attributes, in buffer order.  faction is the index in mission.factions
+ENTITY_FIELDS = (
+    ( "id",         "i" ),
+    ( "faction",    "i" ),
+    ( "x",          "f" ),
+    ( "y",          "f" ),
+    ( "hit_points", "i" ),
+)
+
+
+def _align( size ):
+    return ( size + 7 ) & ~7
+
+
+def _layout( dim_x, dim_y, max_entities ):
+    """
+    Where everything goes in a buffer.
+
+    Returns:
+        tuple: ( buffer size, { name: ( offset, typecode, length ) } )
+    """
+    area = dim_x * dim_y
+    places = {}
+    offset = BUF_HEADER.size
+    for name, typecode in LAYERS:
+        places[ name ] = ( offset, typecode, area )
+        offset += _align( area * array( typecode ).itemsize )
+    for name, typecode in ENTITY_FIELDS:
+        places[ "ent_" + name ] = ( offset, typecode, max_entities )
+        offset += _align( max_entities * array( typecode ).itemsize )
+
+    return ( offset, places )
+
+
+class WorldPublisher( object ):
+
+    """
+    Copies the mission's state into shared memory for other processes to read.
+
+    Attributes:
+        max_entities (int): Entity slots, entities past this aren't published
+        mission (Mission): The mission
+        name (string): Shared memory name, give it to the WorldReaders
+        published (int): Frames published
+        truncated (int): Entities left out of the last frame, for want of slots
+    """
+
+    def __init__( self, mission, name=None, max_entities=4096 ):
+        self.mission = mission
+        self.max_entities = max_entities
+        self.published = 0
+        self.truncated = 0
+
+        field = mission.field
+        self._buf_size, self._places = _layout( field.dim_x, field.dim_y, max_entities )
+        self._shm = shared_memory.SharedMemory( name=name, create=True,
+                                                size=HEADER.size + 2 * self._buf_size )
+        self.name = self._shm.name
+
+        self._front = 0
+        HEADER.pack_into( self._shm.buf, 0, WORLD_MAGIC, WORLD_VERSION, self._front,
+                          field.dim_x, field.dim_y, max_entities )
+        for idx in ( 0, 1 ):
+            BUF_HEADER.pack_into( self._shm.buf, self._bufOffset( idx ), 0, 0, 0 )
+
+        self._mirror = LayerMirror( field )
+        self._handle = None
+
+        self.publish()
+
+    def _bufOffset( self, idx ):
+        return HEADER.size + idx * self._buf_size
+
+    def publish( self ):
+        """
+        Write the world as it is now into the back buffer, and make it the front.
+        """
+        back = 1 - self._front
+        base = self._bufOffset( back )
+        buf = self._shm.buf
+
+        seq = BUF_HEADER.unpack_from( buf, base )[0]
+        BUF_HEADER.pack_into( buf, base, seq + 1, 0, 0 )
+
+        for name, _ in LAYERS:
+            offset = self._places[ name ][0]
+            raw = memoryview( self._mirror.layers[ name ] ).cast( "B" )
+            buf[ base + offset:base + offset + len( raw ) ] = raw
+
+        count = self._writeEntities( buf, base )
+
+        BUF_HEADER.pack_into( buf, base, seq + 2, self.mission.clock.now, count )
+        self._front = back
+        FRONT.pack_into( buf, FRONT_OFFSET, back )
+        self.published += 1
+
+    def _writeEntities( self, buf, base ):
+        columns = { name: array( typecode ) for name, typecode in ENTITY_FIELDS }
+        total = 0
+        for f_idx, faction in enumerate( self.mission.factions ):
+            for ent in faction.buildings + faction.units:
+                total += 1
+                if( total > self.max_entities ):
+                    continue
+                columns[ "id" ].append( ent.id )
+                columns[ "faction" ].append( f_idx )
+                columns[ "x" ].append( ent.x )
+                columns[ "y" ].append( ent.y )
+                columns[ "hit_points" ].append( ent.hit_points )
+
+        count = min( total, self.max_entities )
+        self.truncated = total - count
+        for name, _ in ENTITY_FIELDS:
+            offset = self._places[ "ent_" + name ][0]
+            raw = memoryview( columns[ name ] ).cast( "B" )
+            buf[ base + offset:base + offset + len( raw ) ] = raw
+
+        return count
+
+    def start( self, clock, interval=1 ):
+        """
+        Publish every _interval_ ticks of the clock.
+
+        Args:
+            clock (Clock): The mission clock
+            interval (int): Ticks between frames
+        """
+        self._handle = clock.scheduleIn( interval, self._tick, clock, interval )
+
+    def stop( self, clock ):
+        """
+        Stop publishing on the clock.
+
+        Args:
+            clock (Clock): The mission clock
+        """
+        if( self._handle is not None ):
+            clock.cancel( self._handle )
+            self._handle = None
+
+    def _tick( self, clock, interval ):
+        self.publish()
+        self._handle = clock.scheduleIn( interval, self._tick, clock, interval )
+
+    def close( self ):
+        """
+        Stop watching the map, and remove the shared memory.  Readers that are still
+        attached keep their mapping until they close.
+        """
+        self._mirror.close()
+        self._shm.close()
+        self._shm.unlink()
+
+
+class Frame( object ):
+
+    """
+    One published tick, as views straight onto the shared memory.  Use what you need,
+    then check valid(), if the simulation has since rewritten the buffer what you read
+    may be torn and you should get a new frame.
+
+    Attributes:
+        count (int): Entities in the frame
+        entities (dict): ENTITY_FIELDS name -> memoryview, _count_ long
+        layers (dict): Layer name -> memoryview in ravel order
+        tick (int): Game tick of the frame
+    """
+
+    def __init__( self, reader, idx ):
+        self._reader = reader
+        buf = reader._shm.buf
+        base = reader._bufOffset( idx )
+        self._base = base
+
+        self._seq, self.tick, self.count = BUF_HEADER.unpack_from( buf, base )
+
+        self.layers = {}
+        for name, _ in LAYERS:
+            self.layers[ name ] = self._view( buf, reader._places[ name ] )
+        self.entities = {}
+        for name, _ in ENTITY_FIELDS:
+            self.entities[ name ] = self._view( buf, reader._places[ "ent_" + name ] )[ :self.count ]
+
+    def _view( self, buf, place ):
+        offset, typecode, length = place
+        start = self._base + offset
+        return buf[ start:start + length * array( typecode ).itemsize ].cast( typecode )
+
+    def valid( self ):
+        """
+        Returns:
+            bool: The buffer hasn't been touched since the frame was taken
+        """
+        return ( self._seq & 1 == 0 ) and ( BUF_HEADER.unpack_from( self._reader._shm.buf, self._base )[0] == self._seq )
+
+    def release( self ):
+        """
+        Let go of the views, the reader can't close while frames hold them.
+        """
+        for views in ( self.layers, self.entities ):
+            for view in views.values():
+                view.release()
+        self.layers = {}
+        self.entities = {}
+
+
+class WorldReader( object ):
+
+    """
+    Attaches to a WorldPublisher's shared memory, from any process.  Pass
+    standalone=False from a process the publishing process started, as they share a
+    resource tracker.
+
+    Attributes:
+        dim_x (int): Map Dimention X
+        dim_y (int): Map Dimention Y
+        max_entities (int): Entity slots
+    """
+
+    def __init__( self, name, standalone=True ):
+        self._shm = shared_memory.SharedMemory( name=name )
+        if( standalone and (sys.version_info < ( 3, 13 )) ):
+            # Before 3.13 attaching also registers the block for removal when we exit,
+            # it's the publisher's to remove
+            resource_tracker.unregister( self._shm._name, "shared_memory" )
+
+        magic, version, _, self.dim_x, self.dim_y, self.max_entities = HEADER.unpack_from( self._shm.buf, 0 )
+        if( magic != WORLD_MAGIC ):
+            self._shm.close()
+            raise ValueError( "'{}' is not a published world".format( name ) )
+        if( version != WORLD_VERSION ):
+            self._shm.close()
+            raise ValueError( "'{}' is world version {}, expected {}".format( name, version, WORLD_VERSION ) )
+
+        self._buf_size, self._places = _layout( self.dim_x, self.dim_y, self.max_entities )
+
+    def _bufOffset( self, idx ):
+        return HEADER.size + idx * self._buf_size
+
+    def frame( self ):
+        """
+        The latest published frame.
+
+        Returns:
+            Frame: Views of the front buffer
+        """
+        while( True ):
+            front = FRONT.unpack_from( self._shm.buf, FRONT_OFFSET )[0]
+            frame = Frame( self, front )
+            if( frame._seq & 1 == 0 ):
+                return frame
+            # Flipped while we looked, the other one is the front now
+            frame.release()
+
+    def read( self, callback ):
+        """
+        Run _callback_ on the latest frame, again on a newer one if the frame was
+        rewritten under it.  Whatever the callback keeps must be copied out, the
+        frame's views are released afterwards.
+
+        Args:
+            callback (callable): Given the Frame
+
+        Returns:
+            The callback's result, from a consistent frame
+        """
+        while( True ):
+            frame = self.frame()
+            try:
+                result = callback( frame )
+                if( frame.valid() ):
+                    return result
+            finally:
+                frame.release()
+
+    def close( self ):
+        """
+        Detach from the shared memory.  Release any frames first.
+        """
+        self._shm.close()